@@ -615,11 +615,31 @@ class Status(SingleBugFeature):
 
 def get_author_ids():
     author_ids = set()
-    for commit in repository.get_commits():
+    for commit in repository.get_commits(columns=["author_email"]):
         author_ids.add(commit["author_email"])
     return author_ids
 
 
+# Number of items sent at once to the feature extraction worker processes.
+EXTRACTION_CHUNK_SIZE = 1024
+
+extraction_worker_extractor = None
+extraction_worker_author_ids = None
+
+
+def _init_extraction_worker(extractor, author_ids):
+    global extraction_worker_extractor, extraction_worker_author_ids
+    extraction_worker_extractor = extractor
+    extraction_worker_author_ids = author_ids
+
+
+def _extract_bug(item):
+    bug, reporter_experience = item
+    return extraction_worker_extractor.extract(
+        bug, reporter_experience, extraction_worker_author_ids
+    )
+
+
 class BugExtractor(BaseEstimator, TransformerMixin):
     def __init__(
         self,
@@ -629,6 +649,7 @@ class BugExtractor(BaseEstimator, TransformerMixin):
         rollback_when=None,
         commit_data=False,
         merge_data=True,
+        n_jobs=None,
     ):
         assert len(set(type(fe) for fe in feature_extractors)) == len(
             feature_extractors
@@ -643,6 +664,7 @@ class BugExtractor(BaseEstimator, TransformerMixin):
         self.rollback_when = rollback_when
         self.commit_data = commit_data
         self.merge_data = merge_data
+        self.n_jobs = n_jobs
 
     def fit(self, x, y=None):
         for feature in self.feature_extractors:
@@ -651,51 +673,54 @@ class BugExtractor(BaseEstimator, TransformerMixin):
 
         return self
 
-    def transform(self, bugs):
-        bugs_iter = iter(bugs())
+    def get_dependent_dbs(self) -> list[str]:
+        """Return the DBs, besides the one of the bugs, read during extraction."""
+        return [repository.COMMITS_DB] if self.commit_data else []
 
-        reporter_experience_map = defaultdict(int)
-        author_ids = get_author_ids() if self.commit_data else None
+    def extract(self, bug, reporter_experience, author_ids):
+        data = {}
 
-        def apply_transform(bug):
-            data = {}
+        for feature_extractor in self.feature_extractors:
+            res = feature_extractor(
+                bug,
+                reporter_experience=reporter_experience,
+                author_ids=author_ids,
+            )
 
-            for feature_extractor in self.feature_extractors:
-                res = feature_extractor(
-                    bug,
-                    reporter_experience=reporter_experience_map[bug["creator"]],
-                    author_ids=author_ids,
-                )
+            if hasattr(feature_extractor, "name"):
+                feature_extractor_name = feature_extractor.name
+            else:
+                feature_extractor_name = feature_extractor.__class__.__name__
 
-                if hasattr(feature_extractor, "name"):
-                    feature_extractor_name = feature_extractor.name
-                else:
-                    feature_extractor_name = feature_extractor.__class__.__name__
+            if res is None:
+                continue
 
-                if res is None:
-                    continue
+            if isinstance(res, (list, set)):
+                for item in res:
+                    data[sys.intern(f"{item} in {feature_extractor_name}")] = True
+                continue
 
-                if isinstance(res, (list, set)):
-                    for item in res:
-                        data[sys.intern(f"{item} in {feature_extractor_name}")] = True
-                    continue
+            data[feature_extractor_name] = res
 
-                data[feature_extractor_name] = res
+        summary = bug["summary"]
+        comments = [c["text"] for c in bug["comments"]]
+        for cleanup_function in self.cleanup_functions:
+            summary = cleanup_function(summary)
+            comments = [cleanup_function(comment) for comment in comments]
 
-            reporter_experience_map[bug["creator"]] += 1
+        return {
+            "data": data,
+            "title": summary,
+            "first_comment": "" if len(comments) == 0 else comments[0],
+            "comments": " ".join(comments),
+        }
 
-            summary = bug["summary"]
-            comments = [c["text"] for c in bug["comments"]]
-            for cleanup_function in self.cleanup_functions:
-                summary = cleanup_function(summary)
-                comments = [cleanup_function(comment) for comment in comments]
+    def extract_all(self, bugs):
+        """Extract the features of the bugs lazily, in the order of the bugs."""
+        bugs_iter = iter(bugs())
 
-            return {
-                "data": data,
-                "title": summary,
-                "first_comment": "" if len(comments) == 0 else comments[0],
-                "comments": " ".join(comments),
-            }
+        reporter_experience_map = defaultdict(int)
+        author_ids = get_author_ids() if self.commit_data else None
 
         def apply_rollback(bugs_iter):
             with Pool() as p:
@@ -708,7 +733,31 @@ class BugExtractor(BaseEstimator, TransformerMixin):
         if self.rollback:
             bugs_iter = apply_rollback(bugs_iter)
 
-        return pd.DataFrame(apply_transform(bug) for bug in bugs_iter)
+        # The reporter experience depends on the order of the bugs, so it is
+        # calculated here and not in the worker processes.
+        def with_reporter_experience(bugs_iter):
+            for bug in bugs_iter:
+                yield bug, reporter_experience_map[bug["creator"]]
+                reporter_experience_map[bug["creator"]] += 1
+
+        items = with_reporter_experience(bugs_iter)
+
+        # Models trained before n_jobs was introduced don't have the attribute.
+        n_jobs = utils.get_n_jobs(getattr(self, "n_jobs", None))
+        if n_jobs == 1:
+            for bug, reporter_experience in items:
+                yield self.extract(bug, reporter_experience, author_ids)
+            return
+
+        with Pool(
+            n_jobs,
+            initializer=_init_extraction_worker,
+            initargs=(self, author_ids),
+        ) as p:
+            yield from p.imap(_extract_bug, items, chunksize=EXTRACTION_CHUNK_SIZE)
+
+    def transform(self, bugs):
+        return pd.DataFrame(self.extract_all(bugs))
 
 
 class IsPerformanceBug(SingleBugFeature):
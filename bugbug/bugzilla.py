@@ -7,6 +7,7 @@ import collections
 import csv
 import math
 import re
+from contextlib import contextmanager
 from datetime import datetime
 from logging import INFO, basicConfig, getLogger
 from typing import Iterable, Iterator, NewType
@@ -31,6 +32,8 @@ db.register(
     BUGS_DB,
     "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_bugs.latest/artifacts/public/bugs.json.zst",
     10,
+    index_keys=["id"],
+    log_structured=True,
 )
 
 PRODUCTS = (
@@ -102,20 +105,30 @@ MAINTENANCE_EFFECTIVENESS_SEVERITY_DEFAULT_WEIGHT = 3
 INCLUDE_FIELDS = ["_default", "filed_via"]
 
 
+def is_included(
+    bug: BugDict,
+    include_invalid: bool | None = False,
+    include_additional_products: tuple[str, ...] = (),
+) -> bool:
+    """Whether a bug is one of the bugs returned by `get_bugs`."""
+    return bug["product"] in PRODUCTS + include_additional_products and (
+        bool(include_invalid) or bug["product"] != "Invalid Bugs"
+    )
+
+
 def get_bugs(
     include_invalid: bool | None = False,
     include_additional_products: tuple[str, ...] = (),
+    columns: list[str] | None = None,
 ) -> Iterator[BugDict]:
-    products = (
-        PRODUCTS + include_additional_products
-        if include_additional_products
-        else PRODUCTS
-    )
+    if columns is not None:
+        # The product is always needed for filtering.
+        columns = list(set(columns) | {"product"})
+
     yield from (
         bug
-        for bug in db.read(BUGS_DB)
-        if bug["product"] in products
-        and (include_invalid or bug["product"] != "Invalid Bugs")
+        for bug in db.read(BUGS_DB, columns=columns)
+        if is_included(bug, include_invalid, include_additional_products)
     )
 
 
@@ -123,23 +136,47 @@ def set_token(token):
     Bugzilla.TOKEN = token
 
 
-def get_ids(params):
-    assert "include_fields" not in params or params["include_fields"] == "id"
+# The chunk sizes set by the chunk_size context managers which are active.
+chunk_size_overrides: list[int] = []
+default_chunk_size = Bugzilla.BUGZILLA_CHUNK_SIZE
+
+
+@contextmanager
+def chunk_size(size: int) -> Iterator[None]:
+    """Set the number of bugs fetched per request by libmozdata in a block.
 
-    old_CHUNK_SIZE = Bugzilla.BUGZILLA_CHUNK_SIZE
+    libmozdata only supports a process-wide chunk size, so the default one is
+    only restored when no block which sets it is active anymore, e.g. in
+    concurrent requests.
+    """
+    global default_chunk_size
+
+    if not chunk_size_overrides:
+        default_chunk_size = Bugzilla.BUGZILLA_CHUNK_SIZE
+
+    chunk_size_overrides.append(size)
+    Bugzilla.BUGZILLA_CHUNK_SIZE = size
     try:
-        Bugzilla.BUGZILLA_CHUNK_SIZE = 7000
+        yield
+    finally:
+        chunk_size_overrides.remove(size)
+        Bugzilla.BUGZILLA_CHUNK_SIZE = (
+            chunk_size_overrides[-1] if chunk_size_overrides else default_chunk_size
+        )
 
-        all_ids = []
 
-        def bughandler(bug):
-            all_ids.append(bug["id"])
+def get_ids(params):
+    assert "include_fields" not in params or params["include_fields"] == "id"
+
+    all_ids = []
 
-        params["include_fields"] = "id"
+    def bughandler(bug):
+        all_ids.append(bug["id"])
 
+    params["include_fields"] = "id"
+
+    with chunk_size(7000):
         Bugzilla(params, bughandler=bughandler).get_data().wait()
-    finally:
-        Bugzilla.BUGZILLA_CHUNK_SIZE = old_CHUNK_SIZE
 
     return all_ids
 
@@ -18,7 +18,7 @@ logger = logging.getLogger("function_search_parser")
 
 
 def search(repo_dir, commit_hash, symbol_name):
-    code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer()
+    code_analysis_server = rust_code_analysis_server.get_server()
 
     found_functions = []
 
@@ -48,6 +48,7 @@ def search(repo_dir, commit_hash, symbol_name):
 
     lines = [line for line in result.stdout.decode().split("\n") if line]
 
+    sources = {}
     for path_rev in lines:
         path = path_rev.split(":")[0]
 
@@ -64,9 +65,11 @@ def search(repo_dir, commit_hash, symbol_name):
             )
             raise
 
-        source = result.stdout
+        sources[path] = result.stdout
 
-        metrics = code_analysis_server.metrics(path, source, unit=False)
+    all_metrics = code_analysis_server.metrics_batch(sources.items(), unit=False)
+
+    for (path, source), metrics in zip(sources.items(), all_metrics):
         if "spaces" not in metrics:
             continue
 
@@ -87,13 +90,11 @@ def search(repo_dir, commit_hash, symbol_name):
                     )
                 )
 
-    code_analysis_server.terminate()
-
     return found_functions
 
 
 def find_functions_for_lines(get_file, commit_hash, path, deleted_lines, added_lines):
-    code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer()
+    code_analysis_server = rust_code_analysis_server.get_server()
 
     source = get_file(commit_hash, path)
     metrics = code_analysis_server.metrics(path, source, unit=False)
@@ -103,8 +104,6 @@ def find_functions_for_lines(get_file, commit_hash, path, deleted_lines, added_l
         metrics["spaces"], deleted_lines, added_lines
     )
 
-    code_analysis_server.terminate()
-
     results = []
     for function in functions:
         results.append(
@@ -3,12 +3,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 import sys
+from multiprocessing.pool import Pool
 from typing import Sequence
 
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
 
-from bugbug import repository
+from bugbug import repository, utils
 
 EXPERIENCE_TIMESPAN = 90
 EXPERIENCE_TIMESPAN_TEXT = f"{EXPERIENCE_TIMESPAN}_days"
@@ -963,8 +964,23 @@ def merge_commits(commits: Sequence[repository.CommitDict]) -> repository.Commit
     )
 
 
+# Number of items sent at once to the feature extraction worker processes.
+EXTRACTION_CHUNK_SIZE = 1024
+
+extraction_worker_extractor = None
+
+
+def _init_extraction_worker(extractor):
+    global extraction_worker_extractor
+    extraction_worker_extractor = extractor
+
+
+def _extract_commit(commit):
+    return extraction_worker_extractor.extract(commit)
+
+
 class CommitExtractor(BaseEstimator, TransformerMixin):
-    def __init__(self, feature_extractors, cleanup_functions):
+    def __init__(self, feature_extractors, cleanup_functions, n_jobs=None):
         assert len(set(type(fe) for fe in feature_extractors)) == len(
             feature_extractors
         ), "Duplicate Feature Extractors"
@@ -974,6 +990,7 @@ class CommitExtractor(BaseEstimator, TransformerMixin):
             cleanup_functions
         ), "Duplicate Cleanup Functions"
         self.cleanup_functions = cleanup_functions
+        self.n_jobs = n_jobs
 
     def fit(self, x, y=None):
         for feature in self.feature_extractors:
@@ -982,55 +999,67 @@ class CommitExtractor(BaseEstimator, TransformerMixin):
 
         return self
 
-    def transform(self, commits):
-        results = []
-
-        for commit in commits():
-            data = {}
-            result = {"data": data}
-
-            for feature_extractor in self.feature_extractors:
-                if "bug_features" in feature_extractor.__module__:
-                    if not commit["bug"]:
-                        continue
-
-                    res = feature_extractor(commit["bug"])
-                elif "test_scheduling_features" in feature_extractor.__module__:
-                    res = feature_extractor(commit["test_job"], commit=commit)
-                else:
-                    res = feature_extractor(commit)
+    def extract(self, commit):
+        data = {}
+        result = {"data": data}
 
-                if res is None:
+        for feature_extractor in self.feature_extractors:
+            if "bug_features" in feature_extractor.__module__:
+                if not commit["bug"]:
                     continue
 
-                if hasattr(feature_extractor, "name"):
-                    feature_extractor_name = feature_extractor.name
-                else:
-                    feature_extractor_name = feature_extractor.__class__.__name__
-
-                # FIXME: This is a workaround to pass the value to the
-                # union transformer independently. This will be dropped when we
-                # resolve https://github.com/mozilla/bugbug/issues/3876
-                if isinstance(feature_extractor, Files):
-                    result[sys.intern(feature_extractor_name)] = res
-                    continue
-
-                if isinstance(res, dict):
-                    for key, value in res.items():
-                        data[sys.intern(key)] = value
-                    continue
-
-                if isinstance(res, list):
-                    for item in res:
-                        data[sys.intern(f"{item} in {feature_extractor_name}")] = True
-                    continue
-
-                data[sys.intern(feature_extractor_name)] = res
-
-            if "desc" in commit:
-                for cleanup_function in self.cleanup_functions:
-                    result["desc"] = cleanup_function(commit["desc"])
-
-            results.append(result)
+                res = feature_extractor(commit["bug"])
+            elif "test_scheduling_features" in feature_extractor.__module__:
+                res = feature_extractor(commit["test_job"], commit=commit)
+            else:
+                res = feature_extractor(commit)
+
+            if res is None:
+                continue
+
+            if hasattr(feature_extractor, "name"):
+                feature_extractor_name = feature_extractor.name
+            else:
+                feature_extractor_name = feature_extractor.__class__.__name__
+
+            # FIXME: This is a workaround to pass the value to the
+            # union transformer independently. This will be dropped when we
+            # resolve https://github.com/mozilla/bugbug/issues/3876
+            if isinstance(feature_extractor, Files):
+                result[sys.intern(feature_extractor_name)] = res
+                continue
+
+            if isinstance(res, dict):
+                for key, value in res.items():
+                    data[sys.intern(key)] = value
+                continue
+
+            if isinstance(res, list):
+                for item in res:
+                    data[sys.intern(f"{item} in {feature_extractor_name}")] = True
+                continue
+
+            data[sys.intern(feature_extractor_name)] = res
+
+        if "desc" in commit:
+            for cleanup_function in self.cleanup_functions:
+                result["desc"] = cleanup_function(commit["desc"])
+
+        return result
+
+    def extract_all(self, commits):
+        """Extract the features of the commits lazily, in the order of the commits."""
+        # Models trained before n_jobs was introduced don't have the attribute.
+        n_jobs = utils.get_n_jobs(getattr(self, "n_jobs", None))
+        if n_jobs == 1:
+            for commit in commits():
+                yield self.extract(commit)
+            return
+
+        with Pool(n_jobs, initializer=_init_extraction_worker, initargs=(self,)) as p:
+            yield from p.imap(
+                _extract_commit, commits(), chunksize=EXTRACTION_CHUNK_SIZE
+            )
 
-        return pd.DataFrame(results)
+    def transform(self, commits):
+        return pd.DataFrame(list(self.extract_all(commits)))
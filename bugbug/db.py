@@ -4,19 +4,39 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import gzip
+import hashlib
 import io
 import logging
 import os
 import pickle
+import shutil
+import struct
+from collections import defaultdict
 from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator
 from urllib.parse import urljoin
 
+import lmdb
 import orjson
 import requests
 import zstandard
 
 from bugbug import utils
 
+HAS_COLUMNAR_DEPENDENCIES = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    HAS_COLUMNAR_DEPENDENCIES = True
+except ImportError:
+    pass
+
+OPT_MSG_MISSING_COLUMNAR = (
+    "Optional dependencies are missing, install them with: pip install bugbug[columnar]"
+)
+
 DATABASES = {}
 
 logger = logging.getLogger(__name__)
@@ -26,8 +46,14 @@ class LastModifiedNotAvailable(Exception):
     pass
 
 
-def register(path, url, version, support_files=[]):
-    DATABASES[path] = {"url": url, "version": version, "support_files": support_files}
+def register(path, url, version, support_files=[], index_keys=[], log_structured=False):
+    DATABASES[path] = {
+        "url": url,
+        "version": version,
+        "support_files": support_files,
+        "index_keys": index_keys,
+        "log_structured": log_structured,
+    }
 
     # Create DB parent directory.
     os.makedirs(os.path.abspath(os.path.dirname(path)), exist_ok=True)
@@ -103,6 +129,8 @@ def download(path, support_files_too=False, extract=True):
         if extract and updated:
             utils.extract_file(zst_path)
             os.remove(zst_path)
+            _remove_index(path)
+            _remove_log(path)
 
         successful = True
         if support_files_too:
@@ -116,6 +144,8 @@ def download(path, support_files_too=False, extract=True):
 
 
 def upload(path):
+    assert not _has_log(path), "Log-structured DBs must be compacted before upload"
+
     support_files_paths = [
         os.path.join(os.path.dirname(path), support_file_path)
         for support_file_path in DATABASES[path]["support_files"]
@@ -136,7 +166,26 @@ def last_modified(path):
     return last_modified
 
 
+def get_digest(path: str) -> str:
+    """Return a digest of the content of a DB, including its log."""
+    digest = hashlib.blake2b(digest_size=16)
+
+    paths = [segment_path for _, segment_path in _get_segments(path)]
+    if os.path.exists(_get_tombstones_path(path)):
+        paths.append(_get_tombstones_path(path))
+
+    for file_path in paths:
+        digest.update(os.path.relpath(file_path, os.path.dirname(path)).encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1048576), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
 class Store:
+    columnar = False
+
     def __init__(self, fh):
         self.fh = fh
 
@@ -150,6 +199,17 @@ class JSONStore(Store):
         for line in io.TextIOWrapper(self.fh, encoding="utf-8"):
             yield orjson.loads(line)
 
+    def read_with_offsets(self, start=0):
+        self.fh.seek(start)
+        offset = start
+        for line in self.fh:
+            yield offset, orjson.loads(line)
+            offset += len(line)
+
+    def read_at(self, offset):
+        self.fh.seek(offset)
+        return orjson.loads(self.fh.readline())
+
 
 class PickleStore(Store):
     def write(self, elems):
@@ -163,13 +223,172 @@ class PickleStore(Store):
         except EOFError:
             pass
 
+    def read_with_offsets(self, start=0):
+        self.fh.seek(start)
+        try:
+            while True:
+                offset = self.fh.tell()
+                yield offset, pickle.load(self.fh)
+        except EOFError:
+            pass
+
+    def read_at(self, offset):
+        self.fh.seek(offset)
+        return pickle.load(self.fh)
+
+
+class ParquetStore:
+    """Columnar store, with a column for each top-level field of the elements.
+
+    Values are serialized as JSON, so elements don't need to share a schema. The
+    schema is defined by the fields of the first row group, fields that only
+    appear later on are stored together in an additional column.
+    Parquet files can't be appended to, so appending copies the existing row
+    groups (without decoding them) to a new file.
+    """
+
+    columnar = True
+
+    ROW_GROUP_SIZE = 4096
+    EXTRA_COLUMN = "__extra__"
+
+    def __init__(self, path, mode):
+        assert HAS_COLUMNAR_DEPENDENCIES, OPT_MSG_MISSING_COLUMNAR
+
+        self.path = path
+        self.mode = mode
+        self.writer = None
+        self.fields = None
+
+        dirname, basename = os.path.split(path)
+        self.tmp_path = os.path.join(dirname, f"tmp_{basename}")
+
+    def _open_writer(self, elems):
+        if "a" in self.mode and os.path.exists(self.path):
+            existing = pq.ParquetFile(self.path)
+            schema = existing.schema_arrow
+        else:
+            existing = None
+            field_names = {}
+            for elem in elems:
+                field_names.update(dict.fromkeys(elem))
+            schema = pa.schema(
+                [
+                    (field_name, pa.binary())
+                    for field_name in list(field_names) + [self.EXTRA_COLUMN]
+                ]
+            )
+
+        self.fields = [name for name in schema.names if name != self.EXTRA_COLUMN]
+        self.writer = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+
+        if existing is not None:
+            for i in range(existing.num_row_groups):
+                self.writer.write_table(existing.read_row_group(i))
+
+    def _write_row_group(self, elems):
+        if self.writer is None:
+            self._open_writer(elems)
+
+        known_fields = set(self.fields)
+
+        columns = [
+            [orjson.dumps(elem[field]) if field in elem else None for elem in elems]
+            for field in self.fields
+        ]
+
+        extra = []
+        for elem in elems:
+            extra_fields = {
+                field: value
+                for field, value in elem.items()
+                if field not in known_fields
+            }
+            extra.append(orjson.dumps(extra_fields) if extra_fields else None)
+        columns.append(extra)
+
+        self.writer.write_table(
+            pa.Table.from_arrays(
+                [pa.array(column, type=pa.binary()) for column in columns],
+                schema=self.writer.schema,
+            )
+        )
+
+    def write(self, elems):
+        batch = []
+        for elem in elems:
+            batch.append(elem)
+            if len(batch) == self.ROW_GROUP_SIZE:
+                self._write_row_group(batch)
+                batch = []
+
+        if batch or self.writer is None:
+            self._write_row_group(batch)
+
+    def read(self, columns=None):
+        parquet_file = pq.ParquetFile(self.path)
+        names = parquet_file.schema_arrow.names
+
+        if columns is None:
+            read_columns = names
+        else:
+            read_columns = [name for name in names if name in columns]
+            if any(column not in names for column in columns):
+                read_columns.append(self.EXTRA_COLUMN)
+
+        fields = [name for name in read_columns if name != self.EXTRA_COLUMN]
+
+        for batch in parquet_file.iter_batches(
+            batch_size=self.ROW_GROUP_SIZE, columns=read_columns
+        ):
+            data = batch.to_pydict()
+            for i in range(batch.num_rows):
+                elem = {
+                    field: orjson.loads(data[field][i])
+                    for field in fields
+                    if data[field][i] is not None
+                }
+
+                if self.EXTRA_COLUMN in data and data[self.EXTRA_COLUMN][i] is not None:
+                    extra_fields = orjson.loads(data[self.EXTRA_COLUMN][i])
+                    if columns is not None:
+                        extra_fields = {
+                            field: value
+                            for field, value in extra_fields.items()
+                            if field in columns
+                        }
+                    elem.update(extra_fields)
+
+                yield elem
+
+    def close(self):
+        if self.writer is None:
+            return
+
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard what was written, leaving the existing file untouched."""
+        if self.writer is None:
+            return
+
+        try:
+            self.writer.close()
+        finally:
+            os.remove(self.tmp_path)
+
 
 COMPRESSION_FORMATS = ["gz", "zstd"]
-SERIALIZATION_FORMATS = {"json": JSONStore, "pickle": PickleStore}
+ZSTD_READ_BUFFER_SIZE = 1024 * 1024
+SERIALIZATION_FORMATS = {
+    "json": JSONStore,
+    "pickle": PickleStore,
+    "parquet": ParquetStore,
+}
 
 
-@contextmanager
-def _db_open(path, mode):
+def _get_format(path):
     parts = str(path).split(".")
     assert len(parts) > 1, "Extension needed to figure out serialization format"
     if len(parts) == 2:
@@ -182,41 +401,86 @@ def _db_open(path, mode):
     assert compression is None or compression in COMPRESSION_FORMATS
     assert db_format in SERIALIZATION_FORMATS
 
+    return db_format, compression
+
+
+@contextmanager
+def _db_open(path, mode):
+    db_format, compression = _get_format(path)
+
     store_constructor = SERIALIZATION_FORMATS[db_format]
 
-    if compression == "gz":
+    if store_constructor.columnar:
+        assert compression is None, "Columnar DBs are compressed internally"
+        store = store_constructor(path, mode)
+        try:
+            yield store
+        except BaseException:
+            store.abort()
+            raise
+        store.close()
+    elif compression == "gz":
         with gzip.GzipFile(path, mode) as f:
             yield store_constructor(f)
     elif compression == "zstd":
         if "w" in mode or "a" in mode:
-            cctx = zstandard.ZstdCompressor()
             with open(path, mode) as f:
-                with cctx.stream_writer(f) as writer:
-                    yield store_constructor(writer)
+                writer = utils.ZstdSeekableWriter(f)
+                yield store_constructor(writer)
+                writer.close()
         else:
-            dctx = zstandard.ZstdDecompressor()
             with open(path, mode) as f:
-                with dctx.stream_reader(f) as reader:
-                    yield store_constructor(reader)
+                frames = utils.read_zstd_seek_table(f)
+                f.seek(0)
+                if frames is not None:
+                    with io.BufferedReader(
+                        utils.ZstdSeekableReader(f, frames), ZSTD_READ_BUFFER_SIZE
+                    ) as reader:
+                        yield store_constructor(reader)
+                else:
+                    dctx = zstandard.ZstdDecompressor()
+                    with dctx.stream_reader(f, read_across_frames=True) as reader:
+                        yield store_constructor(reader)
     else:
         with open(path, mode) as f:
             yield store_constructor(f)
 
 
-def read(path):
+def _read_store(store, columns=None):
+    if store.columnar:
+        yield from store.read(columns)
+    elif columns is None:
+        yield from store.read()
+    else:
+        for elem in store.read():
+            yield {column: elem[column] for column in columns if column in elem}
+
+
+def read(path, columns=None):
+    """Read the elements of a DB.
+
+    If `columns` is specified, only the given top-level fields of the elements are
+    returned. For columnar DBs, only those fields are loaded from disk.
+    """
     assert path in DATABASES
 
+    if DATABASES[path]["log_structured"]:
+        yield from _read_log(path, columns)
+        return
+
     if not os.path.exists(path):
         return ()
 
     with _db_open(path, "rb") as store:
-        for elem in store.read():
-            yield elem
+        yield from _read_store(store, columns)
 
 
 def write(path, elems):
     assert path in DATABASES
 
+    _remove_index(path)
+    _remove_log(path)
+
     with _db_open(path, "wb") as store:
         store.write(elems)
 
@@ -224,13 +488,37 @@ def write(path, elems):
 def append(path, elems):
     assert path in DATABASES
 
+    db_format, _ = _get_format(path)
+    if (
+        DATABASES[path]["log_structured"]
+        and SERIALIZATION_FORMATS[db_format].columnar
+        and os.path.exists(path)
+    ):
+        # Columnar DBs can't be appended to in place, so write a new segment.
+        _append_segment(path, elems)
+        return
+
+    # Keep an up-to-date index current by only indexing the appended elements.
+    index_is_current = (
+        _is_indexable(path) and os.path.exists(path) and _index_is_current(path)
+    )
+
     with _db_open(path, "ab") as store:
         store.write(elems)
 
+    if index_is_current:
+        _update_index(path)
+    else:
+        _remove_index(path)
+
 
 def delete(path, match):
     assert path in DATABASES
 
+    if DATABASES[path]["log_structured"]:
+        _delete_log(path, match)
+        return
+
     dirname, basename = os.path.split(path)
     new_path = os.path.join(dirname, f"new_{basename}")
 
@@ -248,3 +536,355 @@ def delete(path, match):
 
     os.unlink(path)
     os.rename(new_path, path)
+
+    _remove_index(path)
+
+
+# Log-structured DBs don't rewrite the DB on deletion, but record the positions
+# of the deleted elements in a tombstones file. For columnar DBs, appended
+# elements are written to new segments, as they can't be appended in place.
+# When the log grows too much, the DB is compacted back into a single file. The
+# DB must be compacted before being compressed for upload.
+MAX_LOG_SEGMENTS = 32
+MAX_TOMBSTONES_RATIO = 0.5
+
+
+def _get_log_dir(path):
+    # The directory name can't contain dots, as the extension of the segments
+    # is used to figure out their format.
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, f"{basename.split('.', 1)[0]}_log")
+
+
+def _get_tombstones_path(path):
+    return os.path.join(_get_log_dir(path), "tombstones")
+
+
+def _has_log(path):
+    return DATABASES[path]["log_structured"] and os.path.exists(_get_log_dir(path))
+
+
+def _remove_log(path):
+    shutil.rmtree(_get_log_dir(path), ignore_errors=True)
+
+
+def _get_segments(path) -> list[tuple[int, str]]:
+    """Return the (number, path) of the segments of a DB, the first being the DB itself."""
+    segments = [(0, path)] if os.path.exists(path) else []
+
+    log_dir = _get_log_dir(path)
+    if os.path.exists(log_dir):
+        for name in os.listdir(log_dir):
+            if name.startswith("segment_"):
+                number = int(name.split(".", 1)[0][len("segment_") :])
+                segments.append((number, os.path.join(log_dir, name)))
+
+    return sorted(segments)
+
+
+def _read_tombstones(path) -> dict[int, set[int]]:
+    tombstones: dict[int, set[int]] = {}
+
+    try:
+        with open(_get_tombstones_path(path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return tombstones
+
+    for segment, position in struct.iter_unpack("<II", data):
+        tombstones.setdefault(segment, set()).add(position)
+
+    return tombstones
+
+
+def _read_log(path, columns=None, with_positions=False):
+    tombstones = _read_tombstones(path)
+
+    for segment, segment_path in _get_segments(path):
+        deleted = tombstones.get(segment, set())
+        with _db_open(segment_path, "rb") as store:
+            for position, elem in enumerate(_read_store(store, columns)):
+                if position in deleted:
+                    continue
+
+                if with_positions:
+                    yield segment, position, elem
+                else:
+                    yield elem
+
+
+def _append_segment(path, elems):
+    segments = _get_segments(path)
+    number = segments[-1][0] + 1
+
+    log_dir = _get_log_dir(path)
+    os.makedirs(log_dir, exist_ok=True)
+
+    extension = os.path.basename(path).split(".", 1)[1]
+    with _db_open(
+        os.path.join(log_dir, f"segment_{number:06d}.{extension}"), "wb"
+    ) as store:
+        store.write(elems)
+
+    if len(segments) >= MAX_LOG_SEGMENTS:
+        compact(path)
+
+
+def _delete_log(path, match):
+    total = 0
+    new_tombstones = []
+    for segment, position, elem in _read_log(path, with_positions=True):
+        total += 1
+        if match(elem):
+            new_tombstones.append((segment, position))
+
+    if not new_tombstones:
+        return
+
+    os.makedirs(_get_log_dir(path), exist_ok=True)
+    with open(_get_tombstones_path(path), "ab") as f:
+        for segment, position in new_tombstones:
+            f.write(struct.pack("<II", segment, position))
+
+    tombstones_num = sum(len(t) for t in _read_tombstones(path).values())
+    if tombstones_num > MAX_TOMBSTONES_RATIO * (total - len(new_tombstones)):
+        compact(path)
+
+
+def compact(path):
+    """Rewrite a log-structured DB into a single file, dropping deleted elements."""
+    assert path in DATABASES
+
+    if not _has_log(path):
+        return
+
+    logger.info("Compacting %s...", path)
+
+    dirname, basename = os.path.split(path)
+    new_path = os.path.join(dirname, f"new_{basename}")
+
+    with _db_open(new_path, "wb") as store:
+        store.write(_read_log(path))
+
+    os.replace(new_path, path)
+
+    _remove_log(path)
+    _remove_index(path)
+
+
+# The index is a LMDB environment stored alongside the DB, with a sub-database
+# per indexed key mapping each value of the key to the byte offsets of the
+# elements containing it. It allows to retrieve a few elements without
+# decompressing and parsing the whole DB.
+INDEX_MAP_SIZE = 68719476736
+INDEX_SIZE_KEY = b"size"
+INDEX_MTIME_KEY = b"mtime"
+INDEX_KEYS_KEY = b"keys"
+
+
+def _get_index_path(path):
+    return f"{path}.idx.lmdb"
+
+
+def _is_indexable(path):
+    if not DATABASES[path]["index_keys"]:
+        return False
+
+    db_format, compression = _get_format(path)
+    return compression is None and not SERIALIZATION_FORMATS[db_format].columnar
+
+
+def _remove_index(path):
+    shutil.rmtree(_get_index_path(path), ignore_errors=True)
+
+
+def _encode_index_key(key: Any) -> bytes:
+    return str(key).encode("utf-8")
+
+
+def _encode_index_keys(path) -> bytes:
+    return ",".join(DATABASES[path]["index_keys"]).encode("ascii")
+
+
+def _open_index(path, readonly=False):
+    return lmdb.open(
+        _get_index_path(path),
+        map_size=INDEX_MAP_SIZE,
+        max_dbs=len(DATABASES[path]["index_keys"]),
+        metasync=False,
+        sync=False,
+        readonly=readonly,
+    )
+
+
+def _index_is_current(path):
+    if not os.path.exists(_get_index_path(path)):
+        return False
+
+    stat = os.stat(path)
+
+    env = _open_index(path, readonly=True)
+    try:
+        with env.begin() as txn:
+            size = txn.get(INDEX_SIZE_KEY)
+            mtime = txn.get(INDEX_MTIME_KEY)
+            index_keys = txn.get(INDEX_KEYS_KEY)
+    finally:
+        env.close()
+
+    return (
+        size is not None
+        and mtime is not None
+        and int(size) == stat.st_size
+        and int(mtime) == stat.st_mtime_ns
+        and index_keys == _encode_index_keys(path)
+    )
+
+
+def _update_index(path, rebuild=False):
+    if rebuild:
+        _remove_index(path)
+
+    index_keys = DATABASES[path]["index_keys"]
+
+    env = _open_index(path)
+    try:
+        sub_dbs = {
+            index_key: env.open_db(index_key.encode("ascii"), dupsort=True)
+            for index_key in index_keys
+        }
+
+        with env.begin(write=True) as txn:
+            start = txn.get(INDEX_SIZE_KEY)
+            start = int(start) if start is not None else 0
+
+            with _db_open(path, "rb") as store:
+                for offset, elem in store.read_with_offsets(start):
+                    encoded_offset = offset.to_bytes(8, "big")
+                    for index_key in index_keys:
+                        value = elem.get(index_key)
+                        if value is None:
+                            continue
+
+                        txn.put(
+                            _encode_index_key(value),
+                            encoded_offset,
+                            db=sub_dbs[index_key],
+                        )
+
+            stat = os.stat(path)
+            txn.put(INDEX_SIZE_KEY, str(stat.st_size).encode("ascii"))
+            txn.put(INDEX_MTIME_KEY, str(stat.st_mtime_ns).encode("ascii"))
+            txn.put(INDEX_KEYS_KEY, _encode_index_keys(path))
+    finally:
+        env.close()
+
+
+def build_index(path):
+    assert path in DATABASES
+
+    if not _is_indexable(path) or not os.path.exists(path):
+        return
+
+    if not _index_is_current(path):
+        logger.info("Indexing %s...", path)
+        _update_index(path, rebuild=True)
+
+
+def get_by_key(path, keys: Iterable[Any], index_key: str | None = None) -> Iterator:
+    """Retrieve the elements whose `index_key` value is one of `keys`.
+
+    Elements are returned in the order in which they are stored in the DB.
+    When the DB can't be indexed (e.g. it is compressed), this falls back to a
+    linear scan.
+    """
+    assert path in DATABASES
+
+    if index_key is None:
+        index_key = DATABASES[path]["index_keys"][0]
+    assert index_key in DATABASES[path]["index_keys"]
+
+    if not os.path.exists(path):
+        return
+
+    if not _is_indexable(path) or _has_log(path):
+        encoded_keys = set(_encode_index_key(key) for key in keys)
+        for elem in read(path):
+            value = elem.get(index_key)
+            if value is not None and _encode_index_key(value) in encoded_keys:
+                yield elem
+        return
+
+    build_index(path)
+
+    offsets = set()
+    env = _open_index(path, readonly=True)
+    try:
+        sub_db = env.open_db(index_key.encode("ascii"), dupsort=True, create=False)
+        with env.begin(db=sub_db) as txn:
+            cursor = txn.cursor()
+            for key in keys:
+                if cursor.set_key(_encode_index_key(key)):
+                    offsets.update(
+                        int.from_bytes(offset, "big")
+                        for offset in cursor.iternext_dup()
+                    )
+    finally:
+        env.close()
+
+    with _db_open(path, "rb") as store:
+        for offset in sorted(offsets):
+            yield store.read_at(offset)
+
+
+@contextmanager
+def open_lookup(path, index_key: str | None = None) -> Iterator[Callable]:
+    """Open a lookup function, returning the elements whose `index_key` value is a given key.
+
+    This allows to join two DBs by streaming one of them and looking up the matching
+    elements of the other one, without loading it in memory. The elements of a key are
+    returned in the order in which they are stored in the DB.
+    When the DB can't be indexed (e.g. it is compressed), the elements are grouped by
+    key in memory with a single scan.
+    """
+    assert path in DATABASES
+
+    if index_key is None:
+        index_key = DATABASES[path]["index_keys"][0]
+    assert index_key in DATABASES[path]["index_keys"]
+
+    if not os.path.exists(path):
+        yield lambda key: []
+        return
+
+    if not _is_indexable(path) or _has_log(path):
+        groups = defaultdict(list)
+        for elem in read(path):
+            value = elem.get(index_key)
+            if value is not None:
+                groups[_encode_index_key(value)].append(elem)
+
+        yield lambda key: groups.get(_encode_index_key(key), [])
+        return
+
+    build_index(path)
+
+    env = _open_index(path, readonly=True)
+    try:
+        sub_db = env.open_db(index_key.encode("ascii"), dupsort=True, create=False)
+        with env.begin(db=sub_db) as txn, _db_open(path, "rb") as store:
+            cursor = txn.cursor()
+
+            def lookup(key: Any) -> list:
+                if not cursor.set_key(_encode_index_key(key)):
+                    return []
+
+                # Offsets are stored big-endian, so duplicates are sorted by offset.
+                return [
+                    store.read_at(int.from_bytes(offset, "big"))
+                    for offset in cursor.iternext_dup()
+                ]
+
+            yield lookup
+    finally:
+        env.close()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Persistent cache of the features extracted from the training items.
+
+The cache of a model is keyed by a fingerprint of its extraction pipeline (the
+feature extractors, the cleanup functions, their parameters and the source code of
+the modules defining them), of the schema versions of its training DBs and of the
+content of the other DBs read during extraction. Inside the cache, every item is identified
+by a digest of its content and label, so that when the DBs are updated only the
+new or modified items need to go through feature extraction.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+from typing import Any, Callable, Iterable
+
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from bugbug import bug_features, db
+
+logger = logging.getLogger(__name__)
+
+FEATURE_CACHE_DIR = os.path.join("data", "feature_cache")
+
+# Parameters which don't influence the extracted features.
+IGNORED_PARAMS = {"n_jobs"}
+
+
+def _fingerprint(obj: Any, modules: set[str]) -> str:
+    """Fingerprint an object, collecting the modules defining its code in `modules`."""
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return repr(obj)
+
+    if isinstance(obj, (list, tuple)):
+        return f"[{','.join(_fingerprint(elem, modules) for elem in obj)}]"
+
+    if isinstance(obj, (set, frozenset)):
+        return f"{{{','.join(sorted(_fingerprint(elem, modules) for elem in obj))}}}"
+
+    if isinstance(obj, dict):
+        return "{%s}" % ",".join(
+            sorted(
+                f"{_fingerprint(key, modules)}:{_fingerprint(value, modules)}"
+                for key, value in obj.items()
+                if key not in IGNORED_PARAMS
+            )
+        )
+
+    cls = type(obj)
+    name = f"{cls.__module__}.{cls.__qualname__}"
+
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        modules.add(obj.__module__)
+        return f"{obj.__module__}.{obj.__qualname__}"
+
+    modules.add(cls.__module__)
+
+    if hasattr(obj, "__dict__"):
+        return f"{name}({_fingerprint(vars(obj), modules)})"
+
+    return f"{name}({obj!r})"
+
+
+def _get_module_dependencies(name: str) -> set[str]:
+    """Return the bugbug modules used by a module."""
+    dependencies = set()
+    for value in vars(sys.modules[name]).values():
+        dependency = (
+            value.__name__
+            if isinstance(value, type(sys))
+            else getattr(value, "__module__", None)
+        )
+        if isinstance(dependency, str) and dependency.split(".")[0] == "bugbug":
+            dependencies.add(dependency)
+    return dependencies
+
+
+def get_code_digest(modules: Iterable[str]) -> str:
+    """Return a digest of the source of the bugbug modules among `modules`, and of
+    the bugbug modules they use.
+    """
+    to_visit = [name for name in modules if name.split(".")[0] == "bugbug"]
+    visited = set()
+    while to_visit:
+        name = to_visit.pop()
+        if name in visited or name not in sys.modules:
+            continue
+        visited.add(name)
+        to_visit.extend(_get_module_dependencies(name))
+
+    digest = hashlib.sha256()
+    for name in sorted(visited):
+        path = getattr(sys.modules[name], "__file__", None)
+        if path is None:
+            continue
+
+        digest.update(name.encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def get_dependent_dbs(extraction_pipeline: Pipeline) -> list[str]:
+    """Return the DBs read by the steps of the pipeline while extracting features."""
+    return [
+        path
+        for _, step in extraction_pipeline.steps
+        if hasattr(step, "get_dependent_dbs")
+        for path in step.get_dependent_dbs()
+    ]
+
+
+def get_key(model_name: str, extraction_pipeline: Pipeline, dbs: Iterable[str]) -> str:
+    modules: set[str] = set()
+    config = _fingerprint(
+        [
+            model_name,
+            [(name, step) for name, step in extraction_pipeline.steps],
+            [(path, db.DATABASES[path]["version"]) for path in dbs],
+        ],
+        modules,
+    )
+    # The items of the training DBs are part of the cache, but the content of the
+    # other DBs read during extraction must be part of the key.
+    dependent_dbs = [
+        (path, db.DATABASES[path]["version"], db.get_digest(path))
+        for path in get_dependent_dbs(extraction_pipeline)
+    ]
+    config += _fingerprint([get_code_digest(modules), dependent_dbs], modules)
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+
+
+def is_order_independent(extraction_pipeline: Pipeline) -> bool:
+    """Whether the features of an item don't depend on the items preceding it."""
+    return not any(
+        isinstance(feature_extractor, bug_features.ReporterExperience)
+        for _, step in extraction_pipeline.steps
+        for feature_extractor in getattr(step, "feature_extractors", [])
+    )
+
+
+def digest_item(item: Any, label: Any) -> bytes:
+    return hashlib.blake2b(
+        pickle.dumps((item, label), protocol=pickle.HIGHEST_PROTOCOL), digest_size=16
+    ).digest()
+
+
+class FeatureCache:
+    def __init__(self, model_name: str, key: str) -> None:
+        self.path = os.path.join(FEATURE_CACHE_DIR, f"{model_name}_{key}.pickle")
+        self.digests: list[bytes] = []
+        self.X: pd.DataFrame | None = None
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.digests, self.X = pickle.load(f)
+
+            logger.info("%d items in the feature cache", len(self.digests))
+
+    def save(self, digests: list[bytes], X: pd.DataFrame) -> None:
+        os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((digests, X), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
+def extract(
+    model_name: str,
+    extraction_pipeline: Pipeline,
+    dbs: Iterable[str],
+    items: Callable[[], Iterable[tuple[Any, Any]]],
+) -> tuple[pd.DataFrame, list[Any]]:
+    """Extract the features of the items, reusing the cached features if possible."""
+    cache = FeatureCache(model_name, get_key(model_name, extraction_pipeline, dbs))
+
+    digests: list[bytes] = []
+    y: list[Any] = []
+
+    if cache.X is not None and not is_order_independent(extraction_pipeline):
+        # Features of an item depend on the previous items, so we can only reuse
+        # the cache if it contains the exact same items.
+        for item, label in items():
+            digests.append(digest_item(item, label))
+            y.append(label)
+
+        if digests == cache.digests:
+            logger.info("All %d items found in the feature cache", len(digests))
+            return cache.X, y
+
+        X = extraction_pipeline.transform(lambda: (item for item, label in items()))
+        cache.save(digests, X)
+        return X, y
+
+    # The items are digested while they are streamed to the extraction, which only
+    # gets the items which are not in the cache.
+    cached_positions = {
+        digest: position for position, digest in enumerate(cache.digests)
+    }
+    reused_positions = []
+    reused_cache_positions = []
+    new_positions = []
+
+    def new_items():
+        for position, (item, label) in enumerate(items()):
+            digest = digest_item(item, label)
+            digests.append(digest)
+            y.append(label)
+
+            cache_position = cached_positions.get(digest)
+            if cache_position is not None:
+                reused_positions.append(position)
+                reused_cache_positions.append(cache_position)
+            else:
+                new_positions.append(position)
+                yield item
+
+    X_new = extraction_pipeline.transform(new_items)
+
+    if len(reused_positions) == 0:
+        X = X_new
+    else:
+        assert cache.X is not None
+        if digests == cache.digests:
+            logger.info("All %d items found in the feature cache", len(digests))
+            return cache.X, y
+
+        logger.info(
+            "%d items found in the feature cache, extracting features for %d items",
+            len(reused_positions),
+            len(new_positions),
+        )
+
+        parts = [cache.X.iloc[reused_cache_positions].set_axis(reused_positions)]
+        if len(new_positions) > 0:
+            parts.append(X_new.set_axis(new_positions))
+        X = pd.concat(parts).sort_index().reset_index(drop=True)
+
+    cache.save(digests, X)
+
+    return X, y
@@ -39,6 +39,7 @@ class Github:
                 self.db_path,
                 DB_URL.format(self.owner, self.repo, self.owner, self.repo),
                 DB_VERSION,
+                log_structured=True,
             )
 
     def get_issues(self) -> Iterator[IssueDict]:
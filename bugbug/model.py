@@ -3,14 +3,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 import logging
 import pickle
-from collections import defaultdict
+import tempfile
+from contextlib import ExitStack
 from os import makedirs, path
 from typing import Any
 
 import matplotlib
 import numpy as np
+import pandas as pd
 import shap
 from imblearn.metrics import (
     classification_report_imbalanced,
@@ -27,7 +30,15 @@ from sklearn.preprocessing import LabelEncoder
 from tabulate import tabulate
 from xgboost import XGBModel
 
-from bugbug import bugzilla, db, repository
+from bugbug import (
+    bug_features,
+    bugzilla,
+    commit_features,
+    db,
+    feature_cache,
+    out_of_core,
+    repository,
+)
 from bugbug.github import Github
 from bugbug.nlp import SpacyVectorizer
 from bugbug.utils import split_tuple_generator, to_array
@@ -152,6 +163,26 @@ def print_labeled_confusion_matrix(confusion_matrix, labels, is_multilabel=False
         )
 
 
+def get_confident_predictions(y_pred_probas, confidence_threshold, is_binary):
+    """Get the predicted classes and which of them are above a confidence threshold.
+
+    In the binary case, the positive class is predicted when its probability is
+    higher than the threshold. Otherwise, the most probable class is predicted.
+
+    Returns:
+        a tuple with the indices of the predicted classes and a boolean mask of the
+        predictions whose probability is at least the threshold.
+    """
+    if is_binary:
+        pred_class_indices = (y_pred_probas[:, 1] > confidence_threshold).astype(int)
+    else:
+        pred_class_indices = np.argmax(y_pred_probas, axis=1)
+
+    pred_probas = y_pred_probas[np.arange(len(y_pred_probas)), pred_class_indices]
+
+    return pred_class_indices, pred_probas >= confidence_threshold
+
+
 def sort_class_names(class_names):
     if len(class_names) == 2:
         class_names = sorted(list(class_names), reverse=True)
@@ -196,6 +227,14 @@ class Model:
                         or not ensure_exist
                     )
 
+    def set_extraction_n_jobs(self, n_jobs: int | None) -> None:
+        """Set the number of processes used to extract features from the items."""
+        for _, step in self.extraction_pipeline.steps:
+            if isinstance(
+                step, (bug_features.BugExtractor, commit_features.CommitExtractor)
+            ):
+                step.set_params(n_jobs=n_jobs)
+
     def get_feature_names(self):
         return []
 
@@ -362,15 +401,38 @@ class Model:
         """Subclasses implement their own function to gather labels."""
         raise NotImplementedError("The model must implement this method")
 
-    def train(self, importance_cutoff=0.15, limit=None):
+    def train(
+        self,
+        importance_cutoff=0.15,
+        limit=None,
+        use_feature_cache=False,
+        use_out_of_core=False,
+        confidence_thresholds=None,
+    ):
         classes, self.class_names = self.get_labels()
         self.class_names = sort_class_names(self.class_names)
 
-        # Get items and labels, filtering out those for which we have no labels.
-        X_gen, y = split_tuple_generator(lambda: self.items_gen(classes))
+        if use_out_of_core:
+            assert not use_feature_cache, (
+                "The feature cache can't be used in out-of-core training"
+            )
+            return self.train_out_of_core(classes, limit, confidence_thresholds)
+
+        if use_feature_cache:
+            # Get items and labels, and extract features from the items which are
+            # not in the cache.
+            X, y = feature_cache.extract(
+                self.__class__.__name__.lower(),
+                self.extraction_pipeline,
+                self.training_dbs,
+                lambda: self.items_gen(classes),
+            )
+        else:
+            # Get items and labels, filtering out those for which we have no labels.
+            X_gen, y = split_tuple_generator(lambda: self.items_gen(classes))
 
-        # Extract features from the items.
-        X = self.extraction_pipeline.transform(X_gen)
+            # Extract features from the items.
+            X = self.extraction_pipeline.transform(X_gen)
 
         # Calculate labels.
         y = np.array(y)
@@ -470,6 +532,147 @@ class Model:
                 )
             )
 
+        self.evaluate_test_set(X_test, y_test, tracking_metrics, confidence_thresholds)
+
+        self.evaluation()
+
+        if self.entire_dataset_training:
+            logger.info("Retraining on the entire dataset...")
+
+            X_train = X
+            y_train = y
+
+            logger.info(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
+
+            self.clf.fit(X_train, self.le.transform(y_train))
+
+        self.save()
+
+        if self.store_dataset:
+            with open(f"{self.__class__.__name__.lower()}_data_X", "wb") as f:
+                pickle.dump(X, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            with open(f"{self.__class__.__name__.lower()}_data_y", "wb") as f:
+                pickle.dump(y, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return tracking_metrics
+
+    def train_out_of_core(self, classes, limit=None, confidence_thresholds=None):
+        """Train the model without holding all of its features in memory."""
+        makedirs(out_of_core.OUT_OF_CORE_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=out_of_core.OUT_OF_CORE_DIR) as tmp_dir:
+            # Extract features from the items, storing them on disk.
+            feature_chunks = out_of_core.ChunkStore(path.join(tmp_dir, "features"))
+            y = out_of_core.extract(
+                self.extraction_pipeline,
+                itertools.islice(self.items_gen(classes), limit),
+                feature_chunks,
+            )
+
+            # Calculate labels.
+            y = np.array(y)
+            self.le.fit(y)
+
+            logger.info(f"y: {y.shape}")
+
+            if isinstance(y[0], np.ndarray):
+                raise ValueError(
+                    "Out-of-core training is not supported for multilabel models"
+                )
+
+            # Split dataset in training and test.
+            train_indices, test_indices, _, _ = self.train_test_split(
+                np.arange(len(y)), y
+            )
+            train_indices = np.sort(train_indices)
+            test_indices = np.sort(test_indices)
+
+            logger.info(
+                "Cross validation and feature importances are not calculated in out-of-core training"
+            )
+            tracking_metrics = {}
+
+            logger.info(f"y_train: {train_indices.shape}, y_test: {test_indices.shape}")
+
+            self.fit_out_of_core(
+                feature_chunks, train_indices, y, path.join(tmp_dir, "train")
+            )
+            logger.info("Number of features: %d", self.clf.steps[-1][1].n_features_in_)
+
+            logger.info("Model trained")
+
+            # The test set is small enough to be evaluated in memory.
+            X_test = pd.concat(out_of_core.select_rows(feature_chunks, test_indices))
+            self.evaluate_test_set(
+                X_test, y[test_indices], tracking_metrics, confidence_thresholds
+            )
+
+            self.evaluation()
+
+            if self.entire_dataset_training:
+                logger.info("Retraining on the entire dataset...")
+
+                self.fit_out_of_core(
+                    feature_chunks, np.arange(len(y)), y, path.join(tmp_dir, "all")
+                )
+
+            if self.store_dataset:
+                with open(f"{self.__class__.__name__.lower()}_data_X", "wb") as f:
+                    pickle.dump(
+                        pd.concat(feature_chunks), f, protocol=pickle.HIGHEST_PROTOCOL
+                    )
+
+                with open(f"{self.__class__.__name__.lower()}_data_y", "wb") as f:
+                    pickle.dump(y, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.save()
+
+        return tracking_metrics
+
+    def fit_out_of_core(self, feature_chunks, indices, y, directory):
+        union = self.clf.named_steps["union"]
+        estimator = self.clf.named_steps["estimator"]
+        samplers = [
+            step
+            for name, step in self.clf.steps
+            if name not in ("union", "estimator") and step != "passthrough"
+        ]
+        for sampler in samplers:
+            if not hasattr(sampler, "fit_resample"):
+                raise ValueError(
+                    f"Out-of-core training is not supported for {type(sampler).__name__}"
+                )
+
+        # First and second passes: fit the union and vectorize the items.
+        out_of_core.fit_union(
+            union, lambda: out_of_core.select_rows(feature_chunks, indices)
+        )
+
+        for sampler in samplers:
+            indices = out_of_core.resample(sampler, indices, y[indices])
+
+        matrix_chunks = out_of_core.ChunkStore(path.join(directory, "matrix"))
+        out_of_core.vectorize(
+            union,
+            out_of_core.select_rows(feature_chunks, indices),
+            self.le.transform(y),
+            matrix_chunks,
+        )
+
+        out_of_core.fit_estimator(
+            estimator,
+            matrix_chunks,
+            not union.sparse_output_,
+            len(self.le.classes_),
+            path.join(directory, "cache"),
+        )
+
+    def evaluate_test_set(
+        self, X_test, y_test, tracking_metrics, confidence_thresholds=None
+    ):
+        is_multilabel = isinstance(y_test[0], np.ndarray)
+        is_binary = len(self.class_names) == 2
+
         logger.info("Test Set scores:")
         # Evaluate results on the test set.
         y_pred = self.clf.predict(X_test)
@@ -505,65 +708,48 @@ class Model:
 
         tracking_metrics["confusion_matrix"] = confusion_matrix.tolist()
 
-        confidence_thresholds = [0.6, 0.7, 0.8, 0.9]
+        if confidence_thresholds is None:
+            confidence_thresholds = [0.6, 0.7, 0.8, 0.9]
 
-        if is_binary:
-            confidence_thresholds = [0.1, 0.2, 0.3, 0.4] + confidence_thresholds
+            if is_binary:
+                confidence_thresholds = [0.1, 0.2, 0.3, 0.4] + confidence_thresholds
 
-        # Evaluate results on the test set for some confidence thresholds.
-        for confidence_threshold in confidence_thresholds:
-            y_pred_probas = self.clf.predict_proba(X_test)
-            confidence_class_names = self.class_names + ["__NOT_CLASSIFIED__"]
-
-            y_pred_filter = []
-            classified_indices = []
-            for i in range(0, len(y_test)):
-                if not is_binary:
-                    argmax = np.argmax(y_pred_probas[i])
-                else:
-                    argmax = 1 if y_pred_probas[i][1] > confidence_threshold else 0
-
-                if y_pred_probas[i][argmax] < confidence_threshold:
-                    if not is_multilabel:
-                        y_pred_filter.append("__NOT_CLASSIFIED__")
-                    continue
-
-                classified_indices.append(i)
-                if is_multilabel:
-                    y_pred_filter.append(y_pred[i])
-                else:
-                    y_pred_filter.append(argmax)
-
-            if not is_multilabel:
-                y_pred_filter = np.array(y_pred_filter)
-                y_pred_filter[classified_indices] = self.le.inverse_transform(
-                    np.array(y_pred_filter[classified_indices], dtype=int)
-                )
+        # Evaluate results on the test set for some confidence thresholds, scoring
+        # the test set only once.
+        y_pred_probas = self.clf.predict_proba(X_test)
+        confidence_class_names = self.class_names + ["__NOT_CLASSIFIED__"]
 
-            if is_multilabel:
-                classified_num = len(classified_indices)
-            else:
-                classified_num = sum(
-                    1 for v in y_pred_filter if v != "__NOT_CLASSIFIED__"
-                )
+        tracking_metrics["confidence_thresholds"] = []
+        for confidence_threshold in confidence_thresholds:
+            pred_class_indices, classified = get_confident_predictions(
+                y_pred_probas, confidence_threshold, is_binary
+            )
+            classified_num = int(classified.sum())
 
             logger.info(
                 f"\nConfidence threshold > {confidence_threshold} - {classified_num} classified"
             )
             if is_multilabel:
                 confusion_matrix = metrics.multilabel_confusion_matrix(
-                    y_test[classified_indices], np.asarray(y_pred_filter)
+                    y_test[classified], y_pred[classified]
                 )
             else:
+                y_pred_filter = np.full(len(y_test), "__NOT_CLASSIFIED__", dtype=object)
+                if classified_num > 0:
+                    y_pred_filter[classified] = self.le.inverse_transform(
+                        pred_class_indices[classified]
+                    )
+                y_pred_filter = y_pred_filter.astype(str)
+
                 confusion_matrix = metrics.confusion_matrix(
                     y_test.astype(str),
-                    y_pred_filter.astype(str),
+                    y_pred_filter,
                     labels=confidence_class_names,
                 )
                 print(
                     classification_report_imbalanced(
                         y_test.astype(str),
-                        y_pred_filter.astype(str),
+                        y_pred_filter,
                         labels=confidence_class_names,
                     )
                 )
@@ -571,18 +757,15 @@ class Model:
                 confusion_matrix, confidence_class_names, is_multilabel=is_multilabel
             )
 
-        self.evaluation()
-
-        if self.entire_dataset_training:
-            logger.info("Retraining on the entire dataset...")
-
-            X_train = X
-            y_train = y
-
-            logger.info(f"X_train: {X_train.shape}, y_train: {y_train.shape}")
-
-            self.clf.fit(X_train, self.le.transform(y_train))
+            tracking_metrics["confidence_thresholds"].append(
+                {
+                    "threshold": confidence_threshold,
+                    "classified": classified_num,
+                    "confusion_matrix": confusion_matrix.tolist(),
+                }
+            )
 
+    def save(self):
         model_directory = self.__class__.__name__.lower()
         makedirs(model_directory, exist_ok=True)
 
@@ -601,15 +784,6 @@ class Model:
         with open(model_path, "wb") as f:
             pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-        if self.store_dataset:
-            with open(f"{self.__class__.__name__.lower()}_data_X", "wb") as f:
-                pickle.dump(X, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-            with open(f"{self.__class__.__name__.lower()}_data_y", "wb") as f:
-                pickle.dump(y, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-        return tracking_metrics
-
     @staticmethod
     def load(model_directory: str) -> "Model":
         model_path = path.join(model_directory, "model.pkl")
@@ -722,32 +896,23 @@ class BugModel(Model):
             self.training_dbs.append(repository.COMMITS_DB)
 
     def items_gen(self, classes):
-        if not self.commit_data:
-            commit_map = None
-        else:
-            commit_map = defaultdict(list)
+        with ExitStack() as stack:
+            if self.commit_data:
+                get_bug_commits = stack.enter_context(
+                    db.open_lookup(repository.COMMITS_DB, "bug_id")
+                )
 
-            for commit in repository.get_commits():
-                bug_id = commit["bug_id"]
-                if not bug_id:
+            for bug in bugzilla.get_bugs():
+                bug_id = bug["id"]
+                if bug_id not in classes:
                     continue
 
-                commit_map[bug_id].append(commit)
-
-            assert len(commit_map) > 0
-
-        for bug in bugzilla.get_bugs():
-            bug_id = bug["id"]
-            if bug_id not in classes:
-                continue
-
-            if self.commit_data:
-                if bug_id in commit_map:
-                    bug["commits"] = commit_map[bug_id]
-                else:
-                    bug["commits"] = []
+                if self.commit_data:
+                    bug["commits"] = list(
+                        repository.filter_commits(get_bug_commits(bug_id))
+                    )
 
-            yield bug, classes[bug_id]
+                yield bug, classes[bug_id]
 
 
 class CommitModel(Model):
@@ -759,34 +924,24 @@ class CommitModel(Model):
             self.training_dbs.append(bugzilla.BUGS_DB)
 
     def items_gen(self, classes):
-        if not self.bug_data:
-            bug_map = None
-        else:
-            all_bug_ids = set(
-                commit["bug_id"]
-                for commit in repository.get_commits()
-                if commit["node"] in classes
-            )
-
-            bug_map = {
-                bug["id"]: bug
-                for bug in bugzilla.get_bugs()
-                if bug["id"] in all_bug_ids
-            }
-
-            assert len(bug_map) > 0
+        with ExitStack() as stack:
+            if self.bug_data:
+                get_bugs_by_id = stack.enter_context(
+                    db.open_lookup(bugzilla.BUGS_DB, "id")
+                )
 
-        for commit in repository.get_commits(include_ignored=True):
-            if commit["node"] not in classes:
-                continue
+            for commit in repository.get_commits(include_ignored=True):
+                if commit["node"] not in classes:
+                    continue
 
-            if self.bug_data:
-                if commit["bug_id"] in bug_map:
-                    commit["bug"] = bug_map[commit["bug_id"]]
-                else:
-                    commit["bug"] = {}
+                if self.bug_data:
+                    bugs = get_bugs_by_id(commit["bug_id"]) if commit["bug_id"] else []
+                    # Only the bugs which bugzilla.get_bugs returns are used.
+                    commit["bug"] = (
+                        bugs[-1] if bugs and bugzilla.is_included(bugs[-1]) else {}
+                    )
 
-            yield commit, classes[commit["node"]]
+                yield commit, classes[commit["node"]]
 
 
 class IssueModel(Model):
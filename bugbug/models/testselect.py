@@ -14,6 +14,7 @@ from functools import reduce
 from typing import Any, Callable, Collection, Iterable, Sequence, Set
 
 import numpy as np
+import scipy.sparse as sp
 import xgboost
 from imblearn.pipeline import Pipeline as ImblearnPipeline
 from imblearn.under_sampling import RandomUnderSampler
@@ -39,13 +40,13 @@ logger = logging.getLogger(__name__)
 def get_commit_map(
     revs: Set[test_scheduling.Revision] | None = None,
 ) -> dict[test_scheduling.Revision, repository.CommitDict]:
-    commit_map = {}
-
-    for commit in repository.get_commits():
-        if revs is not None and commit["node"] not in revs:
-            continue
+    commits = (
+        repository.get_commits()
+        if revs is None
+        else repository.get_commits_by_nodes(revs)
+    )
 
-        commit_map[commit["node"]] = commit
+    commit_map = {commit["node"]: commit for commit in commits}
 
     assert len(commit_map) > 0
     return commit_map
@@ -402,6 +403,7 @@ class TestSelectModel(Model):
             self.eval_dbs[test_scheduling.TEST_LABEL_SCHEDULING_DB] = (
                 test_scheduling.PAST_FAILURES_LABEL_DB,
                 test_scheduling.FAILING_TOGETHER_LABEL_DB,
+                test_scheduling.FAILING_TOGETHER_COUNTS_LABEL_DB,
             )
         elif granularity == "group":
             self.training_dbs.append(test_scheduling.TEST_GROUP_SCHEDULING_DB)
@@ -411,6 +413,7 @@ class TestSelectModel(Model):
             )
             self.eval_dbs[test_scheduling.TEST_CONFIG_GROUP_SCHEDULING_DB] = (
                 test_scheduling.FAILING_TOGETHER_CONFIG_GROUP_DB,
+                test_scheduling.FAILING_TOGETHER_COUNTS_CONFIG_GROUP_DB,
             )
         elif granularity == "config_group":
             self.training_dbs.append(test_scheduling.TEST_CONFIG_GROUP_SCHEDULING_DB)
@@ -558,6 +561,78 @@ class TestSelectModel(Model):
 
         return classes, [0, 1]
 
+    def vectorize_test_jobs(
+        self, commit: repository.CommitDict, test_jobs: Sequence[dict]
+    ) -> np.ndarray | sp.csr_matrix:
+        """Build the feature matrix of a list of test jobs for a single commit.
+
+        This is equivalent to running the extraction pipeline and the union
+        transformer on one `commit` copy per test job, but it writes the
+        features directly in the matrix, skipping the intermediate dicts, the
+        DataFrame and the DictVectorizer.
+        """
+        extractor = self.extraction_pipeline.named_steps["commit_extractor"]
+        union = self.clf.named_steps["union"]
+        vectorizer = union.named_transformers_["data"]
+        vocabulary = vectorizer.vocabulary_
+        dtype = vectorizer.dtype
+
+        feature_extractors = [
+            (
+                feature_extractor,
+                getattr(
+                    feature_extractor, "name", feature_extractor.__class__.__name__
+                ),
+            )
+            for feature_extractor in extractor.feature_extractors
+        ]
+
+        indices = []
+        values = []
+        indptr = [0]
+
+        def add(feature_name, value):
+            if isinstance(value, str):
+                feature_name = f"{feature_name}{vectorizer.separator}{value}"
+                value = 1
+
+            index = vocabulary.get(feature_name)
+            if index is not None:
+                indices.append(index)
+                values.append(dtype(value))
+
+        for test_job in test_jobs:
+            for feature_extractor, feature_extractor_name in feature_extractors:
+                res = feature_extractor(test_job, commit=commit)
+
+                if res is None:
+                    continue
+
+                if isinstance(res, dict):
+                    for key, value in res.items():
+                        add(key, value)
+                elif isinstance(res, list):
+                    for item in res:
+                        add(f"{item} in {feature_extractor_name}", True)
+                else:
+                    add(feature_extractor_name, res)
+
+            indptr.append(len(indices))
+
+        X = sp.csr_matrix(
+            (values, np.array(indices, dtype=np.intc), indptr),
+            shape=(len(test_jobs), len(vocabulary)),
+            dtype=dtype,
+        )
+        X.sort_indices()
+
+        # Match the output type of the union, as XGBoost treats missing values
+        # differently in sparse and dense inputs.
+        if not union.sparse_output_:
+            X = X.toarray()
+
+        return X
+
     def select_tests(
         self,
         commits: Sequence[repository.CommitDict],
@@ -571,24 +646,25 @@ class TestSelectModel(Model):
         if push_num is None:
             push_num = past_failures_data.push_num + 1
 
-        commit_tests = []
-        for data in test_scheduling.generate_data(
-            self.granularity,
-            past_failures_data,
-            commit_data,
-            push_num,
-            past_failures_data.all_runnables,
-            tuple(),
-            tuple(),
-        ):
-            commit_test = commit_data.copy()
-            commit_test["test_job"] = data
-            commit_tests.append(commit_test)
+        test_jobs = list(
+            test_scheduling.generate_data(
+                self.granularity,
+                past_failures_data,
+                commit_data,
+                push_num,
+                past_failures_data.all_runnables,
+                tuple(),
+                tuple(),
+            )
+        )
+        if len(test_jobs) == 0:
+            return {}
 
-        probs = self.classify(commit_tests, probabilities=True)
+        X = self.vectorize_test_jobs(commit_data, test_jobs)
+        probs = self.clf.named_steps["estimator"].predict_proba(X)
         selected_indexes = np.argwhere(probs[:, 1] >= confidence)[:, 0]
         return {
-            commit_tests[i]["test_job"]["name"]: math.floor(probs[i, 1] * 100) / 100
+            test_jobs[i]["name"]: math.floor(probs[i, 1] * 100) / 100
             for i in selected_indexes
         }
 
@@ -600,14 +676,15 @@ class TestSelectModel(Model):
         # only failure data from the training pushes (otherwise, we'd leak training information into the test
         # set).
         logger.info("Generate failing together DB (restricted to training pushes)")
-        push_data_iter, push_data_count, _ = test_scheduling.get_push_data(
+        push_data_iter, push_data_count, all_runnables = test_scheduling.get_push_data(
             "label" if self.granularity == "label" else "config_group"
         )
         test_scheduling.generate_failing_together_probabilities(
             "label" if self.granularity == "label" else "config_group",
-            push_data_iter(),
+            lambda: push_data_iter(filtered=False),
             push_data_count,
             pushes[train_push_len - 1]["revs"][0],
+            all_runnables,
         )
 
         test_pushes_list = pushes[train_push_len:]
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Out-of-core training of the models.
+
+Instead of materializing all the features in memory, the items are extracted in
+chunks which are stored on disk. The vectorizers of the union are then fitted
+with two passes over the chunks (the first to collect the vocabulary and the
+document frequencies, the second to vectorize the items into an on-disk sparse
+matrix), and XGBoost is trained from an external memory DMatrix.
+
+The fitted union and estimator are the same objects which are fitted in memory,
+so the models trained out-of-core are used at inference time as usual.
+"""
+
+import itertools
+import logging
+import os
+import pickle
+from collections import Counter
+from numbers import Integral
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+import xgboost
+from imblearn.over_sampling import RandomOverSampler
+from imblearn.under_sampling import RandomUnderSampler
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from bugbug import feature_cache
+
+logger = logging.getLogger(__name__)
+
+OUT_OF_CORE_DIR = os.path.join("data", "out_of_core")
+
+OUT_OF_CORE_CHUNK_SIZE = 2**14
+
+
+class ChunkStore:
+    """A sequence of objects, each one pickled in its own file."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.num_chunks = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return self.num_chunks
+
+    def _path(self, i: int) -> str:
+        return os.path.join(self.directory, f"{i}.pickle")
+
+    def append(self, obj: Any) -> None:
+        with open(self._path(self.num_chunks), "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.num_chunks += 1
+
+    def __getitem__(self, i: int) -> Any:
+        with open(self._path(i), "rb") as f:
+            return pickle.load(f)
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self.num_chunks):
+            yield self[i]
+
+
+def _transform_chunks(
+    extraction_pipeline, items: Iterable[Any], chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    steps = extraction_pipeline.steps
+    if len(steps) == 1 and hasattr(steps[0][1], "extract_all"):
+        # A single extraction over all the items, so that the state of the
+        # extractor (e.g. the reporter experience) is kept from chunk to chunk.
+        features = steps[0][1].extract_all(lambda: items)
+        while True:
+            chunk = list(itertools.islice(features, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            yield pd.DataFrame(chunk)
+
+        return
+
+    if not feature_cache.is_order_independent(extraction_pipeline):
+        raise ValueError(
+            "Out-of-core training is not supported for extraction pipelines whose features depend on the order of the items"
+        )
+
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if len(chunk) == 0:
+            break
+
+        yield extraction_pipeline.transform(lambda: chunk)
+
+
+def extract(
+    extraction_pipeline,
+    items: Iterable[tuple[Any, Any]],
+    store: ChunkStore,
+    chunk_size: int | None = None,
+) -> list[Any]:
+    """Extract the features of the items in chunks, returning their labels.
+
+    The rows of the stored chunks are indexed by the position of their item.
+    """
+    if chunk_size is None:
+        chunk_size = OUT_OF_CORE_CHUNK_SIZE
+
+    y: list[Any] = []
+
+    def items_iter():
+        for item, label in items:
+            y.append(label)
+            yield item
+
+    start = 0
+    for X in _transform_chunks(extraction_pipeline, items_iter(), chunk_size):
+        X.index = pd.RangeIndex(start, start + len(X))
+        store.append(X)
+        start += len(X)
+
+        logger.info("Extracted features for %d items", start)
+
+    return y
+
+
+def select_rows(store: ChunkStore, indices: np.ndarray) -> Iterator[pd.DataFrame]:
+    """Iterate over the rows at the given (sorted) indices, chunk by chunk."""
+    start = 0
+    for X in store:
+        end = start + len(X)
+
+        chunk_indices = indices[
+            np.searchsorted(indices, start) : np.searchsorted(indices, end)
+        ]
+        if len(chunk_indices) > 0:
+            yield X.iloc[chunk_indices - start]
+
+        start = end
+
+
+class DictVectorizerVocabulary:
+    def __init__(self, transformer: DictVectorizer) -> None:
+        self.transformer = transformer
+        self.feature_names: dict[str, None] = {}
+
+    def update(self, values) -> None:
+        self.feature_names.update(
+            dict.fromkeys(clone(self.transformer).fit(values).feature_names_)
+        )
+
+    def finalize(self) -> None:
+        feature_names = list(self.feature_names)
+        if self.transformer.sort:
+            feature_names.sort()
+
+        self.transformer.feature_names_ = feature_names
+        self.transformer.vocabulary_ = {
+            feature_name: i for i, feature_name in enumerate(feature_names)
+        }
+
+
+class TextVectorizerVocabulary:
+    def __init__(self, transformer: CountVectorizer) -> None:
+        self.transformer = transformer
+        self.analyze = transformer.build_analyzer()
+        self.n_docs = 0
+        self.dfs: Counter = Counter()
+        self.tfs: Counter = Counter()
+
+    def update(self, values) -> None:
+        for doc in values:
+            counts = Counter(self.analyze(doc))
+            if self.transformer.fixed_vocabulary_:
+                counts = Counter(
+                    {
+                        term: count
+                        for term, count in counts.items()
+                        if term in self.transformer.vocabulary_
+                    }
+                )
+
+            self.n_docs += 1
+            self.dfs.update(counts.keys())
+            self.tfs.update(counts)
+
+    def finalize(self) -> None:
+        transformer = self.transformer
+
+        if not transformer.fixed_vocabulary_:
+            max_df = transformer.max_df
+            min_df = transformer.min_df
+            max_doc_count = (
+                max_df if isinstance(max_df, Integral) else max_df * self.n_docs
+            )
+            min_doc_count = (
+                min_df if isinstance(min_df, Integral) else min_df * self.n_docs
+            )
+            if max_doc_count < min_doc_count:
+                raise ValueError("max_df corresponds to < documents than min_df")
+
+            terms = sorted(self.dfs)
+            dfs = np.array([self.dfs[term] for term in terms], dtype=np.int64)
+            mask = (dfs <= max_doc_count) & (dfs >= min_doc_count)
+
+            max_features = transformer.max_features
+            if max_features is not None and mask.sum() > max_features:
+                if transformer.binary:
+                    tfs = dfs
+                else:
+                    tfs = np.array([self.tfs[term] for term in terms], dtype=np.int64)
+                mask_inds = (-tfs[mask]).argsort()[:max_features]
+                new_mask = np.zeros(len(dfs), dtype=bool)
+                new_mask[np.where(mask)[0][mask_inds]] = True
+                mask = new_mask
+
+            kept_terms = [term for term, keep in zip(terms, mask) if keep]
+            if len(kept_terms) == 0:
+                raise ValueError(
+                    "After pruning, no terms remain. Try a lower min_df or a higher max_df."
+                )
+
+            transformer.vocabulary_ = {term: i for i, term in enumerate(kept_terms)}
+
+        if isinstance(transformer, TfidfVectorizer) and transformer.use_idf:
+            df = np.zeros(len(transformer.vocabulary_), dtype=np.float64)
+            for term, i in transformer.vocabulary_.items():
+                df[i] = self.dfs[term]
+
+            # Same as TfidfTransformer.fit.
+            df += float(transformer.smooth_idf)
+            n_samples = self.n_docs + float(transformer.smooth_idf)
+            idf = np.log(n_samples / df) + 1.0
+
+            transformer._tfidf.n_features_in_ = len(idf)
+            transformer.idf_ = idf
+
+
+def fit_union(
+    union: ColumnTransformer, chunks: Callable[[], Iterator[pd.DataFrame]]
+) -> None:
+    """Fit the vocabulary-based transformers of the union over all the chunks.
+
+    The union is first fitted on the first chunk to create its fitted
+    transformers, whose vocabularies are then replaced by the ones collected
+    over all the chunks.
+    """
+    union.fit(next(chunks()))
+
+    vocabularies = []
+    for name, transformer, columns in union.transformers_:
+        if transformer == "drop":
+            continue
+
+        if isinstance(transformer, DictVectorizer):
+            vocabularies.append((DictVectorizerVocabulary(transformer), columns))
+        elif isinstance(transformer, CountVectorizer):
+            vocabularies.append((TextVectorizerVocabulary(transformer), columns))
+        else:
+            raise ValueError(
+                f"Out-of-core training is not supported for the {name} transformer ({type(transformer).__name__})"
+            )
+
+    for X in chunks():
+        for vocabulary, columns in vocabularies:
+            vocabulary.update(X[columns])
+
+    for vocabulary, _ in vocabularies:
+        vocabulary.finalize()
+
+    start = 0
+    union.output_indices_ = {}
+    for name, transformer, _ in union.transformers_:
+        if transformer == "drop":
+            continue
+
+        n_features = len(transformer.get_feature_names_out())
+        union.output_indices_[name] = slice(start, start + n_features)
+        start += n_features
+
+    for name in [name for name, _, _ in union.transformers] + ["remainder"]:
+        union.output_indices_.setdefault(name, slice(0, 0))
+
+
+def resample(sampler, indices: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Resample the items at the given indices, without looking at their features.
+
+    Only samplers which select existing items can be applied out-of-core.
+    """
+    if sampler is None or sampler == "passthrough":
+        return indices
+
+    if not isinstance(sampler, (RandomUnderSampler, RandomOverSampler)):
+        logger.warning(
+            "%s needs the features of the items, it is skipped in out-of-core training",
+            type(sampler).__name__,
+        )
+        return indices
+
+    sampler.fit_resample(indices.reshape(-1, 1), y)
+    return np.sort(indices[sampler.sample_indices_])
+
+
+def vectorize(
+    union: ColumnTransformer,
+    chunks: Iterable[pd.DataFrame],
+    y: np.ndarray,
+    store: ChunkStore,
+) -> None:
+    """Vectorize the chunks into an on-disk sparse matrix.
+
+    Whether the union outputs a sparse or dense matrix at inference time is
+    decided, like when fitting in memory, by the density of the whole matrix.
+    """
+    union.sparse_output_ = True
+
+    nnz = 0
+    total = 0
+    for X in chunks:
+        Xt = sparse.csr_matrix(union.transform(X))
+        store.append((Xt, y[X.index]))
+
+        nnz += Xt.nnz
+        total += Xt.shape[0] * Xt.shape[1]
+
+    union.sparse_output_ = total > 0 and nnz / total < union.sparse_threshold
+
+
+class ChunkStoreIter(xgboost.DataIter):
+    def __init__(self, store: ChunkStore, dense: bool, cache_prefix: str) -> None:
+        self.store = store
+        self.dense = dense
+        self.i = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data: Callable) -> bool:
+        if self.i == len(self.store):
+            return False
+
+        X, y = self.store[self.i]
+        # XGBoost treats zeros in sparse matrices as missing values, so we need to
+        # pass the same kind of matrix that the union outputs at inference time.
+        input_data(data=X.toarray() if self.dense else X, label=y)
+        self.i += 1
+        return True
+
+    def reset(self) -> None:
+        self.i = 0
+
+
+def fit_estimator(
+    estimator: xgboost.XGBClassifier,
+    store: ChunkStore,
+    dense: bool,
+    n_classes: int,
+    cache_prefix: str,
+) -> None:
+    """Train the estimator from an external memory DMatrix."""
+    if not isinstance(estimator, xgboost.XGBClassifier):
+        raise ValueError(
+            f"Out-of-core training is not supported for {type(estimator).__name__}"
+        )
+
+    dtrain = xgboost.DMatrix(
+        ChunkStoreIter(store, dense, cache_prefix), missing=estimator.missing
+    )
+
+    # Same as XGBClassifier.fit.
+    params = estimator.get_xgb_params()
+    if n_classes > 2:
+        if params.get("objective", None) != "multi:softmax":
+            params["objective"] = "multi:softprob"
+        params["num_class"] = n_classes
+
+    booster = xgboost.train(params, dtrain, estimator.get_num_boosting_rounds())
+
+    estimator.load_model(bytearray(booster.save_raw("ubj")))
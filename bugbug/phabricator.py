@@ -28,6 +28,7 @@ db.register(
     REVISIONS_DB,
     "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_revisions.latest/artifacts/public/revisions.json.zst",
     4,
+    log_structured=True,
 )
 
 FIXED_COMMENTS_DB = "data/fixed_comments.json"
@@ -5,6 +5,7 @@
 
 import argparse
 import concurrent.futures
+import contextlib
 import copy
 import itertools
 import json
@@ -20,10 +21,11 @@ import sys
 import threading
 from datetime import datetime
 from functools import lru_cache
-from typing import Collection, Iterable, Iterator, NewType, Set, Union
+from typing import Collection, Iterable, Iterator, NewType, Set
 
 import hglib
 import lmdb
+import numpy as np
 import rs_parsepatch
 import tenacity
 from tqdm import tqdm
@@ -43,11 +45,25 @@ thread_local = threading.local()
 
 COMMITS_DB = "data/commits.json"
 COMMIT_EXPERIENCES_DB = "commit_experiences.lmdb.tar.zst"
+
+# Number of commits whose files and patches are retrieved together.
+TRANSFORM_BATCH_SIZE = 64
+
+# Number of commits which are mined, stored and checkpointed together.
+MINING_CHUNK_SIZE = 4096
+
+# Key of the experiences DB holding the node of the last mined commit.
+MINING_CHECKPOINT_KEY = "mining_checkpoint"
+
+# Key of the experiences DB holding the next integer id to assign to a commit.
+NEXT_COMMIT_ID_KEY = "next_commit_id"
+
 db.register(
     COMMITS_DB,
     "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_commits.latest/artifacts/public/commits.json.zst",
     24,
     [COMMIT_EXPERIENCES_DB],
+    index_keys=["node", "bug_id"],
 )
 
 commit_to_coverage = None
@@ -303,9 +319,42 @@ def get_commits(
     include_no_bug: bool = False,
     include_backouts: bool = False,
     include_ignored: bool = False,
+    columns: list[str] | None = None,
+) -> Iterator[CommitDict]:
+    if columns is not None:
+        # The fields used for filtering are always needed.
+        columns = list(set(columns) | {"ignored", "bug_id", "backsout"})
+
+    return filter_commits(
+        db.read(COMMITS_DB, columns=columns),
+        include_no_bug=include_no_bug,
+        include_backouts=include_backouts,
+        include_ignored=include_ignored,
+    )
+
+
+def get_commits_by_nodes(
+    nodes: Iterable[str],
+    include_no_bug: bool = False,
+    include_backouts: bool = False,
+    include_ignored: bool = False,
+) -> Iterator[CommitDict]:
+    return filter_commits(
+        db.get_by_key(COMMITS_DB, nodes, "node"),
+        include_no_bug=include_no_bug,
+        include_backouts=include_backouts,
+        include_ignored=include_ignored,
+    )
+
+
+def get_commits_by_bug_ids(
+    bug_ids: Iterable[int],
+    include_no_bug: bool = False,
+    include_backouts: bool = False,
+    include_ignored: bool = False,
 ) -> Iterator[CommitDict]:
     return filter_commits(
-        db.read(COMMITS_DB),
+        db.get_by_key(COMMITS_DB, bug_ids, "bug_id"),
         include_no_bug=include_no_bug,
         include_backouts=include_backouts,
         include_ignored=include_ignored,
@@ -352,6 +401,22 @@ def is_test(path: str) -> bool:
     )
 
 
+def _set_modified_files(commit, files_str: bytes, file_copies_str: bytes) -> None:
+    file_copies = {}
+    for file_copy in file_copies_str.decode("utf-8").split("|"):
+        if not file_copy:
+            continue
+
+        parts = file_copy.split(" (")
+        copied = parts[0]
+        orig = parts[1][:-1]
+        file_copies[sys.intern(orig)] = sys.intern(copied)
+
+    commit.set_files(
+        [sys.intern(f) for f in files_str.decode("utf-8").split("|") if f], file_copies
+    )
+
+
 def hg_modified_files(hg, commit):
     template = '{join(files,"|")}\\0{join(file_copies,"|")}\\0'
     args = hglib.util.cmdbuilder(
@@ -364,19 +429,36 @@ def hg_modified_files(hg, commit):
     x = hg.rawcommand(args)
     files_str, file_copies_str = x.split(b"\x00")[:-1]
 
-    file_copies = {}
-    for file_copy in file_copies_str.decode("utf-8").split("|"):
-        if not file_copy:
-            continue
+    _set_modified_files(commit, files_str, file_copies_str)
 
-        parts = file_copy.split(" (")
-        copied = parts[0]
-        orig = parts[1][:-1]
-        file_copies[sys.intern(orig)] = sys.intern(copied)
 
-    commit.set_files(
-        [sys.intern(f) for f in files_str.decode("utf-8").split("|") if f], file_copies
+def hg_modified_files_batch(hg, commits):
+    """Set the modified files of several commits with a single command."""
+    if len(commits) == 0:
+        return
+
+    template = '{node}\\0{join(files,"|")}\\0{join(file_copies,"|")}\\0'
+    args = hglib.util.cmdbuilder(
+        b"log",
+        template=template,
+        no_merges=True,
+        rev=[commit.node.encode("ascii") for commit in commits],
+        branch="tip",
     )
+    x = hg.rawcommand(args)
+
+    files_by_node = {
+        node.decode("ascii"): (files_str, file_copies_str)
+        for node, files_str, file_copies_str in hglib.util.grouper(
+            3, x.split(b"\x00")[:-1]
+        )
+    }
+
+    for commit in commits:
+        if commit.node in files_by_node:
+            _set_modified_files(commit, *files_by_node[commit.node])
+        else:
+            hg_modified_files(hg, commit)
 
 
 def get_functions_from_metrics(metrics_space):
@@ -715,12 +797,99 @@ def set_commit_metrics(
         )
 
 
+def hg_export_batch(hg: hglib.client, nodes: list[str]) -> dict[str, bytes]:
+    """Export the patches of several commits with a single command."""
+    if len(nodes) == 0:
+        return {}
+
+    export = hg.export(revs=[node.encode("ascii") for node in nodes], git=True)
+
+    patches = {}
+    # If a commit message contains a patch header, we can't split the patches.
+    if export.count(b"# HG changeset patch\n") == len(nodes):
+        for patch in re.split(rb"(?m)^(?=# HG changeset patch\n)", export):
+            match = re.search(rb"^# Node ID ([0-9a-f]{40})$", patch, re.MULTILINE)
+            if match is not None:
+                patches[match.group(1).decode("ascii")] = patch
+
+    for node in nodes:
+        if node not in patches:
+            patches[node] = hg.export(revs=[node.encode("ascii")], git=True)
+
+    return patches
+
+
+def hg_cat_files(
+    hg: hglib.client, repo_dir: str, rev: bytes, paths: list[str]
+) -> dict[str, bytes]:
+    """Get the contents of several files at a revision with a single command.
+
+    The files which don't exist at the revision are left out.
+    """
+    if len(paths) == 0:
+        return {}
+
+    # The size of each file is output before its content, so that the output can
+    # be split whatever the content is.
+    args = hglib.util.cmdbuilder(
+        b"cat",
+        *[os.path.join(repo_dir, path).encode("utf-8") for path in paths],
+        r=rev,
+        T="{path}\\0{data|count}\\0{data}",
+    )
+    try:
+        out = hg.rawcommand(args)
+    except hglib.error.CommandError as e:
+        if b"no such file in rev" not in e.err:
+            raise
+
+        out = e.out
+
+    contents = {}
+    pos = 0
+    while pos < len(out):
+        path_end = out.index(b"\0", pos)
+        size_end = out.index(b"\0", path_end + 1)
+        size = int(out[path_end + 1 : size_end])
+        contents[out[pos:path_end].decode("utf-8")] = out[
+            size_end + 1 : size_end + 1 + size
+        ]
+        pos = size_end + 1 + size
+
+    return contents
+
+
+def needs_analysis(commit: Commit) -> bool:
+    return not (commit.ignored or len(commit.backsout) > 0 or commit.bug_id is None)
+
+
 def transform(hg: hglib.client, repo_dir: str, commit: Commit) -> Commit:
     hg_modified_files(hg, commit)
 
-    if commit.ignored or len(commit.backsout) > 0 or commit.bug_id is None:
+    if not needs_analysis(commit):
         return commit
 
+    patch = hg.export(revs=[commit.node.encode("ascii")], git=True)
+    return analyze_patch(hg, repo_dir, commit, patch)
+
+
+def transform_batch(
+    hg: hglib.client, repo_dir: str, commits: list[Commit]
+) -> list[Commit]:
+    """Same as `transform`, but with a few hg commands for the whole batch."""
+    hg_modified_files_batch(hg, commits)
+
+    commits_to_analyze = [commit for commit in commits if needs_analysis(commit)]
+    patches = hg_export_batch(hg, [commit.node for commit in commits_to_analyze])
+    for commit in commits_to_analyze:
+        analyze_patch(hg, repo_dir, commit, patches[commit.node])
+
+    return commits
+
+
+def analyze_patch(
+    hg: hglib.client, repo_dir: str, commit: Commit, patch: bytes
+) -> Commit:
     assert code_analysis_server is not None
 
     source_code_sizes = []
@@ -728,13 +897,23 @@ def transform(hg: hglib.client, repo_dir: str, commit: Commit) -> Commit:
     test_sizes = []
     metrics_file_count = 0
 
-    patch = hg.export(revs=[commit.node.encode("ascii")], git=True)
     try:
         patch_data = rs_parsepatch.get_lines(patch)
     except Exception:
         logger.error(f"Exception while analyzing {commit.node}")
         raise
 
+    contents = hg_cat_files(
+        hg,
+        repo_dir,
+        commit.node.encode("ascii"),
+        [
+            stats["filename"]
+            for stats in patch_data
+            if not stats["binary"] and not stats["deleted"]
+        ],
+    )
+
     for stats in patch_data:
         path = stats["filename"]
 
@@ -744,17 +923,9 @@ def transform(hg: hglib.client, repo_dir: str, commit: Commit) -> Commit:
             continue
 
         size = None
-        after = None
-        if not stats["deleted"]:
-            try:
-                after = hg.cat(
-                    [os.path.join(repo_dir, path).encode("utf-8")],
-                    rev=commit.node.encode("ascii"),
-                )
-                size = after.count(b"\n")
-            except hglib.error.CommandError as e:
-                if b"no such file in rev" not in e.err:
-                    raise
+        after = contents.get(path) if not stats["deleted"] else None
+        if after is not None:
+            size = after.count(b"\n")
 
         type_ = get_type(path)
 
@@ -787,18 +958,9 @@ def transform(hg: hglib.client, repo_dir: str, commit: Commit) -> Commit:
 
                         before_metrics = {}
                         if not stats["new"]:
-                            try:
-                                before = hg.cat(
-                                    [os.path.join(repo_dir, path).encode("utf-8")],
-                                    rev=commit.node.encode("ascii"),
-                                )
-
-                                before_metrics = code_analysis_server.metrics(
-                                    path, before, unit=False
-                                )
-                            except hglib.error.CommandError as e:
-                                if b"no such file in rev" not in e.err:
-                                    raise
+                            # The file is read at the same revision as above, so
+                            # its metrics are the same.
+                            before_metrics = after_metrics
 
                         set_commit_metrics(
                             commit,
@@ -866,8 +1028,8 @@ def transform(hg: hglib.client, repo_dir: str, commit: Commit) -> Commit:
     return commit
 
 
-def _transform(commit):
-    return transform(HG, REPO_DIR, commit)
+def _transform_batch(commits: list[Commit]) -> list[Commit]:
+    return transform_batch(HG, REPO_DIR, commits)
 
 
 def hg_log(
@@ -995,6 +1157,13 @@ class Experiences:
         if not save:
             self.mem_experiences = {}
 
+        # The lists of commits of DBs which were not migrated hold commit nodes. When
+        # they can't be migrated because they are read-only, they are converted on
+        # the fly, with the ids of the commits assigned in memory.
+        self.legacy_commit_ids: dict[str, int] | None = (
+            {} if not save and NEXT_COMMIT_ID_KEY not in self.db_experiences else None
+        )
+
     def __contains__(self, key):
         if self.save:
             return key in self.db_experiences
@@ -1017,13 +1186,91 @@ class Experiences:
         else:
             self.mem_experiences[key] = value
 
+    def get_checkpoint(self) -> str | None:
+        """Return the node of the last commit whose experiences were persisted."""
+        if not self.save:
+            return None
+
+        return self.db_experiences.get(MINING_CHECKPOINT_KEY)
+
+    def checkpoint(self, node: str) -> None:
+        """Persist the experiences, up to and including the commit `node`."""
+        assert self.save
+
+        self.db_experiences[MINING_CHECKPOINT_KEY] = node
+        # Write the cached values back to the DB and drop them from memory, then
+        # commit them together with the checkpoint.
+        self.db_experiences.sync()
+        self.db_experiences.dict.commit()
+
+    def close(self) -> None:
+        """Close the DB, discarding the changes made after the last checkpoint."""
+        if not isinstance(self.db_experiences, shelve.Shelf):
+            return
+
+        if self.save:
+            self.db_experiences.cache.clear()
+            self.db_experiences.dict.rollback()
+
+        self.db_experiences.close()
+
+
+def migrate_experiences() -> int:
+    """Convert the ExpQueues of the experiences DB to their compact variants.
+
+    Integer ExpQueues are converted to ArrayExpQueues, ExpQueues of tuples of
+    commit nodes to CommitListExpQueues.
+
+    Returns the number of converted values.
+    """
+    db_experiences = LMDBDict("data/commit_experiences.lmdb")
+
+    next_commit_id_key = NEXT_COMMIT_ID_KEY.encode("utf-8")
+
+    migrated = 0
+    try:
+        # The commit lists were already converted, and new integer ExpQueues
+        # are not written anymore.
+        if next_commit_id_key in db_experiences:
+            return 0
+
+        commit_ids: dict[str, int] = {}
+
+        for key in list(db_experiences.keys()):
+            value = pickle.loads(db_experiences[key])
+            if not isinstance(value, utils.ExpQueue):
+                continue
+
+            new_value: utils.ArrayExpQueue | utils.CommitListExpQueue
+            if isinstance(value.default, int):
+                new_value = utils.ArrayExpQueue.from_exp_queue(value)
+            else:
+                new_value = utils.CommitListExpQueue.from_exp_queue(value, commit_ids)
+
+            db_experiences[key] = pickle.dumps(
+                new_value, protocol=pickle.DEFAULT_PROTOCOL
+            )
+            migrated += 1
+
+        db_experiences[next_commit_id_key] = pickle.dumps(
+            len(commit_ids), protocol=pickle.DEFAULT_PROTOCOL
+        )
+    finally:
+        db_experiences.close()
+
+    return migrated
+
 
 def calculate_experiences(
-    commits: Collection[Commit], first_pushdate: datetime, save: bool = True
+    commits: Collection[Commit],
+    first_pushdate: datetime,
+    save: bool = True,
+    experiences: Experiences | None = None,
 ) -> None:
     logger.info("Analyzing seniorities from %d commits...", len(commits))
 
-    experiences = Experiences(save)
+    if experiences is None:
+        experiences = Experiences(save)
 
     for commit in tqdm(commits):
         key = f"first_commit_time${commit.author}"
@@ -1045,22 +1292,59 @@ def calculate_experiences(
         return f"{exp_type}${commit_type}${item}"
 
     def get_experience(
-        exp_type: str, commit_type: str, item: str, day: int, default: Union[int, tuple]
-    ) -> utils.ExpQueue:
+        exp_type: str, commit_type: str, item: str, day: int
+    ) -> utils.ExpQueue | utils.ArrayExpQueue:
         key = get_key(exp_type, commit_type, item)
         try:
             return experiences[key]
         except KeyError:
-            queue = utils.ExpQueue(day, EXPERIENCE_TIMESPAN + 1, default)
+            queue = utils.ArrayExpQueue(day, EXPERIENCE_TIMESPAN + 1, 0)
+            experiences[key] = queue
+            return queue
+
+    def get_commit_list_experience(
+        exp_type: str, commit_type: str, item: str, day: int
+    ) -> utils.CommitListExpQueue:
+        key = get_key(exp_type, commit_type, item)
+        try:
+            queue = experiences[key]
+        except KeyError:
+            queue = utils.CommitListExpQueue(day, EXPERIENCE_TIMESPAN + 1)
             experiences[key] = queue
             return queue
 
+        if not isinstance(queue, utils.CommitListExpQueue):
+            assert experiences.legacy_commit_ids is not None, (
+                "The experiences DB must be migrated with bugbug-migrate-exp-queues"
+            )
+            queue = utils.CommitListExpQueue.from_exp_queue(
+                queue, experiences.legacy_commit_ids
+            )
+            experiences[key] = queue
+
+        return queue
+
+    def count_commits(commit_lists: Collection[memoryview]) -> int:
+        # A commit is only once in the list of an item, so we only need to look for
+        # duplicates when there are multiple lists.
+        if len(commit_lists) <= 1:
+            return sum(len(commit_list) for commit_list in commit_lists)
+
+        return np.unique(
+            np.concatenate(
+                [
+                    np.frombuffer(commit_list, dtype=np.uint32)
+                    for commit_list in commit_lists
+                ]
+            )
+        ).size
+
     def update_experiences(
         experience_type: str, day: int, items: Collection[str]
     ) -> None:
         for commit_type in ("", "backout"):
             exp_queues = tuple(
-                get_experience(experience_type, commit_type, item, day, 0)
+                get_experience(experience_type, commit_type, item, day)
                 for item in items
             )
             total_exps = tuple(exp_queues[i][day] for i in range(len(items)))
@@ -1100,60 +1384,53 @@ def calculate_experiences(
                     exp_queues[i][day] = total_exps[i] + 1
 
     def update_complex_experiences(
-        experience_type: str, day: int, items: Collection[str]
+        experience_type: str, day: int, items: Collection[str], commit_id: int
     ) -> None:
         for commit_type in ("", "backout"):
             exp_queues = tuple(
-                get_experience(experience_type, commit_type, item, day, tuple())
+                get_commit_list_experience(experience_type, commit_type, item, day)
                 for item in items
             )
-            all_commit_lists = tuple(exp_queues[i][day] for i in range(len(items)))
-            before_commit_lists = tuple(
-                exp_queues[i][day - EXPERIENCE_TIMESPAN] for i in range(len(items))
+            all_commit_lens = tuple(exp_queue[day] for exp_queue in exp_queues)
+            before_commit_lens = tuple(
+                exp_queue[day - EXPERIENCE_TIMESPAN] for exp_queue in exp_queues
             )
-            timespan_commit_lists = tuple(
-                commit_list[len(before_commit_list) :]
-                for commit_list, before_commit_list in zip(
-                    all_commit_lists, before_commit_lists
+            timespan_commit_lens = tuple(
+                all_commit_len - before_commit_len
+                for all_commit_len, before_commit_len in zip(
+                    all_commit_lens, before_commit_lens
                 )
             )
 
-            all_commits = set(sum(all_commit_lists, tuple()))
-            timespan_commits = set(sum(timespan_commit_lists, tuple()))
-
             commit.set_experience(
                 experience_type,
                 commit_type,
                 "total",
-                len(all_commits),
-                max(
-                    (len(all_commit_list) for all_commit_list in all_commit_lists),
-                    default=0,
-                ),
-                min(
-                    (len(all_commit_list) for all_commit_list in all_commit_lists),
-                    default=0,
+                count_commits(
+                    tuple(
+                        exp_queue.get_ids(0, all_commit_len)
+                        for exp_queue, all_commit_len in zip(
+                            exp_queues, all_commit_lens
+                        )
+                    )
                 ),
+                max(all_commit_lens, default=0),
+                min(all_commit_lens, default=0),
             )
             commit.set_experience(
                 experience_type,
                 commit_type,
                 EXPERIENCE_TIMESPAN_TEXT,
-                len(timespan_commits),
-                max(
-                    (
-                        len(timespan_commit_list)
-                        for timespan_commit_list in timespan_commit_lists
-                    ),
-                    default=0,
-                ),
-                min(
-                    (
-                        len(timespan_commit_list)
-                        for timespan_commit_list in timespan_commit_lists
-                    ),
-                    default=0,
+                count_commits(
+                    tuple(
+                        exp_queue.get_ids(before_commit_len, all_commit_len)
+                        for exp_queue, before_commit_len, all_commit_len in zip(
+                            exp_queues, before_commit_lens, all_commit_lens
+                        )
+                    )
                 ),
+                max(timespan_commit_lens, default=0),
+                min(timespan_commit_lens, default=0),
             )
 
             # We don't want to consider backed out commits when calculating normal experiences.
@@ -1164,7 +1441,7 @@ def calculate_experiences(
                 and commit.backedoutby
             ):
                 for i in range(len(items)):
-                    exp_queues[i][day] = all_commit_lists[i] + (commit.node,)
+                    exp_queues[i].set(day, all_commit_lens[i], commit_id)
 
     for i, commit in enumerate(tqdm(commits)):
         # The push date is unreliable, e.g. 4d0e3037210dd03bdb21964a6a8c2e201c45794b was pushed after
@@ -1194,9 +1471,23 @@ def calculate_experiences(
             update_experiences("author", day, (commit.author,))
             update_experiences("reviewer", day, commit.reviewers)
 
-            update_complex_experiences("file", day, commit.files)
-            update_complex_experiences("directory", day, commit.directories)
-            update_complex_experiences("component", day, commit.components)
+            if experiences.legacy_commit_ids is not None:
+                # The ids of the commits of converted lists and of new commits must
+                # not overlap.
+                commit_id = experiences.legacy_commit_ids.setdefault(
+                    commit.node, len(experiences.legacy_commit_ids)
+                )
+            else:
+                commit_id = (
+                    experiences[NEXT_COMMIT_ID_KEY]
+                    if NEXT_COMMIT_ID_KEY in experiences
+                    else 0
+                )
+                experiences[NEXT_COMMIT_ID_KEY] = commit_id + 1
+
+            update_complex_experiences("file", day, commit.files, commit_id)
+            update_complex_experiences("directory", day, commit.directories, commit_id)
+            update_complex_experiences("component", day, commit.components, commit_id)
 
 
 def set_commits_to_ignore(
@@ -1334,7 +1625,65 @@ def get_first_pushdate(repo_dir):
         return hg_log(hg, [b"0"])[0].pushdate
 
 
-def download_commits(
+def _mine_commits_chunk(
+    hg: hglib.client,
+    repo_dir: str,
+    revs: list[bytes],
+    branch: str | None,
+    executor: concurrent.futures.Executor | None,
+) -> tuple[Commit, ...]:
+    if executor is not None:
+        commits = hg_log_multi(repo_dir, revs, branch)
+    else:
+        commits = hg_log(hg, revs, branch)
+
+    set_commits_to_ignore(hg, repo_dir, commits)
+
+    commits_num = len(commits)
+
+    logger.info("Mining %d patches...", commits_num)
+
+    commit_batches = [
+        list(commits[i : i + TRANSFORM_BATCH_SIZE])
+        for i in range(0, commits_num, TRANSFORM_BATCH_SIZE)
+    ]
+
+    if executor is not None:
+        commits_iter = executor.map(_transform_batch, commit_batches)
+        commits_iter = tqdm(commits_iter, total=len(commit_batches))
+        return tuple(itertools.chain.from_iterable(commits_iter))
+    else:
+        return tuple(
+            itertools.chain.from_iterable(
+                transform_batch(hg, repo_dir, batch) for batch in commit_batches
+            )
+        )
+
+
+def _discard_unfinished_commits(checkpoint: str) -> list[bytes]:
+    """Remove the commits stored after the checkpoint from the commits DB.
+
+    The commits of a chunk are appended to the DB before the experiences are
+    checkpointed, so if the checkpoint failed their experiences were discarded and
+    they need to be mined again. Returns their nodes, in the order they were mined.
+    """
+    nodes = [commit["node"] for commit in db.read(COMMITS_DB, columns=["node"])]
+    try:
+        checkpoint_index = nodes.index(checkpoint)
+    except ValueError:
+        return []
+
+    unfinished = set(nodes[checkpoint_index + 1 :])
+    if not unfinished:
+        return []
+
+    logger.info("Discarding %d commits mined after the checkpoint", len(unfinished))
+    db.delete(COMMITS_DB, lambda commit: commit["node"] in unfinished)
+
+    return [node.encode("ascii") for node in nodes[checkpoint_index + 1 :]]
+
+
+def mine_commits(
     repo_dir: str,
     rev_start: str | None = None,
     revs: list[bytes] | None = None,
@@ -1344,7 +1693,15 @@ def download_commits(
     include_no_bug: bool = False,
     include_backouts: bool = False,
     include_ignored: bool = False,
-) -> tuple[CommitDict, ...]:
+    chunk_size: int = MINING_CHUNK_SIZE,
+) -> Iterator[CommitDict]:
+    """Mine commits, `chunk_size` commits at a time.
+
+    When `save` is set, each chunk is appended to the commits DB and the experiences
+    are persisted along with a checkpoint of the last mined commit, so an interrupted
+    mining resumes from the checkpoint instead of starting over. The commits which
+    were stored after the checkpoint are mined again, even if they are not in `revs`.
+    """
     assert revs is not None or rev_start is not None
 
     with hglib.open(repo_dir) as hg:
@@ -1359,65 +1716,114 @@ def download_commits(
             logger.info("Downloading commit->coverage mapping...")
             download_coverage_mapping()
 
+        experiences = Experiences(save)
+
+        checkpoint = experiences.get_checkpoint()
+        if checkpoint is not None:
+            try:
+                checkpoint_index = revs.index(checkpoint.encode("ascii"))
+            except ValueError:
+                pass
+            else:
+                logger.info("Resuming mining after checkpoint %s", checkpoint)
+                revs = revs[checkpoint_index + 1 :]
+
+            unfinished_revs = _discard_unfinished_commits(checkpoint)
+            if unfinished_revs:
+                unfinished_revs_set = set(unfinished_revs)
+                revs = unfinished_revs + [
+                    rev for rev in revs if rev not in unfinished_revs_set
+                ]
+
         if len(revs) == 0:
             logger.info("No commits to analyze")
-            return tuple()
+            experiences.close()
+            return
 
         first_pushdate = get_first_pushdate(repo_dir)
 
         logger.info("Mining %d commits...", len(revs))
 
-        if not use_single_process:
-            logger.info("Using %d processes...", os.cpu_count())
-            commits = hg_log_multi(repo_dir, revs, branch)
-        else:
-            commits = hg_log(hg, revs, branch)
+        global code_analysis_server
 
-        set_commits_to_ignore(hg, repo_dir, commits)
+        with contextlib.ExitStack() as stack:
+            stack.callback(experiences.close)
 
-        commits_num = len(commits)
+            executor: concurrent.futures.Executor | None
+            if not use_single_process:
+                logger.info("Using %d processes...", os.cpu_count())
 
-        logger.info("Mining %d patches...", commits_num)
+                code_analysis_server = rust_code_analysis_server.get_server()
 
-        global code_analysis_server
+                executor = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(
+                        initializer=_init_process,
+                        initargs=(repo_dir,),
+                        # Fixing https://github.com/mozilla/bugbug/issues/3131
+                        mp_context=mp.get_context("fork"),
+                    )
+                )
+            else:
+                code_analysis_server = rust_code_analysis_server.get_server(1)
 
-        if not use_single_process:
-            code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer()
-
-            with concurrent.futures.ProcessPoolExecutor(
-                initializer=_init_process,
-                initargs=(repo_dir,),
-                # Fixing https://github.com/mozilla/bugbug/issues/3131
-                mp_context=mp.get_context("fork"),
-            ) as executor:
-                commits_iter = executor.map(_transform, commits, chunksize=64)
-                commits_iter = tqdm(commits_iter, total=commits_num)
-                commits = tuple(commits_iter)
-        else:
-            code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer(1)
+                executor = None
+
+                get_component_mapping()
+                stack.callback(close_component_mapping)
 
-            get_component_mapping()
+            for i in range(0, len(revs), chunk_size):
+                chunk_revs = revs[i : i + chunk_size]
 
-            commits = tuple(transform(hg, repo_dir, c) for c in commits)
+                logger.info(
+                    "Mining commits %d to %d of %d...",
+                    i + 1,
+                    i + len(chunk_revs),
+                    len(revs),
+                )
 
-            close_component_mapping()
+                commits = _mine_commits_chunk(
+                    hg, repo_dir, chunk_revs, branch, executor
+                )
 
-    code_analysis_server.terminate()
+                calculate_experiences(commits, first_pushdate, save, experiences)
 
-    calculate_experiences(commits, first_pushdate, save)
+                logger.info("Applying final commits filtering...")
 
-    logger.info("Applying final commits filtering...")
+                commit_dicts = tuple(commit.to_dict() for commit in commits)
 
-    commit_dicts = tuple(commit.to_dict() for commit in commits)
+                set_commit_coverage(commit_dicts)
 
-    set_commit_coverage(commit_dicts)
+                if save:
+                    db.append(COMMITS_DB, commit_dicts)
+                    experiences.checkpoint(chunk_revs[-1].decode("ascii"))
 
-    if save:
-        db.append(COMMITS_DB, commit_dicts)
+                yield from filter_commits(
+                    commit_dicts,
+                    include_no_bug=include_no_bug,
+                    include_backouts=include_backouts,
+                    include_ignored=include_ignored,
+                )
 
+
+def download_commits(
+    repo_dir: str,
+    rev_start: str | None = None,
+    revs: list[bytes] | None = None,
+    branch: str | None = "tip",
+    save: bool = True,
+    use_single_process: bool = False,
+    include_no_bug: bool = False,
+    include_backouts: bool = False,
+    include_ignored: bool = False,
+) -> tuple[CommitDict, ...]:
     return tuple(
-        filter_commits(
-            commit_dicts,
+        mine_commits(
+            repo_dir,
+            rev_start,
+            revs,
+            branch=branch,
+            save=save,
+            use_single_process=use_single_process,
             include_no_bug=include_no_bug,
             include_backouts=include_backouts,
             include_ignored=include_ignored,
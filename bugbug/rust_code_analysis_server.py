@@ -3,11 +3,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import atexit
+import concurrent.futures
+import hashlib
 import logging
+import os
+import shutil
 import subprocess
+import threading
 import time
+from typing import Iterable
 
+import lmdb
+import orjson
 import requests
+import zstandard
 
 from bugbug import utils
 
@@ -16,10 +26,121 @@ logger = logging.getLogger(__name__)
 
 START_RETRIES = 14
 HEADERS = {"Content-type": "application/octet-stream"}
+# Maximum number of concurrent requests (and pooled connections) to the server.
+MAX_CONNECTIONS = 8
+
+METRICS_CACHE_PATH = "data/code_analysis_metrics.lmdb"
+# Maximum size (in bytes) of the metrics cache, which is cleared when it is full.
+METRICS_CACHE_MAX_SIZE = 2**33
+
+
+class MetricsCache:
+    """A cache of the metrics of files, keyed by their content.
+
+    The same file contents recur across commits (backouts and relands, uplifts,
+    re-mining of the same commits), so their metrics don't need to be computed
+    again. The keys include the extension of the file, which determines its
+    language, and the version of rust-code-analysis.
+
+    The cache is shared by processes, and each process opens it on first use. Its
+    size is bounded by `max_size`, when it is full it is cleared.
+    """
+
+    def __init__(self, path: str, version: str, max_size: int = METRICS_CACHE_MAX_SIZE):
+        self.path = path
+        self.version = version
+        self.max_size = max_size
+        self._env: lmdb.Environment | None = None
+        self._env_pid: int | None = None
+        self._env_lock = threading.Lock()
+        self.cctx = zstandard.ZstdCompressor()
+        self.dctx = zstandard.ZstdDecompressor()
+
+    @property
+    def env(self) -> lmdb.Environment:
+        # LMDB environments can't be used by forked processes.
+        if self._env is None or self._env_pid != os.getpid():
+            # The cache is used by concurrent threads, e.g. in metrics_batch, and an
+            # environment must only be opened once per process.
+            with self._env_lock:
+                if self._env is None or self._env_pid != os.getpid():
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._env = lmdb.open(
+                        self.path,
+                        map_size=self.max_size,
+                        metasync=False,
+                        sync=False,
+                        meminit=False,
+                    )
+                    self._env_pid = os.getpid()
+
+        return self._env
+
+    def get_key(self, filename: str, code: bytes | str, unit: bool) -> bytes:
+        if isinstance(code, str):
+            code = code.encode("utf-8")
+
+        extension = os.path.splitext(filename)[1].lower()
+        return b"\0".join(
+            [
+                hashlib.sha256(code).digest(),
+                extension.encode("utf-8"),
+                b"1" if unit else b"0",
+                self.version.encode("utf-8"),
+            ]
+        )
+
+    def get(self, key: bytes, filename: str) -> dict | None:
+        with self.env.begin(buffers=True) as txn:
+            value = txn.get(key)
+            if value is None:
+                return None
+
+            cached_filename, metrics = orjson.loads(self.dctx.decompress(value))
+
+        # The metrics contain the name of the file they were computed for.
+        if metrics.get("id") == cached_filename:
+            metrics["id"] = filename
+        if metrics.get("spaces", {}).get("name") == cached_filename:
+            metrics["spaces"]["name"] = filename
+
+        return metrics
+
+    def clear(self) -> None:
+        with self.env.begin(write=True) as txn:
+            txn.drop(self.env.open_db(), delete=False)
+
+    def put(self, key: bytes, filename: str, metrics: dict) -> None:
+        value = self.cctx.compress(orjson.dumps([filename, metrics]))
+        try:
+            with self.env.begin(write=True) as txn:
+                txn.put(key, value)
+        except lmdb.MapFullError:
+            # The metrics of old versions of rust-code-analysis and of file contents
+            # which are not seen anymore are dropped along with the others.
+            logger.info("The metrics cache is full, clearing it")
+            self.clear()
+            with self.env.begin(write=True) as txn:
+                txn.put(key, value)
 
 
 class RustCodeAnalysisServer:
-    def __init__(self, thread_num: int | None = None):
+    def __init__(
+        self,
+        thread_num: int | None = None,
+        metrics_cache_path: str | None = METRICS_CACHE_PATH,
+    ):
+        self.proc = None
+        self.thread_num = thread_num
+        self._session: requests.Session | None = None
+        self._session_pid: int | None = None
+
+        self.metrics_cache = (
+            MetricsCache(metrics_cache_path, self.get_version())
+            if metrics_cache_path is not None
+            else None
+        )
+
         for _ in range(START_RETRIES):
             self.start_process(thread_num)
 
@@ -40,8 +161,40 @@ class RustCodeAnalysisServer:
     def base_url(self):
         return f"http://127.0.0.1:{self.port}"
 
+    @property
+    def session(self) -> requests.Session:
+        # The connections can't be shared with forked processes, so each process
+        # gets its own session.
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = requests.Session()
+            self._session.mount(
+                "http://",
+                requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=MAX_CONNECTIONS
+                ),
+            )
+            self._session_pid = os.getpid()
+
+        return self._session
+
+    @staticmethod
+    def get_version() -> str:
+        path = shutil.which("rust-code-analysis-web")
+        if path is None:
+            raise RuntimeError("rust-code-analysis is required for code analysis")
+
+        try:
+            return subprocess.run(
+                [path, "--version"], check=True, capture_output=True, text=True
+            ).stdout.strip()
+        except subprocess.CalledProcessError:
+            # Identify the version by the executable itself.
+            stat = os.stat(path)
+            return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
     def start_process(self, thread_num: int | None = None):
         self.port = utils.get_free_tcp_port()
+        self.pid = os.getpid()
 
         try:
             cmd = ["rust-code-analysis-web", "--port", str(self.port)]
@@ -55,12 +208,20 @@ class RustCodeAnalysisServer:
         if self.proc is not None:
             self.proc.terminate()
 
+    def is_running(self) -> bool:
+        # Only the process which started the server can check its status, the
+        # processes forked from it check that it still answers.
+        if os.getpid() != self.pid:
+            return self.ping()
+
+        return self.proc.poll() is None
+
     def __str__(self):
         return f"Server running at {self.base_url}"
 
     def ping(self):
         try:
-            r = requests.get(f"{self.base_url}/ping")
+            r = self.session.get(f"{self.base_url}/ping")
             return r.ok
         except requests.exceptions.ConnectionError:
             return False
@@ -75,11 +236,76 @@ class RustCodeAnalysisServer:
                 returned, when False, then we get detailed metrics for all
                 classes, functions, nested functions, ...
         """
-        unit = 1 if unit else 0
-        url = f"{self.base_url}/metrics?file_name={filename}&unit={unit}"
-        r = requests.post(url, data=code, headers=HEADERS)
+        if self.metrics_cache is not None:
+            key = self.metrics_cache.get_key(filename, code, unit)
+            metrics = self.metrics_cache.get(key, filename)
+            if metrics is not None:
+                return metrics
+
+        url = f"{self.base_url}/metrics?file_name={filename}&unit={1 if unit else 0}"
+        r = self.session.post(url, data=code, headers=HEADERS)
 
         if not r.ok:
             return {}
 
-        return r.json()
+        metrics = r.json()
+
+        if self.metrics_cache is not None:
+            self.metrics_cache.put(key, filename, metrics)
+
+        return metrics
+
+    def metrics_batch(
+        self, files: Iterable[tuple[str, bytes | str]], unit: bool = True
+    ) -> list[dict]:
+        """Get code metrics for many files, with concurrent pooled requests.
+
+        Args:
+            files: the (path, content) pairs of the files that we want to analyze
+            unit: see `metrics`
+        """
+        with concurrent.futures.ThreadPoolExecutor(MAX_CONNECTIONS) as executor:
+            return list(
+                executor.map(
+                    lambda file: self.metrics(file[0], file[1], unit=unit), files
+                )
+            )
+
+
+_server: RustCodeAnalysisServer | None = None
+_server_lock = threading.Lock()
+
+
+def get_server(thread_num: int | None = None) -> RustCodeAnalysisServer:
+    """Get the server shared by the process, starting it on first use.
+
+    The server keeps running until the process exits, and is also used by the
+    processes forked after it was started. A process which finds that the server
+    stopped starts a new one for itself.
+
+    Args:
+        thread_num: the number of threads of the server, if it needs to be started
+    """
+    global _server
+
+    with _server_lock:
+        if _server is None or not _server.is_running():
+            _server = RustCodeAnalysisServer(thread_num)
+            atexit.register(_terminate_server, _server)
+        elif (
+            thread_num is not None
+            and _server.thread_num is not None
+            and thread_num > _server.thread_num
+        ):
+            logger.warning(
+                "The rust-code-analysis server was started with %d threads, fewer than %d",
+                _server.thread_num,
+                thread_num,
+            )
+
+        return _server
+
+
+def _terminate_server(server: RustCodeAnalysisServer) -> None:
+    if os.getpid() == server.pid:
+        server.terminate()
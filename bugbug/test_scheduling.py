@@ -4,14 +4,15 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import collections
+import copy
 import itertools
 import logging
 import os
 import pickle
 import re
-import shelve
 import shutil
 import struct
+from array import array
 from datetime import datetime
 from typing import (
     Any,
@@ -26,10 +27,18 @@ from typing import (
     cast,
 )
 
+import numpy as np
+import scipy.sparse as sp
 from tqdm import tqdm
 
 from bugbug import db, repository
-from bugbug.utils import ExpQueue, LMDBDict, get_session, get_user_agent
+from bugbug.utils import (
+    ArrayExpQueue,
+    ExpQueue,
+    LMDBDict,
+    get_session,
+    get_user_agent,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,15 +55,22 @@ PushResult = tuple[
     tuple[Runnable, ...],
     tuple[Runnable, ...],
 ]
+# Sorted ids of the runnables of a row, and of the ones which failed.
+CouplesRow = tuple[array, array]
 
 TEST_LABEL_SCHEDULING_DB = "data/test_label_scheduling_history.pickle"
 PAST_FAILURES_LABEL_DB = "past_failures_label.lmdb.tar.zst"
 FAILING_TOGETHER_LABEL_DB = "failing_together_label.lmdb.tar.zst"
+FAILING_TOGETHER_COUNTS_LABEL_DB = "failing_together_counts_label.pickle.zst"
 db.register(
     TEST_LABEL_SCHEDULING_DB,
     "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_test_label_scheduling_history.latest/artifacts/public/test_label_scheduling_history.pickle.zst",
     13,
-    [PAST_FAILURES_LABEL_DB, FAILING_TOGETHER_LABEL_DB],
+    [
+        PAST_FAILURES_LABEL_DB,
+        FAILING_TOGETHER_LABEL_DB,
+        FAILING_TOGETHER_COUNTS_LABEL_DB,
+    ],
 )
 PUSH_DATA_LABEL_DB = "data/push_data_label.json"
 db.register(
@@ -82,11 +98,18 @@ db.register(
 TEST_CONFIG_GROUP_SCHEDULING_DB = "data/test_config_group_scheduling_history.pickle"
 PAST_FAILURES_CONFIG_GROUP_DB = "past_failures_config_group.lmdb.tar.zst"
 FAILING_TOGETHER_CONFIG_GROUP_DB = "failing_together_config_group.lmdb.tar.zst"
+FAILING_TOGETHER_COUNTS_CONFIG_GROUP_DB = (
+    "failing_together_counts_config_group.pickle.zst"
+)
 db.register(
     TEST_CONFIG_GROUP_SCHEDULING_DB,
     "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_test_config_group_scheduling_history.latest/artifacts/public/test_config_group_scheduling_history.pickle.zst",
     20,
-    [PAST_FAILURES_CONFIG_GROUP_DB, FAILING_TOGETHER_CONFIG_GROUP_DB],
+    [
+        PAST_FAILURES_CONFIG_GROUP_DB,
+        FAILING_TOGETHER_CONFIG_GROUP_DB,
+        FAILING_TOGETHER_COUNTS_CONFIG_GROUP_DB,
+    ],
 )
 PUSH_DATA_CONFIG_GROUP_DB = "data/push_data_config_group.json"
 db.register(
@@ -124,17 +147,25 @@ class UnexpectedGranularityError(ValueError):
 
 
 def filter_runnables(
-    runnables: tuple[Runnable, ...], all_runnables: Set[Runnable], granularity: str
+    runnables: tuple[Runnable, ...],
+    all_runnables: Set[Runnable] | None,
+    granularity: str,
 ) -> tuple[Any, ...]:
+    """Filter out the runnables we don't need.
+
+    If `all_runnables` is None, runnables are not filtered by their presence in it.
+    """
     if granularity == "label":
         tasks = cast(list[Task], runnables)
         return tuple(
             task
             for task in tasks
-            if task in all_runnables
+            if (all_runnables is None or task in all_runnables)
             and any(task.startswith(j) for j in JOBS_TO_CONSIDER)
             and not any(j in task for j in JOBS_TO_IGNORE)
         )
+    elif all_runnables is None:
+        return tuple(runnables)
     else:
         return tuple(runnable for runnable in runnables if runnable in all_runnables)
 
@@ -195,7 +226,7 @@ def rename_runnables(
 
 def get_push_data(
     granularity: str,
-) -> tuple[Callable[[], Iterator[PushResult]], int, tuple[Runnable, ...]]:
+) -> tuple[Callable[..., Iterator[PushResult]], int, tuple[Runnable, ...]]:
     if granularity == "label":
         push_data_db = PUSH_DATA_LABEL_DB
     elif granularity == "group":
@@ -253,24 +284,29 @@ def get_push_data(
     all_runnables_set = set(all_runnables)
     logger.info("%d runnables run in the last 28 pushes", len(all_runnables_set))
 
-    def push_data_iter() -> Iterator[PushResult]:
+    def push_data_iter(filtered: bool = True) -> Iterator[PushResult]:
+        """Iterate over the push data.
+
+        If `filtered` is False, runnables which didn't run in the last pushes are kept.
+        """
+        runnables_filter = all_runnables_set if filtered else None
         return (
             (
                 revisions,
                 fix_revision,
                 filter_runnables(
                     rename_runnables(granularity, push_tasks),
-                    all_runnables_set,
+                    runnables_filter,
                     granularity,
                 ),
                 filter_runnables(
                     rename_runnables(granularity, possible_regressions),
-                    all_runnables_set,
+                    runnables_filter,
                     granularity,
                 ),
                 filter_runnables(
                     rename_runnables(granularity, likely_regressions),
-                    all_runnables_set,
+                    runnables_filter,
                     granularity,
                 ),
             )
@@ -309,61 +345,175 @@ def get_test_scheduling_history(granularity):
         yield obj["revs"], obj["data"]
 
 
+# Maximum number of decoded past failures entries kept in memory.
+PAST_FAILURES_CACHE_SIZE = 2**19
+
+PastFailuresValue = Union[ExpQueue, ArrayExpQueue]
+
+# Prefix of the binary encoded ArrayExpQueue values in the past failures DB.
+# Values without it are pickled ExpQueue objects written by older versions.
+PAST_FAILURES_ENCODING_PREFIX = b"\x01"
+
+
+def _decode_past_failures(value: bytes) -> PastFailuresValue:
+    if value[:1] == PAST_FAILURES_ENCODING_PREFIX:
+        return ArrayExpQueue.from_bytes(value, len(PAST_FAILURES_ENCODING_PREFIX))
+
+    return pickle.loads(value)
+
+
+def _encode_past_failures(value: PastFailuresValue) -> bytes:
+    if isinstance(value, ExpQueue):
+        value = ArrayExpQueue.from_exp_queue(value)
+
+    return PAST_FAILURES_ENCODING_PREFIX + value.to_bytes()
+
+
+def get_past_failures_db_path(granularity: str) -> str:
+    if granularity == "label":
+        path = PAST_FAILURES_LABEL_DB
+    elif granularity == "group":
+        path = PAST_FAILURES_GROUP_DB
+    elif granularity == "config_group":
+        assert False, "config_group granularity not supported for past failures"
+    else:
+        raise UnexpectedGranularityError(granularity)
+
+    return os.path.join("data", path[: -len(".tar.zst")])
+
+
 class PastFailures:
-    def __init__(self, granularity, readonly):
-        if granularity == "label":
-            past_failures_db = os.path.join("data", PAST_FAILURES_LABEL_DB)
-        elif granularity == "group":
-            past_failures_db = os.path.join("data", PAST_FAILURES_GROUP_DB)
-        elif granularity == "config_group":
-            assert False, "config_group granularity not supported for past failures"
-        else:
-            raise UnexpectedGranularityError(granularity)
+    def __init__(self, granularity, readonly, cache_size=PAST_FAILURES_CACHE_SIZE):
         self.granularity = granularity
+        self.readonly = readonly
+
+        self.db = LMDBDict(get_past_failures_db_path(granularity), readonly=readonly)
 
-        self.db = shelve.Shelf(
-            LMDBDict(past_failures_db[: -len(".tar.zst")], readonly=readonly),
-            protocol=pickle.DEFAULT_PROTOCOL,
-            writeback=not readonly,
+        # LRU cache of the decoded values (None for keys which are not in the DB).
+        # In write mode, the values which were set are written back when they are
+        # evicted or on sync.
+        self.cache: collections.OrderedDict[str, PastFailuresValue | None] = (
+            collections.OrderedDict()
         )
+        self.cache_size = cache_size
+        self.dirty: set[str] = set()
 
     @property
     def push_num(self) -> int:
-        return self.db["push_num"]
+        return pickle.loads(self.db[b"push_num"])
 
     @push_num.setter
     def push_num(self, value: int) -> None:
-        self.db["push_num"] = value
+        self.db[b"push_num"] = pickle.dumps(value, protocol=pickle.DEFAULT_PROTOCOL)
 
     @property
     def all_runnables(self):
-        return self.db["all_runnables"]
+        return pickle.loads(self.db[b"all_runnables"])
 
     @all_runnables.setter
     def all_runnables(self, value) -> None:
-        self.db["all_runnables"] = value
+        self.db[b"all_runnables"] = pickle.dumps(
+            value, protocol=pickle.DEFAULT_PROTOCOL
+        )
 
-    def get(self, key: str) -> ExpQueue | None:
-        value = self.db.get(key, None)
+    def _write(self, key: str, value: PastFailuresValue | None) -> None:
+        if not self.readonly and value is not None:
+            self.db[key.encode("utf-8")] = _encode_past_failures(value)
+
+    def _cache(self, key: str, value: PastFailuresValue | None) -> None:
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.cache_size:
+            key, value = self.cache.popitem(last=False)
+            if key in self.dirty:
+                self.dirty.remove(key)
+                self._write(key, value)
+
+    def _load(self, key: str) -> PastFailuresValue | None:
+        try:
+            value = self.cache[key]
+            self.cache.move_to_end(key)
+            return value
+        except KeyError:
+            pass
+
+        try:
+            value = _decode_past_failures(self.db[key.encode("utf-8")])
+        except KeyError:
+            value = None
+
+        self._cache(key, value)
+        return value
+
+    def prefetch(self, keys: Iterable[str]) -> None:
+        """Load the values of the given keys in the cache with a single DB pass."""
+        to_read = set()
+        for key in keys:
+            if key in self.cache:
+                continue
+
+            to_read.add(key.encode("utf-8"))
+
+            if self.granularity == "group" and key.endswith(".toml"):
+                to_read.add(f"{key[:-4]}ini".encode("utf-8"))
+
+        # Decode everything before caching, as caching might write to the DB.
+        values = {
+            key: _decode_past_failures(value)
+            for key, value in self.db.getmulti(to_read)
+        }
+
+        for key in to_read:
+            self._cache(key.decode("utf-8"), values.get(key))
+
+    def get(self, key: str) -> PastFailuresValue | None:
+        value = self._load(key)
 
         # Fallback on INI if the group is now TOML.
         if value is None and self.granularity == "group" and key.endswith(".toml"):
-            ini_key = f"{key[:-4]}ini"
-            try:
-                value = self.db[ini_key]
-                self.db[key] = value
-            except KeyError:
+            value = self._load(f"{key[:-4]}ini")
+            if value is None:
                 return None
 
+            value = copy.deepcopy(value)
+            self._cache(key, value)
+
         return value
 
-    def set(self, key: str, value: ExpQueue) -> None:
-        self.db[key] = value
+    def set(self, key: str, value: PastFailuresValue) -> None:
+        """Store a value, which must also be called after updating it in place."""
+        self.dirty.add(key)
+        self._cache(key, value)
 
     def sync(self) -> None:
-        self.db.sync()
+        for key in self.dirty:
+            self._write(key, self.cache[key])
+        self.dirty.clear()
+
+    def migrate(self) -> int:
+        """Re-encode values pickled by older versions, returning their number."""
+        assert not self.readonly
+        self.sync()
+        self.cache.clear()
+
+        migrated = 0
+        for key in list(self.db.keys()):
+            if key in (b"push_num", b"all_runnables"):
+                continue
+
+            value = self.db[key]
+            if value[:1] == PAST_FAILURES_ENCODING_PREFIX:
+                continue
+
+            self.db[key] = _encode_past_failures(pickle.loads(value))
+            migrated += 1
+
+        return migrated
 
     def close(self) -> None:
+        if not self.readonly:
+            self.sync()
         self.db.close()
 
 
@@ -410,73 +560,411 @@ def close_failing_together_db(granularity: str) -> None:
     failing_together.pop(granularity)
 
 
-def generate_failing_together_probabilities(
-    granularity: str,
-    push_data: Iterator[PushResult],
-    push_data_count: int,
-    up_to: str | None = None,
-) -> None:
-    # TODO: we should consider the probabilities of `task1 failure -> task2 failure` and
-    # `task2 failure -> task1 failure` separately, as they could be different.
+# Number of rows (pushes, or groups in a push at config/group granularity) whose
+# couples are counted at once with a sparse matrix product.
+FAILING_TOGETHER_CHUNK_SIZE = 1024
 
-    remove_failing_together_db(granularity)
+# Version of the format of the stored failing together counts, counts stored with
+# a different version are recomputed from scratch.
+FAILING_TOGETHER_COUNTS_VERSION = 2
+
+
+def _rows_to_matrix(
+    rows: list[list[int]], columns: int, signs: list[int] | None = None
+) -> sp.csr_matrix:
+    lengths = [len(row) for row in rows]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths)
+    indices = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int32)
+    if signs is None:
+        data = np.ones(len(indices), dtype=np.int32)
+    else:
+        data = np.repeat(np.array(signs, dtype=np.int32), lengths)
+    return sp.csr_matrix((data, indices, indptr), shape=(len(rows), columns))
+
+
+class CouplesCounter:
+    """Count how many times couples of runnables ran together and failed.
+
+    Runnables are interned to integer ids, and the counts are accumulated in
+    upper triangular sparse matrices indexed by those ids. Rows are buffered and
+    counted in chunks, as the products of their run and failure matrices.
+    """
+
+    def __init__(self) -> None:
+        self.runnables: list[Runnable] = []
+        self.runnable_ids: dict[Runnable, int] = {}
+
+        self.runs = sp.csr_matrix((0, 0), dtype=np.int32)
+        self.single_failures = sp.csr_matrix((0, 0), dtype=np.int32)
+        self.both_failures = sp.csr_matrix((0, 0), dtype=np.int32)
+        # Number of rows in which each runnable ran.
+        self.run_counts = np.zeros(0, dtype=np.int64)
+
+        self.run_rows: list[array] = []
+        self.failure_rows: list[array] = []
+        self.row_signs: list[int] = []
+
+    def _intern(self, runnable: Runnable) -> int:
+        runnable_id = self.runnable_ids.get(runnable)
+        if runnable_id is None:
+            runnable_id = self.runnable_ids[runnable] = len(self.runnables)
+            self.runnables.append(runnable)
+        return runnable_id
+
+    def intern_row(
+        self, runnables: Iterable[Runnable], failures: Set[Runnable]
+    ) -> CouplesRow:
+        """Convert a row to the sorted ids of its runnables and failed runnables."""
+        run_row = array("i", sorted(self._intern(runnable) for runnable in runnables))
+        failure_row = array(
+            "i",
+            (
+                runnable_id
+                for runnable_id in run_row
+                if self.runnables[runnable_id] in failures
+            ),
+        )
+        return run_row, failure_row
+
+    def add_row(self, row: CouplesRow, sign: int = 1) -> None:
+        """Count an interned row, or undo its counting if `sign` is -1."""
+        run_row, failure_row = row
+        self.run_rows.append(run_row)
+        self.failure_rows.append(failure_row)
+        self.row_signs.append(sign)
+
+        if len(self.run_rows) >= FAILING_TOGETHER_CHUNK_SIZE:
+            self.flush()
+
+    def add(self, runnables: Iterable[Runnable], failures: Set[Runnable]) -> None:
+        """Count the couples of distinct runnables which ran together."""
+        self.add_row(self.intern_row(runnables, failures))
+
+    def remove(self, runnables: Iterable[Runnable], failures: Set[Runnable]) -> None:
+        """Undo the counting of a row which was previously added."""
+        self.add_row(self.intern_row(runnables, failures), -1)
+
+    def flush(self) -> None:
+        if len(self.run_rows) == 0:
+            return
+
+        n = len(self.runnables)
+        runs = _rows_to_matrix(self.run_rows, n)
+        failures = _rows_to_matrix(self.failure_rows, n)
+        # Removed rows are counted negatively, by signing one side of the products.
+        signed_runs = _rows_to_matrix(self.run_rows, n, self.row_signs)
+        signed_failures = _rows_to_matrix(self.failure_rows, n, self.row_signs)
+        self.run_rows = []
+        self.failure_rows = []
+        self.row_signs = []
+
+        run_counts = np.asarray(signed_runs.sum(axis=0)).ravel()
+        self.run_counts = (
+            np.pad(self.run_counts, (0, n - len(self.run_counts))) + run_counts
+        )
 
-    count_runs: collections.Counter = collections.Counter()
-    count_single_failures: collections.Counter = collections.Counter()
-    count_both_failures: collections.Counter = collections.Counter()
+        both_failures = signed_failures.T @ failures
+        failures_runs = signed_failures.T @ runs
+        # Rows where only one of the two runnables failed.
+        single_failures = failures_runs + failures_runs.T - 2 * both_failures
+
+        for name, counts in (
+            ("runs", signed_runs.T @ runs),
+            ("single_failures", single_failures),
+            ("both_failures", both_failures),
+        ):
+            counts = sp.triu(counts, k=1, format="csr")
+
+            accumulated = getattr(self, name)
+            accumulated.resize((n, n))
+            accumulated = accumulated + counts
+            accumulated.eliminate_zeros()
+            setattr(self, name, accumulated)
+
+    def runnables_ran(self) -> list[Runnable]:
+        """Return the runnables which are part of at least one counted row."""
+        self.flush()
+
+        return [
+            self.runnables[runnable_id]
+            for runnable_id in np.flatnonzero(self.run_counts).tolist()
+        ]
+
+    def couples(
+        self,
+    ) -> Iterator[tuple[tuple[Runnable, Runnable], int, int, int]]:
+        """Yield the couples which ran together, with their run, single failure
+        and both failures counts.
+
+        The runnables in a couple are sorted.
+        """
+        self.flush()
+
+        runs = self.runs.tocoo()
+        single_failures = np.asarray(self.single_failures[runs.row, runs.col]).ravel()
+        both_failures = np.asarray(self.both_failures[runs.row, runs.col]).ravel()
+
+        for i, j, run_count, single_failure_count, failure_count in zip(
+            runs.row.tolist(),
+            runs.col.tolist(),
+            runs.data.tolist(),
+            single_failures.tolist(),
+            both_failures.tolist(),
+        ):
+            runnable1 = self.runnables[i]
+            runnable2 = self.runnables[j]
+            if runnable2 < runnable1:
+                runnable1, runnable2 = runnable2, runnable1
+
+            yield (
+                (runnable1, runnable2),
+                run_count,
+                single_failure_count,
+                failure_count,
+            )
 
-    def count_runs_and_failures(tasks):
-        for task1, task2 in itertools.combinations(sorted(tasks), 2):
-            count_runs[(task1, task2)] += 1
 
-            if task1 in failures:
-                if task2 in failures:
-                    count_both_failures[(task1, task2)] += 1
-                else:
-                    count_single_failures[(task1, task2)] += 1
-            elif task2 in failures:
-                count_single_failures[(task1, task2)] += 1
+class FailingTogetherCounts:
+    """Raw counts from which the failing together probabilities are derived.
 
-    all_available_configs: Set[str] = set()
-    available_configs_by_group: dict[Group, Set[str]] = collections.defaultdict(set)
+    They are persisted between runs, so that new pushes can be counted
+    incrementally. All runnables are counted, so that the counts don't depend on
+    which runnables are considered when the probabilities are generated.
+    """
+
+    def __init__(self, granularity: str) -> None:
+        self.version = FAILING_TOGETHER_COUNTS_VERSION
+        self.granularity = granularity
+        self.couples_counter = CouplesCounter()
+        # The first revision of each counted push.
+        self.revisions: list[Revision] = []
+        # The rows counted for each push, so that their counting can be undone when
+        # the push is removed from the push data or its data changes.
+        self.push_rows: list[list[CouplesRow]] = []
+
+    def _rows(self, push: PushResult) -> list[CouplesRow]:
+        revisions, fix_revision, tasks, likely_regressions, candidate_regressions = push
 
-    for (
-        revisions,
-        fix_revision,
-        tasks,
-        likely_regressions,
-        candidate_regressions,
-    ) in tqdm(push_data, total=push_data_count):
         failures = set(likely_regressions + candidate_regressions)
-        all_tasks_set = set(tasks) | failures
-        all_tasks = list(all_tasks_set)
+        all_tasks = list(set(tasks) | failures)
 
         # At config/group granularity, only consider redundancy between the same manifest
         # on different configurations, and not between manifests too.
-        if granularity == "config_group":
-            all_available_configs.update(config for config, group in all_tasks)
-            for config, group in all_tasks:
-                available_configs_by_group[group].add(config)
-
+        if self.granularity == "config_group":
             groups = itertools.groupby(
                 sorted(all_tasks, key=lambda x: x[1]), key=lambda x: x[1]
             )
-            for manifest, group_tasks in groups:
-                count_runs_and_failures(group_tasks)
+            return [
+                self.couples_counter.intern_row(group_tasks, failures)
+                for manifest, group_tasks in groups
+            ]
+        else:
+            return [self.couples_counter.intern_row(all_tasks, failures)]
+
+    def _remove_rows(self, rows: list[CouplesRow]) -> None:
+        for row in rows:
+            self.couples_counter.add_row(row, -1)
+
+    def add(self, push: PushResult) -> None:
+        rows = self._rows(push)
+        for row in rows:
+            self.couples_counter.add_row(row)
+
+        self.revisions.append(push[0][0])
+        self.push_rows.append(rows)
+
+    def remove_first(self, count: int) -> None:
+        """Remove the counts of the first `count` pushes."""
+        for rows in self.push_rows[:count]:
+            self._remove_rows(rows)
+
+        del self.revisions[:count]
+        del self.push_rows[:count]
+
+    def remove_after(self, up_to: str) -> None:
+        """Remove the counts of the pushes following the `up_to` revision."""
+        try:
+            last = self.revisions.index(up_to)
+        except ValueError:
+            raise ValueError(f"Push {up_to} was not counted") from None
+
+        for rows in self.push_rows[last + 1 :]:
+            self._remove_rows(rows)
+
+        del self.revisions[last + 1 :]
+        del self.push_rows[last + 1 :]
+
+    def update(self, push_data: Iterable[PushResult]) -> bool:
+        """Update the counts to match the given push data.
+
+        Counted pushes which are not at the beginning of the push data anymore are
+        removed, pushes whose data changed are counted again and new pushes are
+        added.
+
+        Returns False if the counted pushes are not in the same order in the push
+        data, in which case the counts must be computed from scratch.
+        """
+        position = None
+        for push in push_data:
+            revision = push[0][0]
+
+            if position is None:
+                # Remove the pushes which went out of the push data window.
+                try:
+                    expired = self.revisions.index(revision)
+                except ValueError:
+                    expired = len(self.revisions)
+                self.remove_first(expired)
+                position = 0
+
+            if position == len(self.revisions):
+                self.add(push)
+            elif self.revisions[position] != revision:
+                return False
+            else:
+                rows = self._rows(push)
+                if rows != self.push_rows[position]:
+                    self._remove_rows(self.push_rows[position])
+                    for row in rows:
+                        self.couples_counter.add_row(row)
+                    self.push_rows[position] = rows
+
+            position += 1
+
+        # Remove the pushes which are not in the push data anymore.
+        if position is None:
+            self.remove_first(len(self.revisions))
+        elif position < len(self.revisions):
+            self.remove_after(self.revisions[position - 1])
+
+        self.couples_counter.flush()
+
+        return True
+
+    def _available_runnables(
+        self, all_runnables: Set[Runnable] | None
+    ) -> list[Runnable]:
+        return [
+            runnable
+            for runnable in self.couples_counter.runnables_ran()
+            if all_runnables is None or runnable in all_runnables
+        ]
+
+    def get_all_available_configs(
+        self, all_runnables: Set[Runnable] | None = None
+    ) -> Set[str]:
+        if self.granularity == "config_group":
+            return {
+                config for config, group in self._available_runnables(all_runnables)
+            }
         else:
-            all_available_configs |= all_tasks_set
-            count_runs_and_failures(all_tasks)
+            return set(self._available_runnables(all_runnables))
+
+    def get_available_configs_by_group(
+        self, all_runnables: Set[Runnable] | None = None
+    ) -> dict[Group, Set[str]]:
+        available_configs_by_group: dict[Group, Set[str]] = collections.defaultdict(set)
+        for config, group in self._available_runnables(all_runnables):
+            available_configs_by_group[group].add(config)
+        return dict(available_configs_by_group)
+
+
+def get_failing_together_counts_path(granularity: str) -> str:
+    if granularity == "label":
+        path = FAILING_TOGETHER_COUNTS_LABEL_DB
+    elif granularity == "config_group":
+        path = FAILING_TOGETHER_COUNTS_CONFIG_GROUP_DB
+    else:
+        raise UnexpectedGranularityError(granularity)
+
+    return os.path.join("data", path[: -len(".zst")])
+
+
+def update_failing_together_counts(
+    granularity: str,
+    push_data_iter: Callable[[], Iterator[PushResult]],
+    push_data_count: int,
+) -> FailingTogetherCounts:
+    """Update the stored counts to match the push data.
+
+    The counts are recomputed from scratch if the already counted pushes are not in
+    the same order in the push data anymore.
+    """
+    counts_path = get_failing_together_counts_path(granularity)
+
+    counts = None
+    if os.path.exists(counts_path):
+        with open(counts_path, "rb") as f:
+            counts = pickle.load(f)
+
+        if getattr(counts, "version", None) != FAILING_TOGETHER_COUNTS_VERSION:
+            logger.info("The stored counts are outdated, counting all pushes again")
+            counts = None
+
+    if counts is not None:
+        logger.info("Updating the counts of %d pushes", len(counts.revisions))
+        if not counts.update(tqdm(push_data_iter(), total=push_data_count)):
+            logger.info("Push data changed, counting all pushes again")
+            counts = None
 
-        if up_to is not None and revisions[0] == up_to:
-            break
+    if counts is None:
+        counts = FailingTogetherCounts(granularity)
+        assert counts.update(tqdm(push_data_iter(), total=push_data_count))
+
+    with open(counts_path, "wb") as f:
+        pickle.dump(counts, f, protocol=pickle.DEFAULT_PROTOCOL)
+
+    return counts
+
+
+def generate_failing_together_probabilities(
+    granularity: str,
+    push_data_iter: Callable[[], Iterator[PushResult]],
+    push_data_count: int,
+    up_to: str | None = None,
+    all_runnables: Iterable[Runnable] | None = None,
+) -> None:
+    """Generate the failing together probabilities DB.
+
+    `push_data_iter` must not filter runnables based on `all_runnables`, the
+    couples of runnables which are not in `all_runnables` are skipped when
+    generating the probabilities instead.
+    """
+    # TODO: we should consider the probabilities of `task1 failure -> task2 failure` and
+    # `task2 failure -> task1 failure` separately, as they could be different.
+
+    remove_failing_together_db(granularity)
+
+    counts = update_failing_together_counts(
+        granularity, push_data_iter, push_data_count
+    )
+
+    # Get a snapshot of the counts as of the `up_to` push, by removing the counts of
+    # the following pushes.
+    if up_to is not None:
+        counts.remove_after(up_to)
+
+    all_runnables_set = set(all_runnables) if all_runnables is not None else None
+
+    couples_counter = counts.couples_counter
 
     stats = {}
+    couple_counts = {}
 
     skipped = 0
 
-    for couple, run_count in count_runs.most_common():
-        failure_count = count_both_failures[couple]
-        single_failure_count = count_single_failures[couple]
+    for (
+        couple,
+        run_count,
+        single_failure_count,
+        failure_count,
+    ) in couples_counter.couples():
+        if all_runnables_set is not None and (
+            couple[0] not in all_runnables_set or couple[1] not in all_runnables_set
+        ):
+            continue
+
         support = failure_count / run_count
 
         # At manifest-level, don't filter based on support.
@@ -494,6 +982,7 @@ def generate_failing_together_probabilities(
             confidence = 0.0
 
         stats[couple] = (support, confidence)
+        couple_counts[couple] = (failure_count, run_count)
 
     logger.info("%d couples skipped because their support was too low", skipped)
 
@@ -501,8 +990,7 @@ def generate_failing_together_probabilities(
     for couple, (support, confidence) in sorted(
         stats.items(), key=lambda k: (-k[1][1], -k[1][0])
     )[:7]:
-        failure_count = count_both_failures[couple]
-        run_count = count_runs[couple]
+        failure_count, run_count = couple_counts[couple]
         logger.info(
             "%s - %s redundancy confidence %f, support %d (%d over %d).",
             couple[0],
@@ -517,8 +1005,7 @@ def generate_failing_together_probabilities(
     for couple, (support, confidence) in sorted(
         stats.items(), key=lambda k: (-k[1][1], k[1][0])
     )[:7]:
-        failure_count = count_both_failures[couple]
-        run_count = count_runs[couple]
+        failure_count, run_count = couple_counts[couple]
         logger.info(
             "%s - %s redundancy confidence %f, support %d (%d over %d).",
             couple[0],
@@ -579,11 +1066,13 @@ def generate_failing_together_probabilities(
 
     failing_together_db = get_failing_together_db(granularity, False)
 
-    failing_together_db[b"$ALL_CONFIGS$"] = pickle.dumps(list(all_available_configs))
+    failing_together_db[b"$ALL_CONFIGS$"] = pickle.dumps(
+        list(counts.get_all_available_configs(all_runnables_set))
+    )
 
     if granularity == "config_group":
         failing_together_db[b"$CONFIGS_BY_GROUP$"] = pickle.dumps(
-            dict(available_configs_by_group)
+            counts.get_available_configs_by_group(all_runnables_set)
         )
 
     for key, value in failing_together.items():
@@ -717,7 +1206,9 @@ def _read_and_update_past_failures(
             if not is_regression:
                 continue
 
-            cur = ExpQueue(round(push_num / 100), int(HISTORICAL_TIMESPAN / 100) + 1, 0)
+            cur = ArrayExpQueue(
+                round(push_num / 100), int(HISTORICAL_TIMESPAN / 100) + 1, 0
+            )
 
         value = cur[round(push_num / 100)]
 
@@ -728,8 +1219,7 @@ def _read_and_update_past_failures(
 
         if is_regression:
             cur[round(push_num / 100)] = value + 1
-            if is_new:
-                past_failures.set(full_key, cur)
+            past_failures.set(full_key, cur)
 
     return (
         sum(values_total),
@@ -753,6 +1243,21 @@ def generate_data(
             os.path.dirname(source_file) for source_file in commit["files"]
         )
 
+    runnables = tuple(runnables)
+
+    past_failures.prefetch(
+        f"{type_}${runnable}${item}"
+        for runnable in runnables
+        for type_, items in (
+            ("all", ("all",)),
+            ("type", commit["types"]),
+            ("file", commit["files"]),
+            ("directory", commit["directories"]),
+            ("component", commit["components"]),
+        )
+        for item in items
+    )
+
     for runnable in runnables:
         if granularity != "label":
             if isinstance(runnable, tuple):
@@ -5,20 +5,24 @@
 
 import concurrent.futures
 import errno
+import io
 import json
 import logging
 import os
 import re
 import socket
+import struct
 import subprocess
+import sys
 import tarfile
 import urllib.parse
+from array import array
 from collections import deque
 from contextlib import contextmanager
 from datetime import datetime
 from functools import lru_cache
 from importlib.metadata import PackageNotFoundError
-from typing import Any, Iterator
+from typing import Any, Iterable, Iterator
 
 import boto3
 import dateutil.parser
@@ -262,26 +266,221 @@ def download_model(model_name: str) -> str:
     return path
 
 
+# Seekable zstd files are made of independently compressed frames, followed by a
+# seek table (https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md)
+# which allows to compress and decompress the frames in parallel. Seekable files
+# are still regular zstd files, as the seek table is stored in a skippable frame.
+ZSTD_FRAME_SIZE = 8 * 1024 * 1024
+ZSTD_SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+ZSTD_SEEK_TABLE_FOOTER_SIZE = 9
+
+
+def write_zstd_seek_table(fh, frames: list[tuple[int, int]]) -> None:
+    """Write a seek table for the given (compressed size, decompressed size) frames."""
+    entries = b"".join(
+        struct.pack("<II", compressed_size, decompressed_size)
+        for compressed_size, decompressed_size in frames
+    )
+    footer = struct.pack("<IBI", len(frames), 0, ZSTD_SEEKABLE_MAGIC)
+    fh.write(
+        struct.pack("<II", ZSTD_SKIPPABLE_FRAME_MAGIC, len(entries) + len(footer))
+        + entries
+        + footer
+    )
+
+
+def read_zstd_seek_table(fh) -> list[tuple[int, int, int]] | None:
+    """Read the (offset, compressed size, decompressed size) of the frames of a file.
+
+    Appending to a seekable file adds new frames followed by their own seek
+    table, so the seek tables are followed backwards from the end of the file.
+    Returns None if the file is not entirely made of seekable frames.
+    """
+    frames: list[tuple[int, int, int]] = []
+
+    end = fh.seek(0, os.SEEK_END)
+    while end > 0:
+        if end < ZSTD_SEEK_TABLE_FOOTER_SIZE:
+            return None
+
+        fh.seek(end - ZSTD_SEEK_TABLE_FOOTER_SIZE)
+        frames_num, descriptor, magic = struct.unpack(
+            "<IBI", fh.read(ZSTD_SEEK_TABLE_FOOTER_SIZE)
+        )
+        if magic != ZSTD_SEEKABLE_MAGIC:
+            return None
+
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = 8 + frames_num * entry_size + ZSTD_SEEK_TABLE_FOOTER_SIZE
+        if end < table_size:
+            return None
+
+        fh.seek(end - table_size)
+        table = fh.read(table_size)
+        skippable_magic, _ = struct.unpack_from("<II", table)
+        if skippable_magic != ZSTD_SKIPPABLE_FRAME_MAGIC:
+            return None
+
+        sizes = [
+            struct.unpack_from("<II", table, 8 + i * entry_size)
+            for i in range(frames_num)
+        ]
+
+        offset = end - table_size - sum(compressed for compressed, _ in sizes)
+        if offset < 0:
+            return None
+
+        end = offset
+
+        segment = []
+        for compressed_size, decompressed_size in sizes:
+            segment.append((offset, compressed_size, decompressed_size))
+            offset += compressed_size
+
+        frames = segment + frames
+
+    return frames
+
+
+def _bounded_map(executor, fn, iterable, window):
+    # Like Executor.map, but without submitting everything upfront, so that
+    # memory usage is bounded.
+    pending: deque = deque()
+    for args in iterable:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _zstd_compress_frame(data: bytes) -> tuple[int, bytes]:
+    return len(data), zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress_frame(data: bytes, decompressed_size: int) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(
+        data, max_output_size=decompressed_size
+    )
+
+
+def iter_zstd_seekable(
+    fh, frames: list[tuple[int, int, int]], threads: int | None = None
+) -> Iterator[bytes]:
+    """Decompress the frames of a seekable file in parallel, yielding them in order."""
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    def read_frames():
+        for offset, compressed_size, decompressed_size in frames:
+            fh.seek(offset)
+            yield fh.read(compressed_size), decompressed_size
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        yield from _bounded_map(
+            executor, _zstd_decompress_frame, read_frames(), threads * 2
+        )
+
+
+class ZstdSeekableWriter:
+    """Writer producing seekable zstd files.
+
+    Frames are only ended between calls to `write`, so a frame always contains
+    whole records when each record is written in a single call.
+    """
+
+    def __init__(self, fh, threads: int = -1) -> None:
+        self.fh = fh
+        self.writer = zstandard.ZstdCompressor(threads=threads).stream_writer(
+            fh, closefd=False
+        )
+        self.frames: list[tuple[int, int]] = []
+        self.frame_start = fh.tell()
+        self.frame_size = 0
+
+    def write(self, data: bytes) -> int:
+        self.writer.write(data)
+        self.frame_size += len(data)
+        if self.frame_size >= ZSTD_FRAME_SIZE:
+            self._end_frame()
+        return len(data)
+
+    def _end_frame(self) -> None:
+        self.writer.flush(zstandard.FLUSH_FRAME)
+        position = self.fh.tell()
+        self.frames.append((position - self.frame_start, self.frame_size))
+        self.frame_start = position
+        self.frame_size = 0
+
+    def close(self) -> None:
+        if self.frame_size > 0:
+            self._end_frame()
+        write_zstd_seek_table(self.fh, self.frames)
+
+
+class ZstdSeekableReader(io.RawIOBase):
+    """Reader decompressing the frames of a seekable zstd file in parallel."""
+
+    def __init__(
+        self, fh, frames: list[tuple[int, int, int]], threads: int | None = None
+    ) -> None:
+        self.chunks = iter_zstd_seekable(fh, frames, threads)
+        self.buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self.buffer) == 0:
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
 def zstd_compress(path: str) -> None:
     if not os.path.exists(path):
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
 
-    try:
-        subprocess.run(["zstdmt", "-f", path], check=True)
-    except FileNotFoundError as error:
-        logger.warning(
-            "%s. Falling back to zstandard API, which could be slower.", error
-        )
-        cctx = zstandard.ZstdCompressor()
-        with open(path, "rb") as input_f:
-            with open(f"{path}.zst", "wb") as output_f:
-                cctx.copy_stream(input_f, output_f)
+    threads = os.cpu_count() or 1
+
+    with open(path, "rb") as input_f:
+        with open(f"{path}.zst", "wb") as output_f:
+            chunks = iter(lambda: input_f.read(ZSTD_FRAME_SIZE), b"")
+
+            frames = []
+            with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+                for decompressed_size, compressed in _bounded_map(
+                    executor,
+                    _zstd_compress_frame,
+                    ((chunk,) for chunk in chunks),
+                    threads * 2,
+                ):
+                    output_f.write(compressed)
+                    frames.append((len(compressed), decompressed_size))
+
+            write_zstd_seek_table(output_f, frames)
 
 
 def zstd_decompress(path: str) -> None:
     if not os.path.exists(f"{path}.zst"):
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
 
+    with open(f"{path}.zst", "rb") as input_f:
+        frames = read_zstd_seek_table(input_f)
+        if frames is not None:
+            with open(path, "wb") as output_f:
+                for chunk in iter_zstd_seekable(input_f, frames):
+                    output_f.write(chunk)
+            return
+
     try:
         subprocess.run(["zstdmt", "-df", f"{path}.zst"], check=True)
     except FileNotFoundError as error:
@@ -421,6 +620,181 @@ class ExpQueue:
         assert day == self.last_day
 
 
+# Header of the binary encoding of ArrayExpQueue: start day, default value, length.
+ARRAY_EXP_QUEUE_HEADER = struct.Struct("<iII")
+
+
+class ArrayExpQueue:
+    """ExpQueue variant for unsigned 32-bit integer values.
+
+    The values are stored in a ring buffer backed by an `array`, so they can be
+    serialized as a single memory copy instead of pickling a deque of ints.
+    """
+
+    def __init__(self, start_day: int, maxlen: int, default: int) -> None:
+        self.array = array("I", [default]) * maxlen
+        # Position of the oldest value in the ring buffer.
+        self.head = 0
+        self.start_day = start_day - (maxlen - 1)
+        self.default = default
+
+    @classmethod
+    def from_exp_queue(cls, queue: ExpQueue) -> "ArrayExpQueue":
+        assert queue.list.maxlen is not None
+        result = cls.__new__(cls)
+        result.array = array("I", queue.list)
+        result.head = 0
+        result.start_day = queue.start_day
+        result.default = queue.default
+        return result
+
+    def __deepcopy__(self, memo):
+        result = ArrayExpQueue.__new__(ArrayExpQueue)
+
+        result.array = array("I", self.array)
+        result.head = self.head
+        result.start_day = self.start_day
+        result.default = self.default
+
+        return result
+
+    def __getstate__(self) -> bytes:
+        return self.to_bytes()
+
+    def __setstate__(self, state: bytes) -> None:
+        self._load(state, 0)
+
+    @property
+    def last_day(self) -> int:
+        return self.start_day + (len(self.array) - 1)
+
+    def __getitem__(self, day: int) -> int:
+        assert day >= self.start_day, (
+            f"Can't get a day ({day}) from earlier than start day ({self.start_day})"
+        )
+
+        if day < 0:
+            return self.default
+
+        if day > self.last_day:
+            return self.array[self.head - 1]
+
+        return self.array[(self.head + day - self.start_day) % len(self.array)]
+
+    def _append(self, value: int) -> None:
+        self.array[self.head] = value
+        self.head = (self.head + 1) % len(self.array)
+
+    def __setitem__(self, day: int, value: int) -> None:
+        maxlen = len(self.array)
+        if day == self.last_day:
+            self.array[self.head - 1] = value
+        elif day > self.last_day:
+            last_val = self.array[self.head - 1]
+            # Same as ExpQueue: extend except for 2 elements (the last, which is
+            # going to be the same, and the one we are adding now).
+            range_end = min(day - self.last_day, maxlen) - 2
+            for _ in range(range_end):
+                self._append(last_val)
+
+            self.start_day = day - (maxlen - 1)
+
+            self._append(value)
+        else:
+            assert False, "Can't insert in the past"
+
+        assert day == self.last_day
+
+    def to_bytes(self) -> bytes:
+        """Encode the queue as a header followed by the values, oldest first."""
+        values = self.array[self.head :] + self.array[: self.head]
+        if sys.byteorder == "big":
+            values.byteswap()
+
+        return (
+            ARRAY_EXP_QUEUE_HEADER.pack(self.start_day, self.default, len(values))
+            + values.tobytes()
+        )
+
+    def _load(self, data: bytes, offset: int) -> None:
+        start_day, default, maxlen = ARRAY_EXP_QUEUE_HEADER.unpack_from(data, offset)
+        offset += ARRAY_EXP_QUEUE_HEADER.size
+
+        self.array = array("I")
+        self.array.frombytes(
+            memoryview(data)[offset : offset + maxlen * self.array.itemsize]
+        )
+        if sys.byteorder == "big":
+            self.array.byteswap()
+        self.head = 0
+        self.start_day = start_day
+        self.default = default
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0) -> "ArrayExpQueue":
+        result = cls.__new__(cls)
+        result._load(data, offset)
+        return result
+
+
+class CommitListExpQueue:
+    """ExpQueue variant for growing lists of integer commit ids.
+
+    The list of a day is always a prefix of the lists of the following days, so
+    the ids are stored once and the queue only holds the length of each list.
+    """
+
+    def __init__(self, start_day: int, maxlen: int) -> None:
+        self.lengths = ArrayExpQueue(start_day, maxlen, 0)
+        self.ids = array("I")
+
+    @classmethod
+    def from_exp_queue(
+        cls, queue: ExpQueue, commit_ids: dict[str, int]
+    ) -> "CommitListExpQueue":
+        """Convert an ExpQueue of tuples of commit nodes.
+
+        Nodes which are not in `commit_ids` are assigned the next available id.
+        """
+        last = queue.list[-1]
+        assert all(value == last[: len(value)] for value in queue.list)
+
+        lengths = ExpQueue.__new__(ExpQueue)
+        lengths.list = deque(
+            (len(value) for value in queue.list), maxlen=queue.list.maxlen
+        )
+        lengths.start_day = queue.start_day
+        lengths.default = 0
+
+        result = cls.__new__(cls)
+        result.lengths = ArrayExpQueue.from_exp_queue(lengths)
+        result.ids = array(
+            "I", (commit_ids.setdefault(node, len(commit_ids)) for node in last)
+        )
+        return result
+
+    def __deepcopy__(self, memo):
+        result = CommitListExpQueue.__new__(CommitListExpQueue)
+
+        result.lengths = self.lengths.__deepcopy__(memo)
+        result.ids = array("I", self.ids)
+
+        return result
+
+    def __getitem__(self, day: int) -> int:
+        """Return the length of the list of the given day."""
+        return self.lengths[day]
+
+    def get_ids(self, start: int, end: int) -> memoryview:
+        """Return a view of the ids of the given range, without copying them."""
+        return memoryview(self.ids)[start:end]
+
+    def set(self, day: int, length: int, commit_id: int) -> None:
+        """Set the list of the given day to the first `length` ids plus `commit_id`."""
+        self.ids[length:] = array("I", (commit_id,))
+        self.lengths[day] = length + 1
+
+
 class LMDBDict:
     def __init__(self, path: str, readonly: bool = False):
         self.readonly = readonly
@@ -440,6 +814,18 @@ class LMDBDict:
             self.db.sync()
         self.db.close()
 
+    def commit(self) -> None:
+        """Persist the changes made so far, keeping the DB open."""
+        self.txn.commit()
+        if not self.readonly:
+            self.db.sync()
+        self.txn = self.db.begin(buffers=True, write=not self.readonly)
+
+    def rollback(self) -> None:
+        """Discard the changes made since the last commit."""
+        self.txn.abort()
+        self.txn = self.db.begin(buffers=True, write=not self.readonly)
+
     def __contains__(self, key: bytes) -> bool:
         return self.txn.get(key) is not None
 
@@ -457,6 +843,14 @@ class LMDBDict:
         for key, value in cursor:
             yield key.tobytes()
 
+    def getmulti(self, keys: Iterable[bytes]) -> list[tuple[bytes, Any]]:
+        """Read several keys in a single cursor pass.
+
+        Keys that are not in the DB are left out of the result.
+        """
+        with self.txn.cursor() as cursor:
+            return [(bytes(key), value) for key, value in cursor.getmulti(sorted(keys))]
+
 
 def get_free_tcp_port() -> int:
     tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -554,6 +948,22 @@ def get_physical_cpu_count() -> int:
     return psutil.cpu_count(logical=False)
 
 
+def get_n_jobs(n_jobs: int | None) -> int:
+    """Convert a scikit-learn style n_jobs value to a number of processes.
+
+    None means 1, negative values count backwards from the number of CPUs
+    (-1 meaning all CPUs).
+    """
+    if n_jobs is None:
+        return 1
+
+    if n_jobs < 0:
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+
+    assert n_jobs > 0, "n_jobs can't be 0"
+    return n_jobs
+
+
 def extract_metadata(body: str) -> dict:
     """Extract metadata as dict from github issue body.
 
@@ -7,3 +7,31 @@ ALLOW_MISSING_MODELS = bool(int(os.environ.get("BUGBUG_ALLOW_MISSING_MODELS", "0
 REPO_DIR = os.environ.get(
     "BUGBUG_REPO_DIR", os.path.join(tempfile.gettempdir(), "bugbug-hg")
 )
+
+# Comma-separated list of the models to load when the worker boots, or "all".
+PRELOAD_MODELS = os.environ.get("BUGBUG_PRELOAD_MODELS", "")
+
+# Maximum total size (in MB) of the models held in memory by a worker.
+MODEL_POOL_MAX_SIZE_MB = (
+    int(os.environ["BUGBUG_MODEL_POOL_MAX_SIZE_MB"])
+    if os.environ.get("BUGBUG_MODEL_POOL_MAX_SIZE_MB")
+    else None
+)
+
+# Number of persistent worker processes, which run jobs without forking and reuse
+# the loaded models and databases across jobs. If 0, a work horse is forked for
+# each job.
+WORKER_PROCESSES = int(os.environ.get("BUGBUG_WORKER_PROCESSES", "0"))
+
+# Number of jobs after which a persistent worker process is replaced by a new one.
+WORKER_MAX_JOBS = (
+    int(os.environ["BUGBUG_WORKER_MAX_JOBS"])
+    if os.environ.get("BUGBUG_WORKER_MAX_JOBS")
+    else None
+)
+
+# Bugs to classify are coalesced, per model, into batches which are classified by
+# a single job. A batch is closed when it holds BUG_BATCH_MAX_SIZE bugs, or
+# BUG_BATCH_WINDOW_MS milliseconds after it was opened.
+BUG_BATCH_MAX_SIZE = int(os.environ.get("BUGBUG_BUG_BATCH_MAX_SIZE", "100"))
+BUG_BATCH_WINDOW_MS = int(os.environ.get("BUGBUG_BUG_BATCH_WINDOW_MS", "1000"))
@@ -6,6 +6,7 @@
 import gzip
 import logging
 import os
+import time
 import uuid
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
@@ -23,18 +24,23 @@ from flask_cors import cross_origin
 from libmozdata.bugzilla import Bugzilla
 from marshmallow import Schema, fields
 from redis import Redis
+from redis.exceptions import WatchError
 from rq import Queue
-from rq.exceptions import NoSuchJobError
 from rq.job import Job
 from sentry_sdk.integrations.flask import FlaskIntegration
 
 from bugbug import bugzilla, get_bugbug_version, utils
+from bugbug_http import BUG_BATCH_MAX_SIZE, BUG_BATCH_WINDOW_MS
 from bugbug_http.models import (
     MODELS_NAMES,
     classify_broken_site_report,
     classify_bug,
+    classify_bug_batch,
     classify_issue,
+    get_bug_batch_key,
     get_config_specific_groups,
+    get_notification_channel,
+    get_open_bug_batch_key,
     schedule_tests,
 )
 from bugbug_http.sentry import setup_sentry
@@ -44,6 +50,10 @@ if os.environ.get("SENTRY_DSN"):
 
 utils.setup_libmozdata()
 
+# Only the IDs and last change times of bugs are fetched when checking whether
+# classifications are up to date, so they can be fetched in larger chunks.
+LAST_CHANGE_TIME_CHUNK_SIZE = 700
+
 API_TOKEN = "X-Api-Key"
 
 API_DESCRIPTION = """
@@ -84,6 +94,8 @@ BUGZILLA_JOB_TIMEOUT = 5 * 60
 QUEUE_TIMEOUT = 7 * 60
 # Store the information that a job failed for 3 minutes.
 FAILURE_TTL = 3 * 60
+# Maximum time clients can wait for results, with the "wait" query parameter.
+MAX_WAIT_TIME = 25
 
 q = Queue(
     connection=redis_conn, default_timeout=JOB_TIMEOUT
@@ -220,25 +232,104 @@ def prepare_queue_job(
     )
 
 
-def create_bug_classification_jobs(
+def add_to_bug_classification_batch(
     model_name: str, bug_ids: Sequence[int]
-) -> tuple[JobInfo, str, int]:
-    """Create job_id and redis connection"""
-    job_id = get_job_id()
-
-    # Set the mapping before queuing to avoid some race conditions
-    job_id_mapping = {}
-    for bug_id in bug_ids:
-        key = JobInfo(classify_bug, model_name, bug_id).mapping_key
-        job_id_mapping[key] = job_id
-
-    redis_conn.mset(job_id_mapping)
+) -> tuple[str, bool, bool, int]:
+    """Add bugs to the open classification batch of the model, or to a new one.
 
-    return (
-        JobInfo(classify_bug, model_name, bug_ids, BUGZILLA_TOKEN),
-        job_id,
-        BUGZILLA_JOB_TIMEOUT,
-    )
+    Returns the id of the batch, whether it was created (as its job needs to be
+    queued), whether it was closed, and the number of bugs which were added to it.
+    """
+    open_batch_key = get_open_bug_batch_key(model_name)
+
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                # The transaction fails if the batch is closed (or other bugs are
+                # added to it) concurrently, in which case we try again.
+                pipe.watch(open_batch_key)
+                open_batch_id = pipe.get(open_batch_key)
+
+                batch_size = 0
+                if open_batch_id is not None:
+                    batch_id = open_batch_id.decode("ascii")
+                    pipe.watch(get_bug_batch_key(batch_id))
+                    batch_size = pipe.scard(get_bug_batch_key(batch_id))
+
+                if open_batch_id is None or batch_size >= BUG_BATCH_MAX_SIZE:
+                    open_batch_id = None
+                    batch_id = get_job_id()
+                    batch_size = 0
+
+                added_bug_ids = bug_ids[: BUG_BATCH_MAX_SIZE - batch_size]
+                batch_key = get_bug_batch_key(batch_id)
+
+                pipe.multi()
+                # Set the mapping before queuing to avoid some race conditions
+                pipe.mset(
+                    {
+                        JobInfo(classify_bug, model_name, bug_id).mapping_key: batch_id
+                        for bug_id in added_bug_ids
+                    }
+                )
+                pipe.sadd(batch_key, *added_bug_ids)
+                pipe.expire(batch_key, QUEUE_TIMEOUT)
+
+                is_closed = (
+                    batch_size + len(added_bug_ids) >= BUG_BATCH_MAX_SIZE
+                    or BUG_BATCH_WINDOW_MS <= 0
+                )
+                if is_closed:
+                    if open_batch_id is not None:
+                        pipe.delete(open_batch_key)
+                elif open_batch_id is None:
+                    pipe.set(open_batch_key, batch_id, px=BUG_BATCH_WINDOW_MS)
+
+                pipe.execute()
+            except WatchError:
+                continue
+
+            return batch_id, open_batch_id is None, is_closed, len(added_bug_ids)
+
+
+def schedule_bug_classification(model_name: str, bug_ids: Sequence[int]) -> None:
+    """Schedule the classification of a bug_id list.
+
+    The bugs are coalesced with the ones from concurrent requests into batches,
+    so that Bugzilla and the model are queried once per batch.
+    """
+    bug_ids = list(bug_ids)
+    while bug_ids:
+        batch_id, is_new, is_closed, num_added = add_to_bug_classification_batch(
+            model_name, bug_ids
+        )
+        if is_new:
+            job_args = (classify_bug_batch, model_name, batch_id, BUGZILLA_TOKEN)
+            job_kwargs = {
+                "job_id": batch_id,
+                "job_timeout": BUGZILLA_JOB_TIMEOUT,
+                "ttl": QUEUE_TIMEOUT,
+                "failure_ttl": FAILURE_TTL,
+            }
+            if is_closed:
+                q.enqueue(*job_args, **job_kwargs)
+            else:
+                # Instead of waiting for more bugs in a worker, the job runs when
+                # the window of the batch ends.
+                q.enqueue_in(
+                    timedelta(milliseconds=BUG_BATCH_WINDOW_MS),
+                    *job_args,
+                    **job_kwargs,
+                )
+        elif is_closed:
+            # The batch is full before the end of its window, queue its job now. If
+            # the job isn't scheduled anymore, it was already queued (or it is
+            # about to be scheduled, and the batch will be classified at the end
+            # of the window).
+            if q.scheduled_job_registry.remove(batch_id):
+                q.enqueue_job(Job.fetch(batch_id, connection=redis_conn))
+
+        bug_ids = bug_ids[num_added:]
 
 
 def create_broken_site_report_classification_jobs(
@@ -285,26 +376,23 @@ def schedule_issue_classification(
     )
 
 
-def is_pending(job):
-    # Check if there is a job
-    job_id = redis_conn.get(job.mapping_key)
-
-    if not job_id:
-        LOGGER.debug(f"No job ID mapping {job_id}, False")
-        return False
-
-    try:
-        job = Job.fetch(job_id.decode("ascii"), connection=redis_conn)
-    except NoSuchJobError:
+def is_job_pending(job_id: str, job: Job | None) -> bool:
+    if job is None:
         LOGGER.debug(f"No job in DB for {job_id}, False")
         # The job might have expired from redis
         return False
 
-    job_status = job.get_status()
+    # The status was loaded when fetching the job.
+    job_status = job.get_status(refresh=False)
     if job_status == "started":
         LOGGER.debug(f"Job {job_id} is running, True")
         return True
 
+    # Scheduled jobs were not queued yet.
+    if job_status == "scheduled":
+        LOGGER.debug(f"Job {job_id} is scheduled, True")
+        return True
+
     # Enforce job timeout as RQ doesn't seems to do it https://github.com/rq/rq/issues/758
     timeout_datetime = job.enqueued_at + timedelta(seconds=job.timeout)
     utcnow = datetime.now(timezone.utc)
@@ -326,25 +414,57 @@ def is_pending(job):
     return False
 
 
+def get_pending(jobs: Sequence[JobInfo]) -> list[bool]:
+    """Check whether each job is queued or running.
+
+    Redis is queried in two round trips, however many jobs there are.
+    """
+    if not jobs:
+        return []
+
+    # Check if there is a job
+    job_ids = [
+        job_id.decode("ascii") if job_id else None
+        for job_id in redis_conn.mget([job.mapping_key for job in jobs])
+    ]
+
+    # Many jobs can map to the same job id, e.g. bugs classified in a batch.
+    unique_job_ids = list(dict.fromkeys(job_id for job_id in job_ids if job_id))
+    rq_jobs = Job.fetch_many(unique_job_ids, connection=redis_conn)
+    is_pending_by_job_id = {
+        job_id: is_job_pending(job_id, rq_job)
+        for job_id, rq_job in zip(unique_job_ids, rq_jobs)
+    }
+
+    pending = []
+    for job, job_id in zip(jobs, job_ids):
+        if not job_id:
+            LOGGER.debug(f"No job ID mapping for {job}, False")
+            pending.append(False)
+        else:
+            pending.append(is_pending_by_job_id[job_id])
+
+    return pending
+
+
+def is_pending(job: JobInfo) -> bool:
+    return get_pending([job])[0]
+
+
 def get_bugs_last_change_time(bug_ids):
     bugzilla.set_token(BUGZILLA_TOKEN)
 
-    old_CHUNK_SIZE = Bugzilla.BUGZILLA_CHUNK_SIZE
-    try:
-        Bugzilla.BUGZILLA_CHUNK_SIZE = 700
-
-        bugs = {}
+    bugs = {}
 
-        def bughandler(bug):
-            bugs[bug["id"]] = bug["last_change_time"]
+    def bughandler(bug):
+        bugs[bug["id"]] = bug["last_change_time"]
 
+    with bugzilla.chunk_size(LAST_CHANGE_TIME_CHUNK_SIZE):
         Bugzilla(
             bugids=bug_ids,
             bughandler=bughandler,
             include_fields=["id", "last_change_time"],
         ).get_data().wait()
-    finally:
-        Bugzilla.BUGZILLA_CHUNK_SIZE = old_CHUNK_SIZE
 
     return bugs
 
@@ -366,47 +486,110 @@ def get_github_issues_update_time(
     return issues
 
 
-def is_prediction_invalidated(job, change_time):
-    # First get the saved change time
-    saved_change_time = redis_conn.get(job.change_time_key)
-
+def is_prediction_invalidated(
+    saved_change_time: bytes | None, has_result: bool, change_time: str
+) -> bool:
     # If we have no last changed time, the bug was not classified yet or the bug was classified by an old worker
     if not saved_change_time:
         # We can have a result without a cache time
-        if redis_conn.exists(job.result_key):
-            return True
-
-        return False
+        return has_result
 
     return saved_change_time.decode("utf-8") != change_time
 
 
-def clean_prediction_cache(job):
-    # If the bug was modified since last time we classified it, clear the cache to avoid stale answer
-    LOGGER.debug(f"Cleaning results for {job}")
+def decode_result(result: bytes) -> Any:
+    try:
+        result = dctx.decompress(result)
+    except zstandard.ZstdError:
+        # Some job results were stored before compression was enabled.
+        # We can remove the exception handling after enough time has passed
+        # since 47114f4f47db6b73214cf946377be8da945d34b5.
+        pass
+
+    return orjson.loads(result)
+
 
-    redis_conn.delete(job.result_key)
-    redis_conn.delete(job.change_time_key)
+def get_results(
+    jobs: Sequence[JobInfo], change_times: Sequence[str | None] | None = None
+) -> list[Any | None]:
+    """Get the results of the jobs, or None for the jobs which have no result.
+
+    If the change times of the classified items are given, the results which were
+    computed before the last change of their item are removed.
+
+    Redis is queried in at most two round trips, however many jobs there are.
+    """
+    if not jobs:
+        return []
+
+    with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.mget([job.result_key for job in jobs])
+        if change_times is not None:
+            pipe.mget([job.change_time_key for job in jobs])
+        results, *saved_change_times = pipe.execute()
+
+    if change_times is not None:
+        invalidated_keys = []
+        for i, (job, saved_change_time, change_time) in enumerate(
+            zip(jobs, saved_change_times[0], change_times)
+        ):
+            # Change time could be None if it's a security bug
+            if change_time and is_prediction_invalidated(
+                saved_change_time, results[i] is not None, change_time
+            ):
+                # If the item was modified since last time we classified it, clear
+                # the cache to avoid stale answer
+                LOGGER.debug(f"Cleaning results for {job}")
+                invalidated_keys += [job.result_key, job.change_time_key]
+                results[i] = None
+
+        if invalidated_keys:
+            redis_conn.delete(*invalidated_keys)
+
+    return [decode_result(result) if result else None for result in results]
 
 
 def get_result(job: JobInfo) -> Any | None:
     LOGGER.debug(f"Checking for existing results at {job.result_key}")
-    result = redis_conn.get(job.result_key)
+    return get_results([job])[0]
 
-    if result:
-        LOGGER.debug(f"Found {result!r}")
-        try:
-            result = dctx.decompress(result)
-        except zstandard.ZstdError:
-            # Some job results were stored before compression was enabled.
-            # We can remove the exception handling after enough time has passed
-            # since 47114f4f47db6b73214cf946377be8da945d34b5.
-            pass
 
-        assert result is not None  # mypy thinks it could be None
-        return orjson.loads(result)
+def get_wait_time() -> float:
+    """How long the client asked to wait for results which are not ready yet."""
+    wait = request.args.get("wait", 0, type=float)
+    return min(max(wait, 0), MAX_WAIT_TIME)
 
-    return None
+
+def wait_for_results(jobs: Sequence[JobInfo], timeout: float) -> None:
+    """Wait until the results of the jobs are stored, or until the timeout.
+
+    Workers notify the storage of results through Redis pub/sub, so the request
+    is woken up as soon as they are available.
+    """
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(*(get_notification_channel(job.result_key) for job in jobs))
+
+        # Results could have been stored before we subscribed.
+        waiting_channels = {
+            get_notification_channel(job.result_key)
+            for job, result in zip(
+                jobs, redis_conn.mget([job.result_key for job in jobs])
+            )
+            if result is None
+        }
+
+        deadline = time.monotonic() + timeout
+        while waiting_channels:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            message = pubsub.get_message(timeout=remaining)
+            if message is not None:
+                waiting_channels.discard(message["channel"].decode("utf-8"))
+    finally:
+        pubsub.close()
 
 
 def compress_response(data: dict, status_code: int):
@@ -480,21 +663,14 @@ def model_prediction(model_name, bug_id):
     # Get the latest change from Bugzilla for the bug
     bug = get_bugs_last_change_time([bug_id])
 
-    # Change time could be None if it's a security bug
     job = JobInfo(classify_bug, model_name, bug_id)
-    bug_change_time = bug.get(bug_id)
-    if bug_change_time and is_prediction_invalidated(job, bug[bug_id]):
-        clean_prediction_cache(job)
 
     status_code = 200
-    data = get_result(job)
+    data = get_results([job], [bug.get(bug_id)])[0]
 
     if not data:
         if not is_pending(job):
-            job_info, job_id, timeout = create_bug_classification_jobs(
-                model_name, [bug_id]
-            )
-            schedule_job(job_info, job_id=job_id, timeout=timeout)
+            schedule_bug_classification(model_name, [bug_id])
         status_code = 202
         data = {"ready": False}
 
@@ -563,12 +739,9 @@ def model_prediction_github(model_name, owner, repo, issue_num):
     update_time = get_github_issues_update_time(owner, repo, [issue_num])
 
     job = JobInfo(classify_issue, model_name, owner, repo, issue_num)
-    issue_change_time = update_time.get(issue_num)
-    if issue_change_time and is_prediction_invalidated(job, update_time[issue_num]):
-        clean_prediction_cache(job)
 
     status_code = 200
-    data = get_result(job)
+    data = get_results([job], [update_time.get(issue_num)])[0]
 
     if not data:
         if not is_pending(job):
@@ -605,6 +778,10 @@ def batch_prediction(model_name):
         Call back the same endpoint with the same bug ids a bit later, and you
         will get the results.<br/><br/>
 
+        Instead of calling back the endpoint repeatedly, you can pass the
+        `wait` query parameter, so that the endpoint waits up to that many
+        seconds for the results before answering.<br/><br/>
+
         You might get the following output if some bugs are not available:
         <br/>
 
@@ -630,6 +807,12 @@ def batch_prediction(model_name):
       - name: model_name
         in: path
         schema: ModelName
+      - name: wait
+        in: query
+        description: Maximum number of seconds to wait for the results (up to 25)
+        schema:
+          type: number
+          example: 10
       requestBody:
         description: The list of bugs to classify
         content:
@@ -724,32 +907,51 @@ def batch_prediction(model_name):
 
     status_code = 200
     data = {}
-    missing_bugs = []
 
     bug_change_dates = get_bugs_last_change_time(bugs)
 
-    for bug_id in bugs:
-        job = JobInfo(classify_bug, model_name, bug_id)
-
-        change_time = bug_change_dates.get(int(bug_id))
-        # Change time could be None if it's a security bug
-        if change_time and is_prediction_invalidated(job, change_time):
-            clean_prediction_cache(job)
+    results = get_results(
+        [JobInfo(classify_bug, model_name, bug_id) for bug_id in bugs],
+        [bug_change_dates.get(int(bug_id)) for bug_id in bugs],
+    )
 
-        data[str(bug_id)] = get_result(job)
-        if not data[str(bug_id)]:
-            if not is_pending(job):
-                missing_bugs.append(bug_id)
+    not_ready_bugs = []
+    for bug_id, result in zip(bugs, results):
+        data[str(bug_id)] = result
+        if not result:
+            not_ready_bugs.append(bug_id)
             status_code = 202
             data[str(bug_id)] = {"ready": False}
 
-    queueJobList: Queue = []
+    pending = get_pending(
+        [JobInfo(classify_bug, model_name, bug_id) for bug_id in not_ready_bugs]
+    )
+    missing_bugs = [
+        bug_id
+        for bug_id, is_bug_pending in zip(not_ready_bugs, pending)
+        if not is_bug_pending
+    ]
+
+    schedule_bug_classification(model_name, missing_bugs)
+
+    wait = get_wait_time()
+    if not_ready_bugs and wait > 0:
+        not_ready_jobs = [
+            JobInfo(classify_bug, model_name, bug_id) for bug_id in not_ready_bugs
+        ]
+        wait_for_results(not_ready_jobs, wait)
+
+        results = get_results(
+            not_ready_jobs,
+            [bug_change_dates.get(int(bug_id)) for bug_id in not_ready_bugs],
+        )
 
-    for i in range(0, len(missing_bugs), 100):
-        bug_ids = missing_bugs[i : (i + 100)]
-        job_info, job_id, timeout = create_bug_classification_jobs(model_name, bug_ids)
-        queueJobList.append(prepare_queue_job(job_info, job_id=job_id, timeout=timeout))
-    q.enqueue_many(queueJobList)
+        status_code = 200
+        for bug_id, result in zip(not_ready_bugs, results):
+            if result:
+                data[str(bug_id)] = result
+            else:
+                status_code = 202
 
     return compress_response({"bugs": data}, status_code)
 
@@ -913,18 +1115,33 @@ def batch_prediction_broken_site_report(model_name):
 
     status_code = 200
     data = {}
-    missing_reports = []
 
-    for report in reports:
-        report_uuid = report["uuid"]
-        job = JobInfo(classify_broken_site_report, model_name, report_uuid)
+    results = get_results(
+        [
+            JobInfo(classify_broken_site_report, model_name, report["uuid"])
+            for report in reports
+        ]
+    )
 
-        data[report_uuid] = get_result(job)
-        if not data[report_uuid]:
-            if not is_pending(job):
-                missing_reports.append(report)
+    not_ready_reports = []
+    for report, result in zip(reports, results):
+        data[report["uuid"]] = result
+        if not result:
+            not_ready_reports.append(report)
             status_code = 202
-            data[report_uuid] = {"ready": False}
+            data[report["uuid"]] = {"ready": False}
+
+    pending = get_pending(
+        [
+            JobInfo(classify_broken_site_report, model_name, report["uuid"])
+            for report in not_ready_reports
+        ]
+    )
+    missing_reports = [
+        report
+        for report, is_report_pending in zip(not_ready_reports, pending)
+        if not is_report_pending
+    ]
 
     queueJobList: Queue = []
 
@@ -957,6 +1174,12 @@ def push_schedules(branch, rev):
         schema:
           type: str
           example: 76383a875678
+      - name: wait
+        in: query
+        description: Maximum number of seconds to wait for the results (up to 25)
+        schema:
+          type: number
+          example: 10
       responses:
         200:
           description: A dict of tests and tasks to schedule.
@@ -994,6 +1217,15 @@ def push_schedules(branch, rev):
 
     if not is_pending(job):
         schedule_job(job)
+
+    wait = get_wait_time()
+    if wait > 0:
+        wait_for_results([job], wait)
+
+        data = get_result(job)
+        if data:
+            return compress_response(data, 200)
+
     return jsonify({"ready": False}), 202
 
 
@@ -6,8 +6,9 @@
 import logging
 
 from bugbug import utils
+from bugbug.model import Model
 from bugbug_http import ALLOW_MISSING_MODELS
-from bugbug_http.models import MODEL_CACHE, MODELS_NAMES
+from bugbug_http.models import MODELS_NAMES
 
 LOGGER = logging.getLogger()
 
@@ -17,7 +18,7 @@ def download_models():
         utils.download_model(model_name)
         # Try loading the model
         try:
-            m = MODEL_CACHE.get(model_name)
+            m = Model.load(f"{model_name}model")
             m.download_eval_dbs(extract=False, ensure_exist=not ALLOW_MISSING_MODELS)
         except FileNotFoundError:
             if ALLOW_MISSING_MODELS:
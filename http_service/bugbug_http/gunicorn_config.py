@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Configuration of the gunicorn server running the HTTP service.
+#
+# The workers are gevent workers, which serve many requests concurrently: while
+# a request waits on Redis or Bugzilla, the worker switches to another one. A
+# few processes can then handle many concurrent polling clients.
+import os
+
+from gevent import monkey
+
+# The standard library needs to be patched before the application, and the Redis
+# and HTTP clients it uses, are imported (as the application is preloaded).
+monkey.patch_all()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("BUGBUG_HTTP_WORKERS", "3"))
+worker_class = "gevent"
+# Maximum number of concurrent requests served by each worker.
+worker_connections = int(os.environ.get("BUGBUG_HTTP_WORKER_CONNECTIONS", "1000"))
+timeout = 30
+preload_app = True
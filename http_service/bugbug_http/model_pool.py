@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Iterable, TypeVar
+
+LOGGER = logging.getLogger()
+
+# A pool of loaded models, bounded by the total size of the models it holds.
+# Models are stored as soon as they are loaded, and the least recently used
+# models are evicted when the pool grows over its maximum size.
+#
+# Models can be preloaded when the worker boots (see BUGBUG_PRELOAD_MODELS). Only
+# preloaded models are shared copy-on-write by the work horses, as they are loaded
+# in the parent process before it forks them. Models which are not preloaded are
+# loaded lazily inside a work horse, so they are not shared: with RQ's default
+# worker they are discarded when the job ends, and with persistent workers (see
+# BUGBUG_WORKER_PROCESSES) each worker process keeps its own copy.
+Key = TypeVar("Key")
+Value = TypeVar("Value")
+
+
+class ModelPool(Generic[Key, Value]):
+    def __init__(
+        self,
+        load_item_function: Callable[[Key], Value],
+        get_item_size: Callable[[Key, Value], int],
+        max_size: int | None = None,
+    ):
+        self.load_item_function = load_item_function
+        self.get_item_size = get_item_size
+        self.max_size = max_size
+        self.items_storage: OrderedDict[Key, tuple[Value, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.items_storage
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items_storage:
+                self.items_storage.move_to_end(key)
+                return self.items_storage[key][0]
+
+            item = self.load_item_function(key)
+            item_size = self.get_item_size(key, item)
+
+            LOGGER.info(
+                f"Storing item with the following key in the model pool: {key} ({item_size} bytes)"
+            )
+            self.items_storage[key] = (item, item_size)
+            self.size += item_size
+
+            self.evict()
+
+            return item
+
+    def evict(self):
+        with self.lock:
+            if self.max_size is None:
+                return
+
+            # Never evict the most recently used item, even if it alone is larger
+            # than the maximum size.
+            while self.size > self.max_size and len(self.items_storage) > 1:
+                key, (_, item_size) = self.items_storage.popitem(last=False)
+                self.size -= item_size
+                LOGGER.info(
+                    f"Evicting item with the following key from the model pool: {key}"
+                )
+
+    def preload(self, keys: Iterable[Key]):
+        for key in keys:
+            self.get(key)
@@ -5,7 +5,6 @@
 
 import logging
 import os
-from datetime import timedelta
 from functools import lru_cache
 from typing import Sequence
 from urllib.parse import urlparse
@@ -14,13 +13,16 @@ import orjson
 import requests
 import zstandard
 from redis import Redis
+from redis.client import Pipeline
+from redis.exceptions import WatchError
 
 from bugbug import bugzilla, repository, test_scheduling
 from bugbug.github import Github
 from bugbug.model import Model
 from bugbug.models import testselect
 from bugbug.utils import get_hgmo_stack
-from bugbug_http.readthrough_cache import ReadthroughTTLCache
+from bugbug_http import ALLOW_MISSING_MODELS, MODEL_POOL_MAX_SIZE_MB, PRELOAD_MODELS
+from bugbug_http.model_pool import ModelPool
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger()
@@ -52,20 +54,72 @@ redis = Redis(
     ssl_cert_reqs=None,
 )
 
-MODEL_CACHE: ReadthroughTTLCache[str, Model] = ReadthroughTTLCache(
-    timedelta(hours=1), lambda m: Model.load(f"{m}model")
+
+def get_model_size(model_name: str, model: Model) -> int:
+    """Approximate the memory used by a model with the size of its files."""
+    model_directory = f"{model_name}model"
+    return sum(
+        os.path.getsize(os.path.join(model_directory, file_name))
+        for file_name in os.listdir(model_directory)
+    )
+
+
+MODEL_CACHE: ModelPool[str, Model] = ModelPool(
+    lambda m: Model.load(f"{m}model"),
+    get_model_size,
+    MODEL_POOL_MAX_SIZE_MB * 1024 * 1024 if MODEL_POOL_MAX_SIZE_MB else None,
 )
-MODEL_CACHE.start_ttl_thread()
+
+
+def preload_models() -> None:
+    if PRELOAD_MODELS == "all":
+        model_names = MODELS_NAMES
+    else:
+        model_names = [
+            model_name.strip()
+            for model_name in PRELOAD_MODELS.split(",")
+            if model_name.strip()
+        ]
+
+    for model_name in model_names:
+        LOGGER.info("Preloading %s model...", model_name)
+        try:
+            MODEL_CACHE.get(model_name)
+        except FileNotFoundError:
+            if not ALLOW_MISSING_MODELS:
+                raise
+
+            LOGGER.info(
+                "Missing %r model, skipping because ALLOW_MISSING_MODELS is set"
+                % model_name
+            )
+
 
 cctx = zstandard.ZstdCompressor(level=10)
 
 
-def setkey(key: str, value: bytes, compress: bool = False) -> None:
+def get_notification_channel(key: str) -> str:
+    """The channel on which the storage of data at the key is notified."""
+    return f"bugbug:notification:{key}"
+
+
+def setkey(
+    key: str,
+    value: bytes,
+    compress: bool = False,
+    pipe: Pipeline | None = None,
+    notify: bool = False,
+) -> None:
     LOGGER.debug(f"Storing data at {key}: {value!r}")
     if compress:
         value = cctx.compress(value)
-    redis.set(key, value)
-    redis.expire(key, DEFAULT_EXPIRATION_TTL)
+
+    conn = redis if pipe is None else pipe
+    conn.set(key, value, ex=DEFAULT_EXPIRATION_TTL)
+
+    # Wake up the requests waiting for the data.
+    if notify:
+        conn.publish(get_notification_channel(key), b"")
 
 
 def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -> str:
@@ -80,11 +134,19 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
 
     missing_bugs = bug_ids_set.difference(bugs.keys())
 
-    for bug_id in missing_bugs:
-        job = JobInfo(classify_bug, model_name, bug_id)
+    with redis.pipeline(transaction=False) as pipe:
+        for bug_id in missing_bugs:
+            job = JobInfo(classify_bug, model_name, bug_id)
 
-        # TODO: Find a better error format
-        setkey(job.result_key, orjson.dumps({"available": False}))
+            # TODO: Find a better error format
+            setkey(
+                job.result_key,
+                orjson.dumps({"available": False}),
+                pipe=pipe,
+                notify=True,
+            )
+
+        pipe.execute()
 
     if not bugs:
         return "NOK"
@@ -107,21 +169,85 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
     indexes_list = indexes.tolist()
     suggestions_list = suggestions.tolist()
 
-    for i, bug_id in enumerate(bugs.keys()):
-        data = {
-            "prob": probs_list[i],
-            "index": indexes_list[i],
-            "class": suggestions_list[i],
-            "extra_data": model_extra_data,
-        }
+    with redis.pipeline(transaction=False) as pipe:
+        for i, bug_id in enumerate(bugs.keys()):
+            data = {
+                "prob": probs_list[i],
+                "index": indexes_list[i],
+                "class": suggestions_list[i],
+                "extra_data": model_extra_data,
+            }
+
+            job = JobInfo(classify_bug, model_name, bug_id)
+
+            # Save the bug last change, before the result so that the result is
+            # never seen without its change time.
+            setkey(
+                job.change_time_key,
+                bugs[bug_id]["last_change_time"].encode(),
+                pipe=pipe,
+            )
+
+            setkey(
+                job.result_key,
+                orjson.dumps(data),
+                compress=True,
+                pipe=pipe,
+                notify=True,
+            )
+
+        pipe.execute()
 
-        job = JobInfo(classify_bug, model_name, bug_id)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
+    return "OK"
 
-        # Save the bug last change
-        setkey(job.change_time_key, bugs[bug_id]["last_change_time"].encode())
 
-    return "OK"
+def get_open_bug_batch_key(model_name: str) -> str:
+    """The key holding the id of the batch of bugs which is open for the model."""
+    return f"bugbug:open_bug_batch:{model_name}"
+
+
+def get_bug_batch_key(batch_id: str) -> str:
+    """The key holding the set of bugs of a batch."""
+    return f"bugbug:bug_batch:{batch_id}"
+
+
+def close_bug_batch(model_name: str, batch_id: str) -> None:
+    """Close the batch of bugs if it is still open, so no more bugs are added to it."""
+    open_batch_key = get_open_bug_batch_key(model_name)
+
+    with redis.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(open_batch_key)
+                if pipe.get(open_batch_key) != batch_id.encode("ascii"):
+                    return
+
+                pipe.multi()
+                pipe.delete(open_batch_key)
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
+def classify_bug_batch(model_name: str, batch_id: str, bugzilla_token: str) -> str:
+    # The job is scheduled for the end of the window of the batch, or queued when
+    # the batch is full, so the batch is normally already closed.
+    close_bug_batch(model_name, batch_id)
+
+    batch_key = get_bug_batch_key(batch_id)
+    with redis.pipeline() as pipe:
+        pipe.multi()
+        pipe.smembers(batch_key)
+        pipe.delete(batch_key)
+        bug_ids, _ = pipe.execute()
+
+    if not bug_ids:
+        return "OK"
+
+    return classify_bug(
+        model_name, sorted(int(bug_id) for bug_id in bug_ids), bugzilla_token
+    )
 
 
 def classify_issue(
@@ -140,11 +266,19 @@ def classify_issue(
 
     missing_issues = issue_ids_set.difference(issues.keys())
 
-    for issue_id in missing_issues:
-        job = JobInfo(classify_issue, model_name, owner, repo, issue_id)
+    with redis.pipeline(transaction=False) as pipe:
+        for issue_id in missing_issues:
+            job = JobInfo(classify_issue, model_name, owner, repo, issue_id)
 
-        # TODO: Find a better error format
-        setkey(job.result_key, orjson.dumps({"available": False}))
+            # TODO: Find a better error format
+            setkey(
+                job.result_key,
+                orjson.dumps({"available": False}),
+                pipe=pipe,
+                notify=True,
+            )
+
+        pipe.execute()
 
     if not issues:
         return "NOK"
@@ -167,19 +301,34 @@ def classify_issue(
     indexes_list = indexes.tolist()
     suggestions_list = suggestions.tolist()
 
-    for i, issue_id in enumerate(issues.keys()):
-        data = {
-            "prob": probs_list[i],
-            "index": indexes_list[i],
-            "class": suggestions_list[i],
-            "extra_data": model_extra_data,
-        }
-
-        job = JobInfo(classify_issue, model_name, owner, repo, issue_id)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
-
-        # Save the bug last change
-        setkey(job.change_time_key, issues[issue_id]["updated_at"].encode())
+    with redis.pipeline(transaction=False) as pipe:
+        for i, issue_id in enumerate(issues.keys()):
+            data = {
+                "prob": probs_list[i],
+                "index": indexes_list[i],
+                "class": suggestions_list[i],
+                "extra_data": model_extra_data,
+            }
+
+            job = JobInfo(classify_issue, model_name, owner, repo, issue_id)
+
+            # Save the issue last change, before the result so that the result is
+            # never seen without its change time.
+            setkey(
+                job.change_time_key,
+                issues[issue_id]["updated_at"].encode(),
+                pipe=pipe,
+            )
+
+            setkey(
+                job.result_key,
+                orjson.dumps(data),
+                compress=True,
+                pipe=pipe,
+                notify=True,
+            )
+
+        pipe.execute()
 
     return "OK"
 
@@ -210,16 +359,25 @@ def classify_broken_site_report(model_name: str, reports_data: list[dict]) -> st
     indexes_list = indexes.tolist()
     suggestions_list = suggestions.tolist()
 
-    for i, report_uuid in enumerate(reports.keys()):
-        data = {
-            "prob": probs_list[i],
-            "index": indexes_list[i],
-            "class": suggestions_list[i],
-            "extra_data": model_extra_data,
-        }
-
-        job = JobInfo(classify_broken_site_report, model_name, report_uuid)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
+    with redis.pipeline(transaction=False) as pipe:
+        for i, report_uuid in enumerate(reports.keys()):
+            data = {
+                "prob": probs_list[i],
+                "index": indexes_list[i],
+                "class": suggestions_list[i],
+                "extra_data": model_extra_data,
+            }
+
+            job = JobInfo(classify_broken_site_report, model_name, report_uuid)
+            setkey(
+                job.result_key,
+                orjson.dumps(data),
+                compress=True,
+                pipe=pipe,
+                notify=True,
+            )
+
+        pipe.execute()
 
     return "OK"
 
@@ -301,27 +459,81 @@ def schedule_tests(branch: str, rev: str) -> str:
         "reduced_tasks_higher": {t: c for t, c in tasks.items() if t in reduced_higher},
         "known_tasks": get_known_tasks(),
     }
-    setkey(job.result_key, orjson.dumps(data), compress=True)
+    setkey(job.result_key, orjson.dumps(data), compress=True, notify=True)
 
     return "OK"
 
 
+def get_db_version(*paths: str) -> tuple:
+    """Return a value which changes when any of the given files is replaced or modified.
+
+    LMDB DBs are identified by the path of their directory.
+    """
+    version = []
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, "data.mdb")
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(version)
+
+
+# The following are only loaded once per process (and again when the DBs they are
+# loaded from are refreshed), so persistent workers can reuse them across jobs.
+@lru_cache(maxsize=None)
+def _get_all_runnables(granularity: str, db_version: tuple) -> tuple[str, ...]:
+    past_failures_data = test_scheduling.PastFailures(granularity, True)
+    all_runnables = tuple(past_failures_data.all_runnables)
+    past_failures_data.close()
+    return all_runnables
+
+
+def get_all_runnables(granularity: str) -> tuple[str, ...]:
+    return _get_all_runnables(
+        granularity,
+        get_db_version(test_scheduling.get_past_failures_db_path(granularity)),
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_equivalence_sets(min_redundancy_confidence: float, db_version: tuple) -> dict:
+    # The failing together DB handle is kept open, reopen it in case it was refreshed.
+    if "config_group" in test_scheduling.failing_together:
+        test_scheduling.close_failing_together_db("config_group")
+    return testselect._get_equivalence_sets(min_redundancy_confidence)
+
+
+def get_equivalence_sets(min_redundancy_confidence: float) -> dict:
+    return _get_equivalence_sets(
+        min_redundancy_confidence,
+        get_db_version(
+            f"equivalence_sets_{min_redundancy_confidence}.pickle",
+            test_scheduling.get_past_failures_db_path("group"),
+            test_scheduling.get_failing_together_db_path("config_group"),
+        ),
+    )
+
+
 def get_config_specific_groups(config: str) -> str:
     from bugbug_http.app import JobInfo
 
     job = JobInfo(get_config_specific_groups, config)
     LOGGER.info("Processing %s...", job)
 
-    equivalence_sets = testselect._get_equivalence_sets(0.9)
-
-    past_failures_data = test_scheduling.PastFailures("group", True)
+    equivalence_sets = get_equivalence_sets(0.9)
 
     setkey(
         job.result_key,
         orjson.dumps(
             [
                 {"name": group}
-                for group in past_failures_data.all_runnables
+                for group in get_all_runnables("group")
                 if any(
                     equivalence_set == {config}
                     for equivalence_set in equivalence_sets[group]
@@ -4,39 +4,157 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import logging
 import os
+import signal
 import sys
+import time
 from urllib.parse import urlparse
 
 from redis import Redis
-from rq import Worker
+from rq import SimpleWorker, Worker
 from sentry_sdk.integrations.rq import RqIntegration
 
 import bugbug_http.boot
+import bugbug_http.models
+from bugbug import rust_code_analysis_server
+from bugbug_http import WORKER_MAX_JOBS, WORKER_PROCESSES
 from bugbug_http.sentry import setup_sentry
 
+LOGGER = logging.getLogger()
+
+# Bounds (in seconds) of the delay before replacing a worker process which failed,
+# doubling at each consecutive failure.
+RESPAWN_BACKOFF_MIN = 1
+RESPAWN_BACKOFF_MAX = 60
+
 if os.environ.get("SENTRY_DSN"):
     setup_sentry(dsn=os.environ.get("SENTRY_DSN"), integrations=[RqIntegration()])
 
 
-def main():
-    # Bootstrap the worker assets
-    bugbug_http.boot.boot_worker()
-
-    # Provide queue names to listen to as arguments to this script,
-    # similar to rq worker
+def get_redis_connection() -> Redis:
     url = urlparse(os.environ.get("REDIS_URL", "redis://localhost/0"))
     assert url.hostname is not None
-    redis_conn = Redis(
+    return Redis(
         host=url.hostname,
         port=url.port if url.port is not None else 6379,
         password=url.password,
         ssl=True if url.scheme == "rediss" else False,
         ssl_cert_reqs=None,
     )
+
+
+def run_persistent_workers(qs: list[str], processes: int, max_jobs: int | None):
+    """Run long-lived worker processes, which execute jobs without forking.
+
+    The worker processes are forked from this process after it loaded the models,
+    and keep their per-process state (models, DB handles, caches) across jobs. A
+    worker process which exits (e.g. after `max_jobs` jobs, to bound the growth of
+    its memory, or because a job crashed it) is replaced by a new one. Worker
+    processes which fail are replaced after an exponentially growing delay, so that
+    a persistent failure doesn't make us fork in a tight loop.
+    """
+    # The start times of the worker processes, by pid.
+    children: dict[int, float] = {}
+    shutting_down = False
+    backoff = 0.0
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                # Restore the default handlers, RQ installs its own ones.
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+                w = SimpleWorker(qs, connection=get_redis_connection())
+                w.work(max_jobs=max_jobs, with_scheduler=True)
+            except Exception:
+                LOGGER.exception("Worker process failed")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        children[pid] = time.monotonic()
+
+    def shutdown(signum, frame) -> None:
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for _ in range(processes):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        start_time = children.pop(pid, None)
+
+        if shutting_down:
+            continue
+
+        # Failures of worker processes which ran for a while are not consecutive.
+        if (
+            start_time is not None
+            and time.monotonic() - start_time > RESPAWN_BACKOFF_MAX
+        ):
+            backoff = 0.0
+
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code == 0:
+            backoff = 0.0
+            LOGGER.info("Worker process %d exited, replacing it", pid)
+        else:
+            backoff = min(max(backoff * 2, RESPAWN_BACKOFF_MIN), RESPAWN_BACKOFF_MAX)
+            LOGGER.warning(
+                "Worker process %d exited with status %d, replacing it in %d seconds",
+                pid,
+                exit_code,
+                backoff,
+            )
+            time.sleep(backoff)
+
+        if not shutting_down:
+            spawn()
+
+
+def main():
+    # Bootstrap the worker assets
+    bugbug_http.boot.boot_worker()
+
+    # Load the models before forking the work horses, so they are shared by them
+    bugbug_http.models.preload_models()
+
+    # Start the code analysis server used to analyze pushes, so that it is shared
+    # by the work horses instead of being started for each job. Each work horse
+    # analyzes a push at a time, so the server gets a thread per work horse.
+    try:
+        rust_code_analysis_server.get_server(max(WORKER_PROCESSES, 1))
+    except RuntimeError:
+        LOGGER.warning("Unable to start the rust-code-analysis server")
+
+    # Provide queue names to listen to as arguments to this script,
+    # similar to rq worker
     qs = sys.argv[1:] or ["default"]
-    w = Worker(qs, connection=redis_conn)
-    w.work()
+
+    if WORKER_PROCESSES > 0:
+        run_persistent_workers(qs, WORKER_PROCESSES, WORKER_MAX_JOBS)
+    else:
+        w = Worker(qs, connection=get_redis_connection())
+        w.work(with_scheduler=True)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ import json
 import logging
 import os
 import pickle
+import queue
 import re
 from collections import defaultdict
 from datetime import datetime, timezone
@@ -58,8 +59,9 @@ def patch_resources(monkeypatch, jobs):
         def __init__(self):
             self.data = {}
             self.expirations = {}
+            self.pubsubs = []
 
-        def set(self, k, v):
+        def set(self, k, v, px=None, ex=None):
             # keep track of job ids for testing purposes
             if k.startswith("bugbug:job_id"):
                 key = k.split(":", 2)[-1]
@@ -70,6 +72,9 @@ def patch_resources(monkeypatch, jobs):
 
             self.data[k] = v
 
+            if ex is not None:
+                self.expire(k, ex)
+
         def mset(self, d):
             for k, v in d.items():
                 self.set(k, v)
@@ -77,26 +82,129 @@ def patch_resources(monkeypatch, jobs):
         def get(self, k):
             return self.data.get(k)
 
+        def mget(self, keys):
+            return [self.get(k) for k in keys]
+
         def exists(self, k):
             return k in self.data
 
-        def delete(self, k):
-            if self.exists(k):
-                del self.data[k]
+        def delete(self, *keys):
+            for k in keys:
+                if self.exists(k):
+                    del self.data[k]
 
         def expire(self, key, expiration):
             self.expirations[key] = expiration
 
+        def sadd(self, k, *values):
+            self.data.setdefault(k, set()).update(values)
+
+        def scard(self, k):
+            return len(self.data.get(k, set()))
+
+        def smembers(self, k):
+            return set(self.data.get(k, set()))
+
+        def pipeline(self, transaction=True):
+            return PipelineMock(self)
+
+        def publish(self, channel, message):
+            for pubsub in self.pubsubs:
+                if channel in pubsub.channels:
+                    pubsub.messages.put(
+                        {
+                            "type": "message",
+                            "channel": channel.encode(),
+                            "data": message,
+                        }
+                    )
+
+        def pubsub(self, ignore_subscribe_messages=False):
+            pubsub = PubSubMock()
+            self.pubsubs.append(pubsub)
+            return pubsub
+
+    class PubSubMock:
+        """Mock class to mimic a Redis pub/sub subscription."""
+
+        def __init__(self):
+            self.channels = set()
+            self.messages = queue.Queue()
+
+        def subscribe(self, *channels):
+            self.channels.update(channels)
+
+        def get_message(self, timeout=0.0):
+            try:
+                return self.messages.get(timeout=timeout)
+            except queue.Empty:
+                return None
+
+        def close(self):
+            self.channels = set()
+
+    class PipelineMock:
+        """Mock class to mimic a Redis transaction pipeline."""
+
+        def __init__(self, redis):
+            self.redis = redis
+            self.commands = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def watch(self, *keys):
+            # Commands are run immediately until the transaction starts.
+            self.commands = None
+
+        def multi(self):
+            self.commands = []
+
+        def execute(self):
+            results = [func(*args, **kwargs) for func, args, kwargs in self.commands]
+            self.commands = []
+            return results
+
+        def __getattr__(self, name):
+            func = getattr(self.redis, name)
+            if self.commands is None:
+                return func
+
+            return lambda *args, **kwargs: self.commands.append((func, args, kwargs))
+
+    class ScheduledJobRegistryMock:
+        """Mock class to mimic rq.registry.ScheduledJobRegistry."""
+
+        def __init__(self):
+            self.job_ids = set()
+
+        def remove(self, job_id):
+            if job_id not in self.job_ids:
+                return 0
+
+            self.job_ids.remove(job_id)
+            return 1
+
     class QueueMock:
         """Mock class to mimic rq.Queue."""
 
         def __init__(self, *args, **kwargs):
-            pass
+            self.scheduled_job_registry = ScheduledJobRegistryMock()
+            self.queued_job_ids = []
 
         def enqueue(
             self, func, *args, job_id=None, job_timeout=None, ttl=None, failure_ttl=None
         ):
-            pass
+            self.queued_job_ids.append(job_id)
+
+        def enqueue_in(self, time_delta, func, *args, job_id=None, **kwargs):
+            self.scheduled_job_registry.job_ids.add(job_id)
+
+        def enqueue_job(self, job):
+            self.queued_job_ids.append(job.job_id)
 
         def enqueue_many(self, job_datas, pipeline=None):
             pass
@@ -116,7 +224,11 @@ def patch_resources(monkeypatch, jobs):
 
             raise NoSuchJobError
 
-        def get_status(self):
+        @staticmethod
+        def fetch_many(job_ids, **kwargs):
+            return [JobMock(job_id) if job_id in jobs else None for job_id in job_ids]
+
+        def get_status(self, refresh=True):
             if self.job_id not in jobs:
                 raise NoSuchJobError
 
@@ -365,6 +477,9 @@ def mock_get_config_specific_groups(
 
     monkeypatch.setattr(bugbug_http.models, "MODEL_CACHE", MockModelCache())
 
+    bugbug_http.models._get_all_runnables.cache_clear()
+    bugbug_http.models._get_equivalence_sets.cache_clear()
+
 
 @pytest.fixture
 def mock_schedule_tests_classify(
@@ -9,6 +9,8 @@ import time
 
 import orjson
 
+import bugbug_http.models
+from bugbug_http import app
 from bugbug_http.app import API_TOKEN
 
 
@@ -310,3 +312,90 @@ def test_no_api_key(client):
 
     assert rv.status_code == 401
     assert rv.json == {"message": "Error, missing X-API-KEY"}
+
+
+def test_bug_classification_batching(monkeypatch, jobs):
+    monkeypatch.setattr(app, "BUG_BATCH_MAX_SIZE", 3)
+
+    # Bugs from different requests are added to the same batch until it is full.
+    app.schedule_bug_classification("component", [1, 2])
+    app.schedule_bug_classification("component", [3, 4])
+    app.schedule_bug_classification("component", [5])
+
+    assert sorted(jobs.values()) == [
+        [
+            "classify_bug:component_1",
+            "classify_bug:component_2",
+            "classify_bug:component_3",
+        ],
+        ["classify_bug:component_4", "classify_bug:component_5"],
+    ]
+
+    # The job of the full batch is queued, the other one is scheduled for the end
+    # of the window of its batch.
+    full_batch_id = next(job_id for job_id, keys in jobs.items() if len(keys) == 3)
+    open_batch_id = next(job_id for job_id, keys in jobs.items() if len(keys) == 2)
+    assert app.q.queued_job_ids == [full_batch_id]
+    assert app.q.scheduled_job_registry.job_ids == {open_batch_id}
+
+    classified = []
+
+    def classify_bug(model_name, bug_ids, bugzilla_token):
+        classified.append((model_name, bug_ids))
+        return "OK"
+
+    monkeypatch.setattr(bugbug_http.models, "classify_bug", classify_bug)
+
+    # The first batch is full, so it is closed.
+    assert (
+        bugbug_http.models.classify_bug_batch("component", full_batch_id, "token")
+        == "OK"
+    )
+    assert classified == [("component", [1, 2, 3])]
+    assert (
+        bugbug_http.models.get_bug_batch_key(full_batch_id) not in app.redis_conn.data
+    )
+
+    # The second one is still open.
+    assert (
+        app.redis_conn.get(bugbug_http.models.get_open_bug_batch_key("component"))
+        is not None
+    )
+
+    # The second one is closed when its job runs.
+    assert (
+        bugbug_http.models.classify_bug_batch("component", open_batch_id, "token")
+        == "OK"
+    )
+    assert classified == [("component", [1, 2, 3]), ("component", [4, 5])]
+    assert (
+        app.redis_conn.get(bugbug_http.models.get_open_bug_batch_key("component"))
+        is None
+    )
+
+
+def test_get_results_and_pending(jobs, add_result, add_change_time):
+    bug_jobs = [
+        app.JobInfo(app.classify_bug, "component", bug_id) for bug_id in range(4)
+    ]
+    result = {"class": "Core::Layout"}
+
+    # Bug 0 has an up to date result, bug 1 a stale one, bug 2 a result without
+    # change time, bug 3 no result.
+    for job, change_time in zip(bug_jobs[:2], ["1", "0"]):
+        add_result(str(job), result)
+        add_change_time(str(job), change_time)
+    add_result(str(bug_jobs[2]), result)
+
+    assert app.get_results(bug_jobs, ["1", "1", None, "1"]) == [
+        result,
+        None,
+        result,
+        None,
+    ]
+    assert app.get_result(bug_jobs[1]) is None
+    assert app.redis_conn.get(bug_jobs[1].change_time_key) is None
+    assert app.get_result(bug_jobs[2]) == result
+
+    app.schedule_bug_classification("component", [1, 3])
+    assert app.get_pending(bug_jobs) == [False, True, False, True]
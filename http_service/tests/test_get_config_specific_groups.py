@@ -8,6 +8,7 @@ from typing import Callable
 import orjson
 import zstandard
 
+from bugbug import test_scheduling
 from bugbug_http import models
 
 
@@ -25,3 +26,20 @@ def test_get_config_specific_groups(
     assert value is not None
     result = orjson.loads(zstandard.ZstdDecompressor().decompress(value))
     assert result == [{"name": "test-group1"}]
+
+
+def test_get_all_runnables_refreshed(
+    mock_get_config_specific_groups: Callable[
+        [dict[str, float], dict[str, float]], None
+    ],
+) -> None:
+    assert models.get_all_runnables("group") == ("test-group1", "test-group2")
+    assert models.get_all_runnables("group") == ("test-group1", "test-group2")
+    assert models._get_all_runnables.cache_info().misses == 1
+
+    # The runnables are loaded again when the past failures DB changes.
+    past_failures_data = test_scheduling.PastFailures("group", False)
+    past_failures_data.all_runnables = ["test-group3"]
+    past_failures_data.close()
+
+    assert models.get_all_runnables("group") == ("test-group3",)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from bugbug_http.model_pool import ModelPool
+
+
+def get_pool(max_size=None):
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return f"payload_{key}"
+
+    pool = ModelPool(load, lambda key, item: len(key), max_size)
+    return pool, loads
+
+
+def test_caches_on_first_access():
+    pool, loads = get_pool()
+
+    assert pool.get("key_a") == "payload_key_a"
+    assert "key_a" in pool
+    assert pool.get("key_a") == "payload_key_a"
+    assert loads == ["key_a"]
+
+
+def test_evicts_least_recently_used():
+    pool, loads = get_pool(max_size=9)
+
+    pool.get("aaa")
+    pool.get("bbbb")
+    pool.get("aaa")
+    assert pool.size == 7
+
+    pool.get("ccc")
+    assert "aaa" in pool
+    assert "bbbb" not in pool
+    assert "ccc" in pool
+    assert pool.size == 6
+
+    pool.get("bbbb")
+    assert loads == ["aaa", "bbbb", "ccc", "bbbb"]
+
+
+def test_keeps_item_larger_than_max_size():
+    pool, loads = get_pool(max_size=2)
+
+    pool.get("aaa")
+    assert "aaa" in pool
+
+    pool.get("bbb")
+    assert "aaa" not in pool
+    assert "bbb" in pool
+
+
+def test_preload():
+    pool, loads = get_pool()
+
+    pool.preload(["key_a", "key_b"])
+    assert "key_a" in pool
+    assert "key_b" in pool
+
+    pool.get("key_a")
+    assert loads == ["key_a", "key_b"]
@@ -4,9 +4,11 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import gzip
+import threading
 
 import orjson
 
+import bugbug_http.models
 from bugbug_http.app import API_TOKEN
 
 
@@ -53,6 +55,43 @@ def test_queue_job_valid(client, add_result, jobs):
     assert retrieve_compressed_reponse(rv) == result
 
 
+def test_queue_job_wait(client, jobs):
+    result = {
+        "groups": ["foo/mochitest.ini", "bar/xpcshell.ini"],
+        "tasks": ["test-linux/opt-mochitest-1"],
+    }
+
+    # Not ready before the wait time expires.
+    rv = client.get(
+        "/push/autoland/abcdef/schedules?wait=0.1",
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 202
+    assert rv.json == {"ready": False}
+
+    # The worker stores the result while the request is waiting.
+    def finish_job():
+        keys = next(iter(jobs.values()))
+        bugbug_http.models.setkey(
+            f"bugbug:job_result:{keys[0]}",
+            orjson.dumps(result),
+            compress=True,
+            notify=True,
+        )
+
+    timer = threading.Timer(0.2, finish_job)
+    timer.start()
+
+    rv = client.get(
+        "/push/autoland/abcdef/schedules?wait=10",
+        headers={API_TOKEN: "test"},
+    )
+    timer.join()
+
+    assert rv.status_code == 200
+    assert retrieve_compressed_reponse(rv) == result
+
+
 def test_no_api_key(client):
     rv = client.get("/push/autoland/foobar/schedules")
 
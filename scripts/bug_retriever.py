@@ -195,6 +195,7 @@ class Retriever(object):
         # TODO: Figure out why we have missing fields in the first place.
         handle_missing_fields(["history", "comments"])
 
+        db.compact(bugzilla.BUGS_DB)
         zstd_compress(bugzilla.BUGS_DB)
 
 
@@ -27,6 +27,9 @@ class Retriever(object):
         else:
             db.download(repository.COMMITS_DB, support_files_too=True)
 
+            if os.path.exists("data/commit_experiences.lmdb"):
+                repository.migrate_experiences()
+
             rev_start = 0
             for commit in repository.get_commits():
                 rev_start = f"children({commit['node']})"
@@ -34,10 +37,10 @@ class Retriever(object):
         with hglib.open(self.repo_dir) as hg:
             revs = repository.get_revs(hg, rev_start)
 
-        chunk_size = 70000
-
-        for i in range(0, len(revs), chunk_size):
-            repository.download_commits(self.repo_dir, revs=revs[i : (i + chunk_size)])
+        # The mined commits are stored as they are mined, so we don't need to keep
+        # them around.
+        for _ in repository.mine_commits(self.repo_dir, revs=revs):
+            pass
 
         logger.info("commit data extracted from repository")
 
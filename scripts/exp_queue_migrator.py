@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import logging
+
+from bugbug import repository, test_scheduling
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate(db_name: str) -> None:
+    if db_name == "commit_experiences":
+        migrated = repository.migrate_experiences()
+    else:
+        granularity = db_name[len("past_failures_") :]
+        past_failures = test_scheduling.PastFailures(granularity, False)
+        try:
+            migrated = past_failures.migrate()
+        finally:
+            past_failures.close()
+
+    logger.info("Migrated %d values in the %s DB", migrated, db_name)
+
+
+def main() -> None:
+    description = (
+        "Convert the pickled ExpQueue values of a DB to their compact variants"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "db",
+        choices=["commit_experiences", "past_failures_label", "past_failures_group"],
+        help="Which DB to migrate (it must be extracted in the data directory).",
+    )
+    args = parser.parse_args()
+
+    migrate(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -120,6 +120,7 @@ class Retriever(object):
                 self.github.delete_issues(lambda issue: issue["id"] in updated_ids)
                 db.append(self.github.db_path, updated_issues)
 
+        db.compact(self.github.db_path)
         zstd_compress(self.github.db_path)
 
 
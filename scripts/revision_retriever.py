@@ -72,6 +72,7 @@ class Retriever(object):
 
         phabricator.download_revisions(revision_ids)
 
+        db.compact(phabricator.REVISIONS_DB)
         zstd_compress(phabricator.REVISIONS_DB)
 
 
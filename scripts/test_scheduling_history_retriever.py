@@ -200,6 +200,9 @@ class Retriever(object):
             failing_together_db = os.path.join(
                 "data", test_scheduling.FAILING_TOGETHER_LABEL_DB
             )
+            failing_together_counts_db = os.path.join(
+                "data", test_scheduling.FAILING_TOGETHER_COUNTS_LABEL_DB
+            )
         elif granularity == "group":
             test_scheduling_db = test_scheduling.TEST_GROUP_SCHEDULING_DB
             past_failures_db = os.path.join(
@@ -216,14 +219,26 @@ class Retriever(object):
             failing_together_db = os.path.join(
                 "data", test_scheduling.FAILING_TOGETHER_CONFIG_GROUP_DB
             )
+            failing_together_counts_db = os.path.join(
+                "data", test_scheduling.FAILING_TOGETHER_COUNTS_CONFIG_GROUP_DB
+            )
 
         push_data_iter, push_data_count, all_runnables = test_scheduling.get_push_data(
             granularity
         )
 
         if granularity in ("label", "config_group"):
+            # Reuse the counts from the previous run, so only new pushes are counted.
+            db.download_support_file(
+                test_scheduling_db,
+                os.path.basename(failing_together_counts_db),
+            )
+
             test_scheduling.generate_failing_together_probabilities(
-                granularity, push_data_iter(), push_data_count
+                granularity,
+                lambda: push_data_iter(filtered=False),
+                push_data_count,
+                all_runnables=all_runnables,
             )
 
         def generate_all_data() -> Generator[dict[str, Any], None, None]:
@@ -301,7 +316,7 @@ class Retriever(object):
                     skipped_no_runnables += 1
                     continue
 
-                # Sync DB every 250 pushes, so we cleanup the shelve cache (we'd run OOM otherwise!).
+                # Sync DB every 250 pushes, so the updated past failures are written regularly.
                 if i % 250 == 0:
                     past_failures.sync()
 
@@ -356,6 +371,7 @@ class Retriever(object):
 
         if granularity in ("label", "config_group"):
             create_tar_zst(failing_together_db)
+            zstd_compress(failing_together_counts_db[: -len(".zst")])
 
 
 def main():
@@ -28,6 +28,9 @@ class Trainer(object):
         }
         model_obj = model_class(**parameters)
 
+        if args.extraction_jobs is not None:
+            model_obj.set_extraction_n_jobs(args.extraction_jobs)
+
         if args.download_db:
             for required_db in model_obj.training_dbs:
                 assert db.download(required_db)
@@ -38,7 +41,12 @@ class Trainer(object):
             logger.info("Skipping download of the databases")
 
         logger.info("Training *%s* model", model_name)
-        metrics = model_obj.train(limit=args.limit)
+        metrics = model_obj.train(
+            limit=args.limit,
+            use_feature_cache=args.feature_cache,
+            use_out_of_core=args.out_of_core,
+            confidence_thresholds=args.thresholds,
+        )
 
         # Save the metrics as a file that can be uploaded as an artifact.
         metric_file_path = "metrics.json"
@@ -82,6 +90,27 @@ def parse_args(args):
         dest="download_eval",
         help="Download databases and database support files required at runtime (e.g. if the model performs custom evaluations)",
     )
+    parser.add_argument(
+        "--extraction-jobs",
+        type=int,
+        help="Number of processes to use for feature extraction (-1 to use all CPUs)",
+    )
+    parser.add_argument(
+        "--feature-cache",
+        action="store_true",
+        help="Reuse the features extracted by previous runs, only extracting features for new or changed items",
+    )
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="Train without holding all the features in memory, storing them on disk instead",
+    )
+    parser.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        help="Confidence thresholds to evaluate the model on the test set with (by default, a few thresholds between 0.1 and 0.9)",
+    )
     parser.add_argument(
         "--lemmatization",
         help="Perform lemmatization (using spaCy)",
@@ -22,7 +22,7 @@ with open(os.path.join(here, "VERSION")) as f:
     version = f.read().strip()
 
 # Read the extra requirements
-extras = ["nlp", "nn"]
+extras = ["columnar", "nlp", "nn"]
 
 extras_require = {}
 
@@ -63,6 +63,7 @@ setup(
             "bugbug-shadow-scheduler-stats = scripts.shadow_scheduler_stats:main",
             "bugbug-data-github = scripts.github_issue_retriever:main",
             "bugbug-fixed-comments = scripts.inline_comments_data_collection:main",
+            "bugbug-migrate-exp-queues = scripts.exp_queue_migrator:main",
         ]
     },
     classifiers=[
@@ -3,11 +3,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 import json
 import os
 
 import pytest
 
+from bugbug import bugzilla
 from bugbug.bug_features import (
     BlockedBugsNumber,
     BugExtractor,
@@ -30,6 +32,7 @@ from bugbug.bug_features import (
     Landings,
     Patches,
     Product,
+    ReporterExperience,
     Severity,
     Whiteboard,
 )
@@ -181,6 +184,22 @@ def test_BugExtractor():
         BugExtractor([HasSTR(), HasURL()], [fileref(), fileref()])
 
 
+def test_BugExtractor_n_jobs():
+    bugs = list(itertools.islice(bugzilla.get_bugs(), 200))
+
+    def extract(n_jobs):
+        extractor = BugExtractor(
+            [HasSTR(), Keywords(), ReporterExperience()],
+            [fileref(), url()],
+            n_jobs=n_jobs,
+        )
+        return extractor.transform(lambda: iter(bugs))
+
+    expected = extract(None)
+    assert len(expected) == len(bugs)
+    assert expected.equals(extract(2))
+
+
 def test_BugTypes(read) -> None:
     read(
         "bug_types.json",
@@ -27,6 +27,15 @@ def test_get_bugs():
     assert 1572747 in legitimate_bugs
 
 
+def test_get_bugs_columns():
+    bugs = list(bugzilla.get_bugs(columns=["id"]))
+
+    assert {int(bug["id"]) for bug in bugs} == {
+        int(bug["id"]) for bug in bugzilla.get_bugs()
+    }
+    assert all(set(bug) == {"id", "product"} for bug in bugs)
+
+
 def test_get_fixed_versions():
     assert bugzilla.get_fixed_versions(
         {
@@ -109,3 +118,22 @@ def test_get_component_team_mapping(
         "Core": {"Graphics": "GFX"},
         "JSS": {"Library": "Crypto", "Tests": "Crypto"},
     }
+
+
+def test_chunk_size():
+    default = bugzilla.Bugzilla.BUGZILLA_CHUNK_SIZE
+
+    with bugzilla.chunk_size(700):
+        assert bugzilla.Bugzilla.BUGZILLA_CHUNK_SIZE == 700
+
+    assert bugzilla.Bugzilla.BUGZILLA_CHUNK_SIZE == default
+
+    # Overlapping blocks (e.g. concurrent requests) don't leak their chunk size.
+    first = bugzilla.chunk_size(700)
+    second = bugzilla.chunk_size(700)
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert bugzilla.Bugzilla.BUGZILLA_CHUNK_SIZE == 700
+    second.__exit__(None, None, None)
+    assert bugzilla.Bugzilla.BUGZILLA_CHUNK_SIZE == default
@@ -5,7 +5,14 @@
 
 import pytest
 
-from bugbug.commit_features import AuthorExperience, CommitExtractor, ReviewersNum
+from bugbug import repository
+from bugbug.commit_features import (
+    AuthorExperience,
+    CommitExtractor,
+    ComponentsModifiedNum,
+    ReviewersNum,
+    TestAdded,
+)
 from bugbug.feature_cleanup import fileref, url
 
 
@@ -15,3 +22,17 @@ def test_CommitExtractor():
         CommitExtractor([ReviewersNum(), AuthorExperience()], [fileref(), fileref()])
     with pytest.raises(AssertionError):
         CommitExtractor([AuthorExperience(), AuthorExperience()], [fileref(), url()])
+
+
+def test_CommitExtractor_n_jobs():
+    commits = list(repository.get_commits())
+
+    def extract(n_jobs):
+        extractor = CommitExtractor(
+            [ComponentsModifiedNum(), TestAdded()], [fileref(), url()], n_jobs=n_jobs
+        )
+        return extractor.transform(lambda: iter(commits))
+
+    expected = extract(None)
+    assert len(expected) == len(commits)
+    assert expected.equals(extract(2))
@@ -11,7 +11,7 @@ import pytest
 import requests
 import responses
 
-from bugbug import db
+from bugbug import db, utils
 from bugbug.db import LastModifiedNotAvailable
 
 
@@ -67,6 +67,103 @@ def test_delete(mock_db, db_format, db_compression):
     assert list(db.read(db_path)) == [1, 2, 3, 5, 6, 7, 8]
 
 
+@pytest.mark.parametrize("db_format", ["json", "pickle"])
+def test_zstd_multiple_frames(mock_db, monkeypatch, db_format):
+    monkeypatch.setattr(utils, "ZSTD_FRAME_SIZE", 64)
+
+    db_path = mock_db(db_format, "zstd")
+
+    db.write(db_path, ({"id": i} for i in range(1, 200)))
+    db.append(db_path, ({"id": i} for i in range(200, 300)))
+
+    with open(db_path, "rb") as f:
+        assert len(utils.read_zstd_seek_table(f)) > 2
+
+    assert [elem["id"] for elem in db.read(db_path)] == list(range(1, 300))
+
+
+def test_parquet_write_read(mock_db):
+    db_path = mock_db("parquet", None)
+
+    elems = [
+        {"id": 1, "title": "Crash", "keywords": ["crash"], "nested": {"a": None}},
+        {"id": 2, "title": "Hang", "keywords": []},
+        {"id": 3, "keywords": ["perf"], "priority": "P1"},
+    ]
+
+    db.write(db_path, elems)
+
+    assert list(db.read(db_path)) == elems
+    assert list(db.read(db_path, columns=["id", "priority"])) == [
+        {"id": 1},
+        {"id": 2},
+        {"id": 3, "priority": "P1"},
+    ]
+
+
+def test_parquet_row_groups(mock_db, monkeypatch):
+    monkeypatch.setattr(db.ParquetStore, "ROW_GROUP_SIZE", 3)
+
+    db_path = mock_db("parquet", None)
+
+    db.write(db_path, ({"id": i} for i in range(1, 9)))
+
+    assert [elem["id"] for elem in db.read(db_path)] == list(range(1, 9))
+
+    db.append(db_path, ({"id": i, "new": True} for i in range(9, 11)))
+
+    assert list(db.read(db_path, columns=["new"]))[-3:] == [
+        {},
+        {"new": True},
+        {"new": True},
+    ]
+
+    db.delete(db_path, lambda x: x["id"] % 2 == 0)
+
+    assert [elem["id"] for elem in db.read(db_path)] == [1, 3, 5, 7, 9]
+
+
+def test_parquet_write_empty(mock_db):
+    db_path = mock_db("parquet", None)
+
+    db.write(db_path, [])
+
+    assert list(db.read(db_path)) == []
+
+    db.append(db_path, [{"id": 1}])
+
+    assert list(db.read(db_path)) == [{"id": 1}]
+
+
+def test_parquet_write_failure(mock_db, monkeypatch):
+    monkeypatch.setattr(db.ParquetStore, "ROW_GROUP_SIZE", 2)
+
+    db_path = mock_db("parquet", None)
+
+    db.write(db_path, [{"id": 1}])
+
+    def elems():
+        yield from ({"id": i} for i in range(2, 6))
+        raise RuntimeError("Generation failed")
+
+    with pytest.raises(RuntimeError, match="Generation failed"):
+        db.append(db_path, elems())
+
+    assert list(db.read(db_path)) == [{"id": 1}]
+    assert not os.path.exists(
+        os.path.join(os.path.dirname(db_path), f"tmp_{os.path.basename(db_path)}")
+    )
+
+
+@pytest.mark.parametrize("db_format", ["json", "pickle"])
+def test_read_columns(mock_db, db_format):
+    db_path = mock_db(db_format, "zstd")
+
+    db.write(db_path, [{"id": 1, "title": "Crash"}, {"id": 2}])
+
+    assert list(db.read(db_path, columns=["title"])) == [{"title": "Crash"}, {}]
+
+
 def test_delete_not_existent(mock_db):
     db_path = mock_db("json", None)
     assert not os.path.exists(db_path)
@@ -74,6 +171,160 @@ def test_delete_not_existent(mock_db):
     assert not os.path.exists(db_path)
 
 
+@pytest.fixture
+def mock_indexed_db(tmp_path):
+    def register_db(db_format, db_compression):
+        db_name = f"prova.{db_format}"
+        if db_compression is not None:
+            db_name += f".{db_compression}"
+
+        db_path = tmp_path / db_name
+        db.register(db_path, "https://alink", 1, index_keys=["id", "group"])
+        return db_path
+
+    return register_db
+
+
+@pytest.mark.parametrize("db_format", ["json", "pickle"])
+@pytest.mark.parametrize("db_compression", [None, "gz", "zstd"])
+def test_get_by_key(mock_indexed_db, db_format, db_compression):
+    db_path = mock_indexed_db(db_format, db_compression)
+
+    db.write(db_path, ({"id": i, "group": i % 3} for i in range(1, 10)))
+
+    assert list(db.get_by_key(db_path, [7, 2, 42])) == [
+        {"id": 2, "group": 2},
+        {"id": 7, "group": 1},
+    ]
+    assert [elem["id"] for elem in db.get_by_key(db_path, [0], "group")] == [3, 6, 9]
+
+    db.append(db_path, ({"id": i, "group": i % 3} for i in range(10, 13)))
+
+    assert list(db.get_by_key(db_path, [11])) == [{"id": 11, "group": 2}]
+    assert [elem["id"] for elem in db.get_by_key(db_path, [0], "group")] == [
+        3,
+        6,
+        9,
+        12,
+    ]
+
+    db.delete(db_path, lambda x: x["id"] == 6)
+
+    assert list(db.get_by_key(db_path, [6])) == []
+    assert [elem["id"] for elem in db.get_by_key(db_path, [0], "group")] == [3, 9, 12]
+
+
+def test_get_by_key_stale_index(mock_indexed_db):
+    db_path = mock_indexed_db("json", None)
+
+    db.write(db_path, ({"id": i, "group": i % 3} for i in range(1, 10)))
+    assert list(db.get_by_key(db_path, [1])) == [{"id": 1, "group": 1}]
+
+    # Replace the DB behind the back of the index.
+    with open(db_path, "w") as f:
+        f.write('{"id": 5, "group": 0}\n')
+
+    assert list(db.get_by_key(db_path, [1])) == []
+    assert list(db.get_by_key(db_path, [5])) == [{"id": 5, "group": 0}]
+
+
+def test_get_by_key_not_existent(mock_indexed_db):
+    db_path = mock_indexed_db("json", None)
+    assert list(db.get_by_key(db_path, [1])) == []
+
+
+@pytest.fixture
+def mock_log_db(tmp_path):
+    def register_db(db_format, db_compression):
+        db_name = f"prova.{db_format}"
+        if db_compression is not None:
+            db_name += f".{db_compression}"
+
+        db_path = tmp_path / db_name
+        db.register(db_path, "https://alink", 1, log_structured=True)
+        return db_path
+
+    return register_db
+
+
+def get_log_dir(db_path):
+    return os.path.join(os.path.dirname(db_path), "prova_log")
+
+
+@pytest.mark.parametrize(
+    "db_format,db_compression",
+    [
+        ("json", None),
+        ("json", "zstd"),
+        ("pickle", "gz"),
+        ("parquet", None),
+    ],
+)
+def test_log_structured(mock_log_db, db_format, db_compression):
+    db_path = mock_log_db(db_format, db_compression)
+
+    db.write(db_path, ({"id": i} for i in range(1, 9)))
+    db.append(db_path, ({"id": i} for i in range(9, 12)))
+
+    base_stat = os.stat(db_path)
+
+    db.delete(db_path, lambda x: x["id"] in {2, 10})
+
+    # Deleting doesn't rewrite the DB.
+    assert os.stat(db_path).st_mtime_ns == base_stat.st_mtime_ns
+
+    assert [elem["id"] for elem in db.read(db_path)] == [1, 3, 4, 5, 6, 7, 8, 9, 11]
+
+    db.append(db_path, [{"id": 2}])
+    db.delete(db_path, lambda x: x["id"] == 7)
+
+    assert [elem["id"] for elem in db.read(db_path)] == [1, 3, 4, 5, 6, 8, 9, 11, 2]
+    assert list(db.read(db_path, columns=["id"]))[-1] == {"id": 2}
+
+    db.compact(db_path)
+
+    assert not os.path.exists(get_log_dir(db_path))
+    assert [elem["id"] for elem in db.read(db_path)] == [1, 3, 4, 5, 6, 8, 9, 11, 2]
+
+    db.write(db_path, [{"id": 42}])
+    assert list(db.read(db_path)) == [{"id": 42}]
+
+
+def test_log_structured_auto_compaction(mock_log_db):
+    db_path = mock_log_db("json", None)
+
+    db.write(db_path, ({"id": i} for i in range(1, 9)))
+
+    db.delete(db_path, lambda x: x["id"] <= 2)
+    assert os.path.exists(get_log_dir(db_path))
+
+    db.delete(db_path, lambda x: x["id"] <= 5)
+    assert not os.path.exists(get_log_dir(db_path))
+
+    assert [elem["id"] for elem in db.read(db_path)] == [6, 7, 8]
+
+
+def test_log_structured_upload_requires_compaction(mock_log_db):
+    db_path = mock_log_db("json", None)
+
+    db.write(db_path, ({"id": i} for i in range(1, 9)))
+    db.delete(db_path, lambda x: x["id"] == 1)
+
+    with pytest.raises(AssertionError):
+        db.upload(db_path)
+
+
+def test_log_structured_get_by_key(tmp_path):
+    db_path = tmp_path / "prova.json"
+    db.register(db_path, "https://alink", 1, index_keys=["id"], log_structured=True)
+
+    db.write(db_path, ({"id": i} for i in range(1, 9)))
+    assert list(db.get_by_key(db_path, [3])) == [{"id": 3}]
+
+    db.delete(db_path, lambda x: x["id"] == 3)
+    assert list(db.get_by_key(db_path, [3])) == []
+
+
 def test_unregistered_db(tmp_path):
     db_path = tmp_path / "prova.json"
 
@@ -88,7 +339,15 @@ def test_unregistered_db(tmp_path):
 
 
 @pytest.mark.parametrize(
-    "db_name", ["prova", "prova.", "prova.gz", "prova.unknown.gz", "prova.json.unknown"]
+    "db_name",
+    [
+        "prova",
+        "prova.",
+        "prova.gz",
+        "prova.unknown.gz",
+        "prova.json.unknown",
+        "prova.parquet.zstd",
+    ],
 )
 def test_bad_format_compression(tmp_path, db_name):
     db_path = tmp_path / db_name
@@ -430,3 +689,35 @@ def test_is_different_schema(tmp_path):
 
     # When the remote version file exists and returns an older version than the current db, we consider that the current db version is different from remote db version.
     assert db.is_different_schema(db_path)
+
+
+@pytest.mark.parametrize("db_format", ["json", "pickle"])
+@pytest.mark.parametrize("db_compression", [None, "zstd"])
+def test_open_lookup(mock_indexed_db, db_format, db_compression):
+    db_path = mock_indexed_db(db_format, db_compression)
+
+    with db.open_lookup(db_path) as lookup:
+        assert lookup(1) == []
+
+    db.write(db_path, ({"id": i, "group": i % 3} for i in range(1, 10)))
+    db.append(db_path, [{"id": 10, "group": None}])
+
+    with db.open_lookup(db_path, "group") as lookup:
+        assert [elem["id"] for elem in lookup(0)] == [3, 6, 9]
+        assert [elem["id"] for elem in lookup(1)] == [1, 4, 7]
+        assert lookup(3) == []
+
+    with db.open_lookup(db_path) as lookup:
+        assert lookup(10) == [{"id": 10, "group": None}]
+        assert lookup(11) == []
+
+
+def test_index_keys_changed(tmp_path):
+    db_path = tmp_path / "prova.json"
+    db.register(db_path, "https://alink", 1, index_keys=["id"])
+
+    db.write(db_path, ({"id": i, "group": i % 3} for i in range(1, 10)))
+    assert list(db.get_by_key(db_path, [1])) == [{"id": 1, "group": 1}]
+
+    db.register(db_path, "https://alink", 1, index_keys=["id", "group"])
+    assert [elem["id"] for elem in db.get_by_key(db_path, [0], "group")] == [3, 6, 9]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from sklearn.pipeline import Pipeline
+
+from bugbug import bug_features, commit_features, db, feature_cache, repository
+from bugbug.feature_cleanup import fileref, url
+
+
+class CountingAdded:
+    extracted = 0
+
+    def __call__(self, commit, **kwargs):
+        CountingAdded.extracted += 1
+        return commit["added"]
+
+
+def get_pipeline(feature_extractors, n_jobs=None):
+    return Pipeline(
+        [
+            (
+                "commit_extractor",
+                commit_features.CommitExtractor(
+                    feature_extractors, [fileref(), url()], n_jobs=n_jobs
+                ),
+            )
+        ]
+    )
+
+
+def test_get_key() -> None:
+    dbs = [repository.COMMITS_DB]
+
+    key = feature_cache.get_key("model", get_pipeline([CountingAdded()]), dbs)
+    assert key == feature_cache.get_key("model", get_pipeline([CountingAdded()]), dbs)
+    assert key == feature_cache.get_key(
+        "model", get_pipeline([CountingAdded()], n_jobs=4), dbs
+    )
+    assert key != feature_cache.get_key("model2", get_pipeline([CountingAdded()]), dbs)
+    assert key != feature_cache.get_key(
+        "model", get_pipeline([CountingAdded(), commit_features.Types()]), dbs
+    )
+    assert key != feature_cache.get_key("model", get_pipeline([CountingAdded()]), [])
+
+
+def test_is_order_independent() -> None:
+    assert feature_cache.is_order_independent(get_pipeline([CountingAdded()]))
+    assert not feature_cache.is_order_independent(
+        Pipeline(
+            [
+                (
+                    "bug_extractor",
+                    bug_features.BugExtractor([bug_features.ReporterExperience()], []),
+                )
+            ]
+        )
+    )
+
+
+def test_extract(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(feature_cache, "FEATURE_CACHE_DIR", str(tmp_path))
+
+    pipeline = get_pipeline([CountingAdded(), commit_features.Types()])
+    commits = [
+        {"added": i, "types": [f"type{i % 3}"], "desc": f"commit {i}"}
+        for i in range(10)
+    ]
+    labels = [i % 2 for i in range(10)]
+
+    def extract(commits, labels):
+        CountingAdded.extracted = 0
+        passes = 0
+
+        def items():
+            nonlocal passes
+            passes += 1
+            return zip(commits, labels)
+
+        X, y = feature_cache.extract("model", pipeline, [], items)
+        # The items are read once.
+        assert passes == 1
+        assert y == labels
+        assert X.equals(pipeline.transform(lambda: commits))
+        return CountingAdded.extracted - len(commits)
+
+    assert extract(commits, labels) == 10
+    assert extract(commits, labels) == 0
+
+    # Only new and modified items are extracted.
+    commits[3] = {**commits[3], "added": 42}
+    labels[5] = 1 - labels[5]
+    commits += [{"added": 11, "types": ["type4"], "desc": "commit 11"}]
+    labels += [0]
+    assert extract(commits, labels) == 3
+
+    # Items are identified by content, not by position.
+    assert extract(commits[::-1], labels[::-1]) == 0
+
+
+def test_get_key_dependent_dbs(tmp_path, monkeypatch) -> None:
+    commits_db = str(tmp_path / "commits.json")
+    monkeypatch.setattr(repository, "COMMITS_DB", commits_db)
+    db.register(commits_db, "https://fake", 1)
+    db.write(commits_db, [{"author_email": "a@mozilla.org"}])
+
+    def get_bug_pipeline():
+        return Pipeline(
+            [
+                (
+                    "bug_extractor",
+                    bug_features.BugExtractor(
+                        [bug_features.HasSTR()], [], commit_data=True
+                    ),
+                )
+            ]
+        )
+
+    assert feature_cache.get_dependent_dbs(get_bug_pipeline()) == [commits_db]
+    assert feature_cache.get_dependent_dbs(get_pipeline([CountingAdded()])) == []
+
+    key = feature_cache.get_key("model", get_bug_pipeline(), [])
+    assert key == feature_cache.get_key("model", get_bug_pipeline(), [])
+
+    # Features depend on the content of the commits DB through the author ids.
+    db.append(commits_db, [{"author_email": "b@mozilla.org"}])
+    assert key != feature_cache.get_key("model", get_bug_pipeline(), [])
+
+
+def test_get_code_digest() -> None:
+    modules: set[str] = set()
+    feature_cache._fingerprint(get_pipeline([CountingAdded()]).steps, modules)
+    assert "bugbug.commit_features" in modules
+
+    digest = feature_cache.get_code_digest(modules)
+    assert digest == feature_cache.get_code_digest(sorted(modules))
+    # Modules outside of bugbug are not part of the digest.
+    assert digest == feature_cache.get_code_digest(
+        [module for module in modules if module.startswith("bugbug.")]
+    )
+    assert digest != feature_cache.get_code_digest(["bugbug.feature_cleanup"])
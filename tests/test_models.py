@@ -5,7 +5,9 @@
 
 from logging import INFO, basicConfig, getLogger
 
-from bugbug import model
+import numpy as np
+
+from bugbug import bugzilla, db, model, repository
 from bugbug.models import MODELS, get_model_class
 
 basicConfig(level=INFO)
@@ -32,3 +34,78 @@ def test_component_is_bugmodel():
 def test_backout_is_commitmodel():
     model_class = get_model_class("backout")
     assert issubclass(model_class, model.CommitModel)
+
+
+def test_bugmodel_items_gen_commit_data():
+    commits_by_bug = {}
+    for commit in repository.get_commits():
+        commits_by_bug.setdefault(commit["bug_id"], []).append(commit)
+
+    bug_ids = [bug["id"] for bug in bugzilla.get_bugs()]
+
+    bug_model = model.BugModel(commit_data=True)
+    items = list(bug_model.items_gen({bug_id: 0 for bug_id in bug_ids}))
+
+    assert [bug["id"] for bug, _ in items] == bug_ids
+    assert any(bug["commits"] for bug, _ in items)
+    for bug, _ in items:
+        assert bug["commits"] == commits_by_bug.get(bug["id"], [])
+
+
+def test_commitmodel_items_gen_bug_data():
+    nodes = [commit["node"] for commit in repository.get_commits(include_ignored=True)]
+
+    # Bugs which bugzilla.get_bugs filters out are not used.
+    bug_ids = list(
+        dict.fromkeys(
+            commit["bug_id"]
+            for commit in repository.get_commits(include_ignored=True)
+            if commit["bug_id"]
+        )
+    )
+    all_bugs = list(db.read(bugzilla.BUGS_DB))
+    excluded = {}
+    for bug in all_bugs:
+        if bug["id"] == bug_ids[0]:
+            bug["product"] = "Invalid Bugs"
+            excluded[bug["id"]] = bug
+        elif bug["id"] == bug_ids[1]:
+            bug["product"] = "Unknown"
+            excluded[bug["id"]] = bug
+    assert len(excluded) == 2
+    db.write(bugzilla.BUGS_DB, all_bugs)
+
+    bugs = {bug["id"]: bug for bug in bugzilla.get_bugs()}
+    assert not any(bug_id in bugs for bug_id in excluded)
+
+    commit_model = model.CommitModel(bug_data=True)
+    items = list(commit_model.items_gen({node: 0 for node in nodes}))
+
+    assert [commit["node"] for commit, _ in items] == nodes
+    assert any(commit["bug"] for commit, _ in items)
+    for commit, _ in items:
+        assert commit["bug"] == bugs.get(commit["bug_id"], {})
+
+
+def test_get_confident_predictions():
+    y_pred_probas = np.array([[0.8, 0.2], [0.4, 0.6], [0.65, 0.35]])
+
+    pred_class_indices, classified = model.get_confident_predictions(
+        y_pred_probas, 0.3, True
+    )
+    assert pred_class_indices.tolist() == [0, 1, 1]
+    assert classified.tolist() == [True, True, True]
+
+    pred_class_indices, classified = model.get_confident_predictions(
+        y_pred_probas, 0.7, True
+    )
+    assert pred_class_indices.tolist() == [0, 0, 0]
+    assert classified.tolist() == [True, False, False]
+
+    y_pred_probas = np.array([[0.5, 0.3, 0.2], [0.1, 0.1, 0.8], [0.3, 0.4, 0.3]])
+
+    pred_class_indices, classified = model.get_confident_predictions(
+        y_pred_probas, 0.5, False
+    )
+    assert pred_class_indices.tolist() == [0, 2, 1]
+    assert classified.tolist() == [True, True, False]
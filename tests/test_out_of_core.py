@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import numpy as np
+import pandas as pd
+import pytest
+from imblearn.under_sampling import RandomUnderSampler
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.pipeline import Pipeline
+
+from bugbug import bug_features, out_of_core
+
+
+class DataFrameExtractor(BaseEstimator, TransformerMixin):
+    def fit(self, x, y=None):
+        return self
+
+    def transform(self, items):
+        return pd.DataFrame(list(items()))
+
+
+def get_union():
+    return ColumnTransformer(
+        [
+            ("data", DictVectorizer(), "data"),
+            ("title", TfidfVectorizer(min_df=0.02), "title"),
+            ("desc", CountVectorizer(max_features=20), "desc"),
+        ]
+    )
+
+
+def get_items(n):
+    rng = np.random.default_rng(0)
+    words = [f"word{i}" for i in range(50)]
+
+    return [
+        {
+            "data": {
+                "num": int(rng.integers(5)),
+                "keywords": [f"keyword{rng.integers(10)}"],
+                f"has_{rng.integers(30)}": True,
+            },
+            "title": " ".join(rng.choice(words, 5)),
+            "desc": " ".join(rng.choice(words, 8)),
+        }
+        for _ in range(n)
+    ]
+
+
+def test_fit_union(tmp_path) -> None:
+    items = get_items(1000)
+    X = pd.DataFrame(items)
+
+    store = out_of_core.ChunkStore(str(tmp_path))
+    y = out_of_core.extract(
+        Pipeline([("extractor", DataFrameExtractor())]),
+        ((item, 0) for item in items),
+        store,
+        chunk_size=128,
+    )
+    assert len(store) == 8
+    assert y == [0] * 1000
+
+    indices = np.arange(0, 1000, 3)
+    selected = pd.concat(out_of_core.select_rows(store, indices))
+    assert selected.index.tolist() == indices.tolist()
+
+    union = get_union()
+    out_of_core.fit_union(union, lambda: out_of_core.select_rows(store, indices))
+    expected_union = get_union().fit(X.iloc[indices])
+
+    assert union.output_indices_ == expected_union.output_indices_
+    assert (
+        union.get_feature_names_out() == expected_union.get_feature_names_out()
+    ).all()
+    assert abs(union.transform(X) - expected_union.transform(X)).max() == 0
+
+
+def test_resample() -> None:
+    indices = np.arange(10, 110)
+    y = np.array([0] * 80 + [1] * 20)
+
+    resampled = out_of_core.resample(RandomUnderSampler(random_state=0), indices, y)
+    assert len(resampled) == 40
+    assert (np.diff(resampled) > 0).all()
+    assert (y[resampled - 10] == 1).sum() == 20
+
+
+def test_extract_keeps_extractor_state(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(out_of_core, "OUT_OF_CORE_CHUNK_SIZE", 3)
+
+    bugs = [
+        {"creator": f"user{i % 2}", "id": i, "summary": "", "comments": []}
+        for i in range(10)
+    ]
+    pipeline = Pipeline(
+        [
+            (
+                "bug_extractor",
+                bug_features.BugExtractor(
+                    [bug_features.ReporterExperience()], [], n_jobs=1
+                ),
+            )
+        ]
+    )
+
+    store = out_of_core.ChunkStore(str(tmp_path))
+    y = out_of_core.extract(pipeline, ((bug, bug["id"]) for bug in bugs), store)
+    assert len(store) == 4
+    assert y == list(range(10))
+
+    # The reporter experience keeps growing across chunk boundaries.
+    X = pd.concat(store)
+    assert list(X.index) == list(range(10))
+    assert X.equals(pipeline.transform(lambda: bugs))
+    assert [row[bug_features.ReporterExperience.name] for row in X["data"]] == [
+        i // 2 for i in range(10)
+    ]
+
+
+def test_extract_order_dependent(tmp_path) -> None:
+    class Extractor(DataFrameExtractor):
+        feature_extractors = [bug_features.ReporterExperience()]
+
+    with pytest.raises(ValueError):
+        out_of_core.extract(
+            Pipeline([("extractor", Extractor())]),
+            [({"creator": "user"}, 0)],
+            out_of_core.ChunkStore(str(tmp_path)),
+        )
@@ -19,6 +19,7 @@ import zstandard
 from dateutil.relativedelta import relativedelta
 
 from bugbug import commit_features, repository, rust_code_analysis_server
+from bugbug.utils import ArrayExpQueue, CommitListExpQueue, ExpQueue
 
 basicConfig(level=INFO)
 logger = getLogger(__name__)
@@ -237,6 +238,74 @@ def test_hg_modified_files(fake_hg_repo):
     assert commits[4].file_copies == {}
 
 
+def test_hg_modified_files_batch(fake_hg_repo):
+    hg, local, remote = fake_hg_repo
+
+    add_file(hg, local, "f1", "1\n2\n3\n4\n5\n6\n7\n")
+    commit(hg)
+
+    add_file(hg, local, "f2", "1\n2\n3\n4\n5\n6\n7\n")
+    commit(hg, "Bug 123 - Prova. r=moz,rev2")
+
+    hg.move(
+        bytes(os.path.join(local, "f2"), "ascii"),
+        bytes(os.path.join(local, "f2move"), "ascii"),
+    )
+    commit(hg, "Move")
+
+    revs = repository.get_revs(hg)
+    commits = repository.hg_log(hg, revs, branch=None)
+
+    repository.path_to_component = {}
+
+    repository.hg_modified_files_batch(hg, commits)
+
+    assert [c.files for c in commits] == [["f1"], ["f2"], ["f2", "f2move"]]
+    assert [c.file_copies for c in commits] == [{}, {}, {"f2": "f2move"}]
+
+
+def test_hg_export_batch(fake_hg_repo):
+    hg, local, remote = fake_hg_repo
+
+    add_file(hg, local, "file1", "1\n")
+    revision1 = commit(hg)
+
+    add_file(hg, local, "file2", "2\n")
+    # A commit message which looks like the start of a patch.
+    revision2 = commit(hg, "Bug 123 - Prova\n# HG changeset patch\n")
+
+    add_file(hg, local, "file3", "3\n")
+    revision3 = commit(hg)
+
+    for revisions in [[revision1, revision3], [revision1, revision2, revision3]]:
+        patches = repository.hg_export_batch(hg, revisions)
+        assert patches == {
+            revision: hg.export(revs=[revision.encode("ascii")], git=True)
+            for revision in revisions
+        }
+
+
+def test_hg_cat_files(fake_hg_repo):
+    hg, local, remote = fake_hg_repo
+
+    add_file(hg, local, "file1", "1\n2\n")
+    os.makedirs(os.path.join(local, "dir"))
+    add_file(hg, local, "dir/file2", "\0\n\0")
+    revision1 = commit(hg)
+
+    remove_file(hg, local, "file1")
+    revision2 = commit(hg)
+
+    assert repository.hg_cat_files(
+        hg, local, revision1.encode("ascii"), ["file1", "dir/file2"]
+    ) == {"file1": b"1\n2\n", "dir/file2": b"\0\n\0"}
+
+    # Files which don't exist at the revision are left out.
+    assert repository.hg_cat_files(
+        hg, local, revision2.encode("ascii"), ["file1", "dir/file2"]
+    ) == {"dir/file2": b"\0\n\0"}
+
+
 def test_hg_log(fake_hg_repo):
     hg, local, remote = fake_hg_repo
 
@@ -1776,6 +1845,214 @@ def test_calculate_experiences_no_save() -> None:
     assert commits["commit6"].touched_prev_90_days_component_min == 2
 
 
+def test_calculate_experiences_legacy_read_only() -> None:
+    repository.path_to_component = {}
+
+    # An experiences DB which was not migrated.
+    experiences = repository.Experiences(True)
+    experiences["file$$dom/file1.cpp"] = ExpQueue(
+        0, repository.EXPERIENCE_TIMESPAN + 1, ("commit1",)
+    )
+    experiences["file$$dom/file2.cpp"] = ExpQueue(
+        0, repository.EXPERIENCE_TIMESPAN + 1, ("commit1",)
+    )
+    experiences.db_experiences.close()
+
+    def make_commit(node, day, files):
+        return repository.Commit(
+            node=node,
+            author="author1",
+            desc=node,
+            pushdate=datetime(2019, 1, 1 + day),
+            bug_id=123,
+            backsout=[],
+            backedoutby="",
+            author_email="author1@mozilla.org",
+            reviewers=[],
+        ).set_files(files, {})
+
+    commits = [
+        make_commit("commit2", 1, ["dom/file1.cpp"]),
+        make_commit("commit3", 2, ["dom/file1.cpp", "dom/file2.cpp"]),
+    ]
+
+    # The lists of commit nodes are converted on the fly, as the DB is read-only.
+    repository.calculate_experiences(commits, datetime(2019, 1, 1), save=False)
+
+    assert commits[0].touched_prev_total_file_sum == 1
+    # The ids of new commits don't overlap with the ones of converted commits.
+    assert commits[1].touched_prev_total_file_sum == 2
+    assert commits[1].touched_prev_total_file_max == 2
+    assert commits[1].touched_prev_total_file_min == 1
+
+
+def test_migrate_experiences() -> None:
+    experiences = repository.Experiences(True)
+    queue = ExpQueue(3, 5, 0)
+    queue[4] = 2
+    experiences["author$$author1"] = queue
+    experiences["file$$dom/file1.cpp"] = ExpQueue(3, 5, ("commit1",))
+    experiences["first_commit_time$author1"] = datetime(2019, 1, 1)
+    experiences.db_experiences.close()
+
+    assert repository.migrate_experiences() == 2
+    assert repository.migrate_experiences() == 0
+
+    experiences = repository.Experiences(False)
+    assert isinstance(experiences["author$$author1"], ArrayExpQueue)
+    assert experiences["author$$author1"][4] == 2
+    assert experiences["author$$author1"][3] == 0
+    assert isinstance(experiences["file$$dom/file1.cpp"], CommitListExpQueue)
+    assert experiences["file$$dom/file1.cpp"][3] == 1
+    assert experiences["file$$dom/file1.cpp"].get_ids(0, 1).tolist() == [0]
+    assert experiences["first_commit_time$author1"] == datetime(2019, 1, 1)
+    assert experiences[repository.NEXT_COMMIT_ID_KEY] == 1
+
+
+def test_experiences_checkpoint() -> None:
+    experiences = repository.Experiences(True)
+    assert experiences.get_checkpoint() is None
+    experiences["first_commit_time$author1"] = datetime(2019, 1, 1)
+    experiences.checkpoint("commit1")
+    experiences["first_commit_time$author2"] = datetime(2019, 1, 2)
+    experiences.close()
+
+    # Only the changes made up to the checkpoint are persisted.
+    experiences = repository.Experiences(True)
+    assert experiences.get_checkpoint() == "commit1"
+    assert experiences["first_commit_time$author1"] == datetime(2019, 1, 1)
+    assert "first_commit_time$author2" not in experiences
+    experiences.close()
+
+
+def test_mine_commits_resume(fake_hg_repo, monkeypatch):
+    hg, local, remote = fake_hg_repo
+
+    repository.path_to_component = {}
+
+    # Remove the mock DB generated by the mock_data fixture.
+    os.remove("data/commits.json")
+
+    def set_commit_coverage(commits):
+        for commit in commits:
+            commit["cov_added"] = commit["cov_covered"] = commit["cov_unknown"] = None
+
+    monkeypatch.setattr(repository, "download_component_mapping", lambda: None)
+    monkeypatch.setattr(repository, "download_coverage_mapping", lambda: None)
+    monkeypatch.setattr(repository, "get_component_mapping", lambda: None)
+    monkeypatch.setattr(repository, "close_component_mapping", lambda: None)
+    monkeypatch.setattr(repository, "set_commit_coverage", set_commit_coverage)
+    monkeypatch.setattr(
+        repository, "get_first_pushdate", lambda repo_dir: datetime(2019, 1, 1)
+    )
+    monkeypatch.setattr(
+        repository.rust_code_analysis_server, "get_server", lambda thread_num: None
+    )
+
+    revs = [f"{i:040x}".encode("ascii") for i in range(5)]
+    mined_chunks = []
+    fail_on = revs[2]
+
+    def mine_commits_chunk(hg, repo_dir, chunk_revs, branch, executor):
+        if fail_on in chunk_revs:
+            raise RuntimeError("Mining interrupted")
+
+        mined_chunks.append(chunk_revs)
+
+        return tuple(
+            repository.Commit(
+                node=rev.decode("ascii"),
+                author="author1",
+                desc="commit",
+                pushdate=datetime(2019, 1, 1 + revs.index(rev)),
+                bug_id=123,
+                backsout=[],
+                backedoutby="",
+                author_email="author1@mozilla.org",
+                reviewers=[],
+            ).set_files([], {})
+            for rev in chunk_revs
+        )
+
+    monkeypatch.setattr(repository, "_mine_commits_chunk", mine_commits_chunk)
+
+    with pytest.raises(RuntimeError, match="Mining interrupted"):
+        list(
+            repository.mine_commits(
+                local, revs=revs, use_single_process=True, chunk_size=2
+            )
+        )
+
+    assert mined_chunks == [revs[0:2]]
+    assert [commit["node"] for commit in repository.get_commits()] == [
+        rev.decode("ascii") for rev in revs[0:2]
+    ]
+
+    # Mining again resumes after the last checkpoint.
+    mined_chunks.clear()
+    fail_on = None
+
+    commits = list(
+        repository.mine_commits(local, revs=revs, use_single_process=True, chunk_size=2)
+    )
+
+    assert mined_chunks == [revs[2:4], revs[4:5]]
+    assert [commit["node"] for commit in commits] == [
+        rev.decode("ascii") for rev in revs[2:5]
+    ]
+    commits = list(repository.get_commits())
+    assert [commit["node"] for commit in commits] == [
+        rev.decode("ascii") for rev in revs
+    ]
+    # The experiences of the commits mined before the interruption were kept.
+    assert commits[2]["seniority_author"] == 2 * 86400
+    assert commits[4]["seniority_author"] == 4 * 86400
+
+    # If the mining is interrupted after storing a chunk but before checkpointing
+    # its experiences, the chunk is mined again, even when resuming from the last
+    # commit in the DB.
+    more_revs = [f"{i:040x}".encode("ascii") for i in range(5, 9)]
+    revs += more_revs
+    mined_chunks.clear()
+
+    checkpoint = repository.Experiences.checkpoint
+
+    def failing_checkpoint(self, node):
+        if node == more_revs[1].decode("ascii"):
+            raise RuntimeError("Checkpoint interrupted")
+        checkpoint(self, node)
+
+    monkeypatch.setattr(repository.Experiences, "checkpoint", failing_checkpoint)
+
+    with pytest.raises(RuntimeError, match="Checkpoint interrupted"):
+        list(
+            repository.mine_commits(
+                local, revs=more_revs, use_single_process=True, chunk_size=2
+            )
+        )
+
+    assert [commit["node"] for commit in repository.get_commits()] == [
+        rev.decode("ascii") for rev in revs[:7]
+    ]
+
+    monkeypatch.setattr(repository.Experiences, "checkpoint", checkpoint)
+    mined_chunks.clear()
+
+    commits = list(
+        repository.mine_commits(
+            local, revs=more_revs[2:], use_single_process=True, chunk_size=2
+        )
+    )
+
+    assert mined_chunks == [more_revs[0:2], more_revs[2:4]]
+    commits = list(repository.get_commits())
+    assert [commit["node"] for commit in commits] == [
+        rev.decode("ascii") for rev in revs
+    ]
+    assert commits[5]["seniority_author"] == 5 * 86400
+    assert commits[8]["seniority_author"] == 8 * 86400
+
+
 def test_get_touched_functions():
     # Allow using the local code analysis server.
     responses.add_passthru("http://127.0.0.1")
@@ -2859,3 +3136,39 @@ void main() {
             }
         ]
     }
+
+
+def test_get_commits_by_nodes():
+    BACKOUT_COMMIT = "ec01c146f756b74d18e4892b4fd3aecba00da93e"
+    NOBUG_COMMIT = "75966ee1fe658b1767d7459256175c0662d14c25"
+
+    all_commits = list(
+        repository.get_commits(
+            include_ignored=True, include_backouts=True, include_no_bug=True
+        )
+    )
+    nodes = [all_commits[5]["node"], all_commits[1]["node"], "0" * 40]
+
+    retrieved_commits = list(
+        repository.get_commits_by_nodes(
+            nodes, include_ignored=True, include_backouts=True, include_no_bug=True
+        )
+    )
+    assert retrieved_commits == [all_commits[1], all_commits[5]]
+
+    assert list(repository.get_commits_by_nodes([BACKOUT_COMMIT, NOBUG_COMMIT])) == []
+    assert [
+        c["node"]
+        for c in repository.get_commits_by_nodes(
+            [BACKOUT_COMMIT, NOBUG_COMMIT], include_backouts=True
+        )
+    ] == [BACKOUT_COMMIT]
+
+
+def test_get_commits_by_bug_ids():
+    commits = list(repository.get_commits())
+    bug_id = commits[0]["bug_id"]
+
+    assert list(repository.get_commits_by_bug_ids([bug_id])) == [
+        c for c in commits if c["bug_id"] == bug_id
+    ]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import concurrent.futures
+import os
+from urllib.parse import parse_qs, urlparse
+
+import responses
+
+from bugbug import rust_code_analysis_server
+
+
+def test_get_server(monkeypatch, caplog):
+    started = []
+
+    class FakeServer:
+        def __init__(self, thread_num=None):
+            started.append(thread_num)
+            self.thread_num = thread_num
+            self.pid = os.getpid()
+            self.running = True
+
+        def is_running(self):
+            return self.running
+
+        def terminate(self):
+            self.running = False
+
+    monkeypatch.setattr(rust_code_analysis_server, "RustCodeAnalysisServer", FakeServer)
+    monkeypatch.setattr(rust_code_analysis_server, "_server", None)
+
+    # The server is started once, and reused.
+    server = rust_code_analysis_server.get_server(1)
+    assert rust_code_analysis_server.get_server() is server
+    assert started == [1]
+
+    # Asking for more threads doesn't restart it, but warns.
+    assert rust_code_analysis_server.get_server(1) is server
+    assert "started with" not in caplog.text
+    assert rust_code_analysis_server.get_server(4) is server
+    assert "started with 1 threads, fewer than 4" in caplog.text
+    assert started == [1]
+
+    # It is started again if it stopped.
+    server.terminate()
+    assert rust_code_analysis_server.get_server() is not server
+    assert started == [1, None]
+
+
+def test_metrics_batch():
+    # Don't start an actual server.
+    server = object.__new__(rust_code_analysis_server.RustCodeAnalysisServer)
+    server._session = None
+    server.port = 8765
+    server.metrics_cache = None
+
+    def metrics_callback(request):
+        file_name = parse_qs(urlparse(request.url).query)["file_name"][0]
+        return (
+            200,
+            {},
+            f'{{"name": "{file_name}", "size": {len(request.body or b"")}}}',
+        )
+
+    responses.add_callback(
+        responses.POST,
+        f"{server.base_url}/metrics",
+        callback=metrics_callback,
+    )
+
+    files = [(f"file{i}.cpp", b"x" * i) for i in range(20)]
+    assert server.metrics_batch(files, unit=False) == [
+        {"name": f"file{i}.cpp", "size": i} for i in range(20)
+    ]
+
+
+def test_metrics_cache(tmp_path):
+    server = object.__new__(rust_code_analysis_server.RustCodeAnalysisServer)
+    server._session = None
+    server.port = 8765
+    server.metrics_cache = rust_code_analysis_server.MetricsCache(
+        str(tmp_path / "metrics.lmdb"), "1.0"
+    )
+
+    def metrics_callback(request):
+        file_name = parse_qs(urlparse(request.url).query)["file_name"][0]
+        return (
+            200,
+            {},
+            f'{{"id": "{file_name}", "language": "C++", "spaces": {{"name": "{file_name}", "size": {len(request.body)}}}}}',
+        )
+
+    responses.add_callback(
+        responses.POST,
+        f"{server.base_url}/metrics",
+        callback=metrics_callback,
+    )
+
+    expected = {
+        "id": "a/file.cpp",
+        "language": "C++",
+        "spaces": {"name": "a/file.cpp", "size": 4},
+    }
+    assert server.metrics("a/file.cpp", b"code", unit=False) == expected
+    assert len(responses.calls) == 1
+
+    # The same content is not analyzed again, even in another file.
+    assert server.metrics("a/file.cpp", b"code", unit=False) == expected
+    assert server.metrics("b/other.cpp", "code", unit=False) == {
+        "id": "b/other.cpp",
+        "language": "C++",
+        "spaces": {"name": "b/other.cpp", "size": 4},
+    }
+    assert len(responses.calls) == 1
+
+    # Different content, languages or options are analyzed.
+    server.metrics("a/file.cpp", b"other code", unit=False)
+    server.metrics("a/file.rs", b"code", unit=False)
+    server.metrics("a/file.cpp", b"code", unit=True)
+    assert len(responses.calls) == 4
+
+    # A different version of rust-code-analysis doesn't use the same metrics.
+    server.metrics_cache.version = "2.0"
+    server.metrics("a/file.cpp", b"code", unit=False)
+    assert len(responses.calls) == 5
+
+
+def test_is_running_forked(monkeypatch):
+    server = object.__new__(rust_code_analysis_server.RustCodeAnalysisServer)
+    server.pid = os.getpid() + 1
+    server.proc = None
+
+    # In processes forked from the one which started it, the server is running as
+    # long as it answers.
+    monkeypatch.setattr(server, "ping", lambda: True)
+    assert server.is_running()
+    monkeypatch.setattr(server, "ping", lambda: False)
+    assert not server.is_running()
+
+
+def test_metrics_cache_full(tmp_path):
+    cache = rust_code_analysis_server.MetricsCache(
+        str(tmp_path / "metrics.lmdb"), "1.0", max_size=2**20
+    )
+
+    # The cache is cleared when it is full, so it doesn't grow past its maximum size.
+    metrics = {"id": "file.cpp", "data": os.urandom(2048).hex()}
+    keys = [cache.get_key("file.cpp", str(i), True) for i in range(1000)]
+    for key in keys:
+        cache.put(key, "file.cpp", metrics)
+
+    assert cache.get(keys[-1], "file.cpp") == metrics
+    assert cache.get(keys[0], "file.cpp") is None
+    assert os.path.getsize(tmp_path / "metrics.lmdb" / "data.mdb") <= 2**20
+
+
+def test_metrics_cache_concurrent_open(tmp_path):
+    cache = rust_code_analysis_server.MetricsCache(
+        str(tmp_path / "metrics.lmdb"), "1.0"
+    )
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        envs = list(executor.map(lambda _: cache.env, range(64)))
+
+    assert all(env is envs[0] for env in envs)
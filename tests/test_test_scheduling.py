@@ -3,15 +3,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import collections
+import itertools
+import os
+import pickle
 from datetime import datetime
 
+import hypothesis
+import hypothesis.strategies as st
 import pytest
 from _pytest.monkeypatch import MonkeyPatch
 
 from bugbug import repository, test_scheduling
 from bugbug.repository import CommitDict
 from bugbug.test_scheduling import ConfigGroup, Group, Revision, Task
-from bugbug.utils import ExpQueue
+from bugbug.utils import ArrayExpQueue, ExpQueue
 
 
 def test_rename_runnables() -> None:
@@ -1023,3 +1029,271 @@ def test_fallback_on_ini() -> None:
     past_failures.set("browser.toml", ExpQueue(0, 1, 22))
     assert_val("browser.toml", 22)
     assert_val("browser.ini", 42)
+
+
+def test_past_failures_legacy_pickle() -> None:
+    past_failures = test_scheduling.PastFailures("group", False)
+    past_failures.db[b"all$browser.ini$all"] = pickle.dumps(ExpQueue(0, 3, 5))
+    past_failures.push_num = 7
+    past_failures.close()
+
+    past_failures = test_scheduling.PastFailures("group", True)
+    assert past_failures.push_num == 7
+    exp_queue = past_failures.get("all$browser.ini$all")
+    assert isinstance(exp_queue, ExpQueue)
+    assert exp_queue[0] == 5
+    past_failures.close()
+
+    past_failures = test_scheduling.PastFailures("group", False)
+    assert past_failures.migrate() == 1
+    assert past_failures.migrate() == 0
+    past_failures.close()
+
+    past_failures = test_scheduling.PastFailures("group", True)
+    assert past_failures.push_num == 7
+    exp_queue = past_failures.get("all$browser.ini$all")
+    assert isinstance(exp_queue, ArrayExpQueue)
+    assert exp_queue[0] == 5
+    past_failures.close()
+
+
+def test_past_failures_cache() -> None:
+    past_failures = test_scheduling.PastFailures("group", False, cache_size=2)
+
+    for i in range(5):
+        past_failures.set(f"all$manifest{i}.ini$all", ExpQueue(0, 2, i))
+    past_failures.set("manifest1.ini", ExpQueue(0, 2, 1))
+
+    # Values which are set are written back when evicted and on close.
+    exp_queue = past_failures.get("all$manifest0.ini$all")
+    assert exp_queue is not None
+    exp_queue[0] = 10
+    past_failures.set("all$manifest0.ini$all", exp_queue)
+    for i in range(1, 5):
+        past_failures.get(f"all$manifest{i}.ini$all")
+    assert len(past_failures.cache) == 2
+    exp_queue = past_failures.get("all$manifest4.ini$all")
+    exp_queue[1] = 20
+    past_failures.set("all$manifest4.ini$all", exp_queue)
+    past_failures.close()
+
+    # Values which are only read are not written back.
+    past_failures = test_scheduling.PastFailures("group", False)
+    writes = []
+    past_failures._write = lambda key, value: writes.append(key)
+    for i in range(5):
+        past_failures.get(f"all$manifest{i}.ini$all")
+    past_failures.get("manifest1.toml")
+    past_failures.sync()
+    assert writes == []
+    past_failures.db.close()
+
+    past_failures = test_scheduling.PastFailures("group", True)
+    past_failures.prefetch(
+        [
+            "all$manifest0.ini$all",
+            "all$manifest4.ini$all",
+            "manifest1.toml",
+            "all$unexisting.ini$all",
+        ]
+    )
+    assert set(past_failures.cache) == {
+        "all$manifest0.ini$all",
+        "all$manifest4.ini$all",
+        "manifest1.toml",
+        "manifest1.ini",
+        "all$unexisting.ini$all",
+    }
+    assert past_failures.cache["all$unexisting.ini$all"] is None
+
+    assert past_failures.get("all$manifest0.ini$all")[0] == 10
+    assert past_failures.get("all$manifest4.ini$all")[1] == 20
+    assert past_failures.get("manifest1.toml")[0] == 1
+    assert past_failures.get("all$manifest3.ini$all")[0] == 3
+    assert past_failures.get("all$unexisting.ini$all") is None
+    past_failures.close()
+
+
+@hypothesis.settings(deadline=None)
+@hypothesis.given(
+    st.lists(
+        st.tuples(
+            st.sets(st.sampled_from("abcdefgh")), st.sets(st.sampled_from("abcdefgh"))
+        ),
+        max_size=30,
+    ),
+    st.integers(min_value=1, max_value=4),
+)
+def test_couples_counter(rows, chunk_size) -> None:
+    count_runs: collections.Counter = collections.Counter()
+    count_single_failures: collections.Counter = collections.Counter()
+    count_both_failures: collections.Counter = collections.Counter()
+
+    with MonkeyPatch.context() as mp:
+        mp.setattr(test_scheduling, "FAILING_TOGETHER_CHUNK_SIZE", chunk_size)
+
+        couples_counter = test_scheduling.CouplesCounter()
+        for runnables, failures in rows:
+            runnables |= failures
+            couples_counter.add(runnables, failures)
+
+            for task1, task2 in itertools.combinations(sorted(runnables), 2):
+                count_runs[(task1, task2)] += 1
+                if task1 in failures and task2 in failures:
+                    count_both_failures[(task1, task2)] += 1
+                elif task1 in failures or task2 in failures:
+                    count_single_failures[(task1, task2)] += 1
+
+        result = {
+            couple: (run_count, single_failure_count, failure_count)
+            for couple, run_count, single_failure_count, failure_count in (
+                couples_counter.couples()
+            )
+        }
+
+    assert result == {
+        couple: (
+            run_count,
+            count_single_failures[couple],
+            count_both_failures[couple],
+        )
+        for couple, run_count in count_runs.items()
+    }
+    assert all(type(count) is int for counts in result.values() for count in counts)
+
+
+def test_generate_failing_together_probabilities() -> None:
+    push_data = [
+        (
+            ("rev1",),
+            "rev1",
+            (("linux", "a.ini"), ("windows", "a.ini"), ("linux", "b.ini")),
+            (("linux", "a.ini"), ("windows", "a.ini")),
+            (),
+        ),
+        (
+            ("rev2",),
+            "rev2",
+            (("linux", "a.ini"), ("windows", "a.ini"), ("windows", "b.ini")),
+            (),
+            (("linux", "a.ini"),),
+        ),
+        (
+            ("rev3",),
+            "rev3",
+            (("linux", "b.ini"), ("windows", "b.ini")),
+            (),
+            (),
+        ),
+    ]
+
+    test_scheduling.generate_failing_together_probabilities(
+        "config_group", lambda: iter(push_data), len(push_data)
+    )
+
+    failing_together = test_scheduling.get_failing_together_db("config_group", True)
+    assert pickle.loads(failing_together[b"a.ini"]) == {
+        "linux": {"windows": (0.5, 0.5)},
+    }
+    assert pickle.loads(failing_together[b"b.ini"]) == {
+        "linux": {"windows": (0.0, 1.0)},
+    }
+    assert set(pickle.loads(failing_together[b"$ALL_CONFIGS$"])) == {
+        "linux",
+        "windows",
+    }
+    test_scheduling.close_failing_together_db("config_group")
+
+
+def test_generate_failing_together_probabilities_incremental() -> None:
+    push_data = [
+        (
+            (f"rev{i}",),
+            f"rev{i}",
+            ("test-linux/opt", "test-windows/opt", "test-mac/opt"),
+            ("test-linux/opt", "test-windows/opt") if i % 2 == 0 else (),
+            ("test-mac/opt",) if i % 3 == 0 else (),
+        )
+        for i in range(10)
+    ]
+
+    def get_failing_together(granularity, push_data, up_to=None, all_runnables=None):
+        test_scheduling.generate_failing_together_probabilities(
+            granularity, lambda: iter(push_data), len(push_data), up_to, all_runnables
+        )
+        failing_together = test_scheduling.get_failing_together_db(granularity, True)
+        result = {
+            bytes(key): pickle.loads(failing_together[key])
+            for key in failing_together.keys()
+        }
+        test_scheduling.close_failing_together_db(granularity)
+        return result
+
+    def get_from_scratch(granularity, push_data, up_to=None, all_runnables=None):
+        os.remove(test_scheduling.get_failing_together_counts_path(granularity))
+        return get_failing_together(granularity, push_data, up_to, all_runnables)
+
+    for granularity in ("label", "config_group"):
+        if granularity == "config_group":
+            push_data = [
+                (
+                    revisions,
+                    fix_revision,
+                    tuple((task, "a.ini") for task in tasks),
+                    tuple((task, "a.ini") for task in likely_regressions),
+                    tuple((task, "a.ini") for task in candidate_regressions),
+                )
+                for (
+                    revisions,
+                    fix_revision,
+                    tasks,
+                    likely_regressions,
+                    candidate_regressions,
+                ) in push_data
+            ]
+
+        # Incrementally counting new pushes is the same as counting from scratch.
+        get_failing_together(granularity, push_data[:6])
+        incremental = get_failing_together(granularity, push_data)
+        assert incremental == get_from_scratch(granularity, push_data)
+
+        # Snapshots are the same as counting from scratch up to the given push.
+        snapshot = get_failing_together(granularity, push_data, "rev4")
+        assert snapshot != incremental
+        assert snapshot == get_from_scratch(granularity, push_data[:5])
+
+        # The snapshot doesn't modify the stored counts.
+        assert get_failing_together(granularity, push_data) == incremental
+
+        # Pushes going out of the push data window are removed.
+        get_failing_together(granularity, push_data)
+        window_push_data = push_data[3:]
+        assert get_failing_together(granularity, window_push_data) == (
+            get_from_scratch(granularity, window_push_data)
+        )
+
+        # Pushes whose data changed are counted again.
+        get_failing_together(granularity, push_data)
+        changed_push_data = list(push_data)
+        changed_push_data[5] = changed_push_data[5][:3] + ((), changed_push_data[5][2])
+        assert get_failing_together(granularity, changed_push_data) == (
+            get_from_scratch(granularity, changed_push_data)
+        )
+
+        # If the order of the counted pushes changed, everything is counted again.
+        get_failing_together(granularity, push_data)
+        reordered_push_data = push_data[5:] + push_data[:5]
+        assert get_failing_together(granularity, reordered_push_data) == (
+            get_from_scratch(granularity, reordered_push_data)
+        )
+
+        # The runnables to consider don't affect the stored counts.
+        all_runnables = [push_data[0][2][0], push_data[0][2][2]]
+        get_failing_together(granularity, push_data)
+        filtered = get_failing_together(granularity, push_data, None, all_runnables)
+        assert filtered != incremental
+        assert filtered == get_from_scratch(granularity, push_data, None, all_runnables)
+
+        # Snapshots can't be taken at pushes which were not counted.
+        with pytest.raises(ValueError, match="rev42 was not counted"):
+            get_failing_together(granularity, push_data, "rev42")
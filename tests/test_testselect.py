@@ -11,11 +11,12 @@ from typing import Iterator
 import hypothesis
 import hypothesis.strategies as st
 import pytest
+import scipy.sparse as sp
 from igraph import Graph
 
 from bugbug import test_scheduling
 from bugbug.models import testselect
-from bugbug.utils import LMDBDict
+from bugbug.utils import LMDBDict, to_array
 
 
 @pytest.fixture
@@ -796,3 +797,62 @@ def test_select_configs(failing_together_config_group: LMDBDict) -> None:
         "linux1804-64-asan/debug",
     }
     assert set(result["group3"]) == {"linux1804-64/opt", "windows10/debug"}
+
+
+@pytest.mark.parametrize("granularity", ["label", "group"])
+def test_vectorize_test_jobs(granularity: str) -> None:
+    model = testselect.TestSelectModel(granularity=granularity)
+
+    failure_fields = [
+        f"failures{period}{kind}"
+        for period in ("", "_past_700_pushes", "_past_1400_pushes", "_past_2800_pushes")
+        for kind in ("", "_in_types", "_in_files", "_in_directories")
+    ]
+
+    if granularity == "label":
+        names = [
+            "test-linux1804-64/debug-mochitest-1",
+            "test-windows10-64/opt-xpcshell-2",
+            "test-android-em-7.0-x86_64/opt-reftest-3",
+        ]
+    else:
+        names = [
+            "dom/base/test/mochitest.ini",
+            "toolkit/components/xpcshell.ini",
+            "layout/reftests/reftest.list",
+        ]
+
+    def test_jobs(seed):
+        return [
+            {
+                "name": name,
+                "touched_together_files": (i + seed) % 3,
+                "touched_together_directories": (i * seed) % 2,
+                **{field: (i + j + seed) % 4 for j, field in enumerate(failure_fields)},
+            }
+            for i, name in enumerate(names)
+        ]
+
+    commit = {"files": ["dom/base/nsDocument.cpp", "toolkit/content/widgets.js"]}
+
+    def commit_tests(test_jobs):
+        return [{**commit, "test_job": test_job} for test_job in test_jobs]
+
+    X_train = model.extraction_pipeline.fit_transform(
+        lambda: commit_tests(test_jobs(0))
+    )
+    model.clf.named_steps["union"].fit(X_train)
+
+    test_jobs_eval = test_jobs(1) + test_jobs(2)
+    expected = model.clf.named_steps["union"].transform(
+        model.extraction_pipeline.transform(lambda: commit_tests(test_jobs_eval))
+    )
+    result = model.vectorize_test_jobs(commit, test_jobs_eval)
+
+    assert type(result) is type(expected)
+    assert result.shape == expected.shape
+    assert (to_array(result) == to_array(expected)).all()
+    if isinstance(expected, sp.csr_matrix):
+        # Explicit zeros are not missing values for XGBoost.
+        assert (result.indptr == expected.indptr).all()
+        assert (result.indices == expected.indices).all()
@@ -3,9 +3,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
+
 import responses
 
-from bugbug import bugzilla, db
+from bugbug import bugzilla, db, out_of_core
+from bugbug.models.regression import RegressionModel
 from scripts import trainer
 
 
@@ -29,3 +32,61 @@ def test_trainer():
     )
 
     trainer.Trainer().go(trainer.parse_args(["regression"]))
+
+
+def test_trainer_thresholds():
+    url = "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_bugs.latest/artifacts/public/bugs.json"
+
+    responses.add(
+        responses.GET,
+        f"{url}.version",
+        status=200,
+        body=str(db.DATABASES[bugzilla.BUGS_DB]["version"]),
+    )
+
+    responses.add(
+        responses.HEAD,
+        f"{url}.zst",
+        status=200,
+        headers={"ETag": "etag"},
+    )
+
+    trainer.Trainer().go(
+        trainer.parse_args(["regression", "--thresholds", "0.5", "0.95"])
+    )
+
+    with open("metrics.json") as f:
+        metrics = json.load(f)
+
+    assert [
+        confidence_threshold["threshold"]
+        for confidence_threshold in metrics["confidence_thresholds"]
+    ] == [0.5, 0.95]
+
+
+def test_trainer_out_of_core(monkeypatch, tmp_path):
+    url = "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug.data_bugs.latest/artifacts/public/bugs.json"
+
+    responses.add(
+        responses.GET,
+        f"{url}.version",
+        status=200,
+        body=str(db.DATABASES[bugzilla.BUGS_DB]["version"]),
+    )
+
+    responses.add(
+        responses.HEAD,
+        f"{url}.zst",
+        status=200,
+        headers={"ETag": "etag"},
+    )
+
+    out_of_core_dir = tmp_path / "out_of_core"
+    monkeypatch.setattr(out_of_core, "OUT_OF_CORE_DIR", str(out_of_core_dir))
+    monkeypatch.setattr(out_of_core, "OUT_OF_CORE_CHUNK_SIZE", 7)
+
+    trainer.Trainer().go(trainer.parse_args(["regression", "--out-of-core"]))
+
+    model = RegressionModel.load("regressionmodel")
+    assert model.clf.named_steps["estimator"].n_features_in_ > 0
+    assert list(out_of_core_dir.iterdir()) == []
@@ -3,17 +3,22 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
 import json
+import math
 import os
 import pickle
 from datetime import datetime
 
+import hypothesis
+import hypothesis.strategies as st
 import numpy as np
 import pandas as pd
 import pytest
 import requests
 import responses
 import urllib3
+import zstandard
 from sklearn.compose import ColumnTransformer
 from sklearn.feature_extraction.text import CountVectorizer
 
@@ -97,6 +102,76 @@ def test_exp_queue():
     assert q[12] == 1
 
 
+@hypothesis.given(
+    st.integers(min_value=0, max_value=100),
+    st.integers(min_value=1, max_value=10),
+    st.integers(min_value=0, max_value=3),
+    st.lists(st.integers(min_value=0, max_value=30), max_size=20),
+)
+def test_array_exp_queue(start_day, maxlen, default, day_increments):
+    q = utils.ExpQueue(start_day, maxlen, default)
+    aq = utils.ArrayExpQueue(start_day, maxlen, default)
+
+    def assert_same():
+        assert aq.start_day == q.start_day
+        assert aq.last_day == q.last_day
+        for day in range(max(q.start_day, -2), q.last_day + 5):
+            assert aq[day] == q[day]
+
+    day = start_day
+    for increment in day_increments:
+        day += increment
+        q[day] = q[day] + 1
+        aq[day] = aq[day] + 1
+        assert_same()
+
+    aq2 = copy.deepcopy(aq)
+    aq2[day + 1] = aq2[day] + 1
+    assert aq[day + 1] == q[day + 1]
+
+    aq = utils.ArrayExpQueue.from_bytes(aq.to_bytes())
+    assert_same()
+    aq = pickle.loads(pickle.dumps(aq))
+    assert_same()
+    aq = utils.ArrayExpQueue.from_exp_queue(q)
+    assert_same()
+
+
+@hypothesis.given(
+    st.integers(min_value=0, max_value=100),
+    st.integers(min_value=1, max_value=10),
+    st.lists(st.integers(min_value=0, max_value=30), max_size=20),
+)
+def test_commit_list_exp_queue(start_day, maxlen, day_increments):
+    q = utils.ExpQueue(start_day, maxlen, tuple())
+    cq = utils.CommitListExpQueue(start_day, maxlen)
+
+    def assert_same(cq):
+        for day in range(max(q.start_day, -2), q.last_day + 5):
+            assert cq.get_ids(0, cq[day]).tolist() == list(q[day])
+
+    day = start_day
+    for commit_id, increment in enumerate(day_increments):
+        day += increment
+        q[day] = q[day] + (commit_id,)
+        cq.set(day, cq[day], commit_id)
+        assert_same(cq)
+
+    cq2 = copy.deepcopy(cq)
+    cq2.set(day + 1, cq2[day], len(day_increments))
+    assert_same(cq)
+
+    assert_same(pickle.loads(pickle.dumps(cq)))
+    assert_same(utils.CommitListExpQueue.from_exp_queue(q, {}))
+
+
+def test_array_exp_queue_from_bytes_offset():
+    q = utils.ArrayExpQueue(0, 1, 42)
+    q2 = utils.ArrayExpQueue.from_bytes(b"xx" + q.to_bytes(), 2)
+    assert q2[0] == 42
+    assert q2.default == 42
+
+
 def test_download_check_etag():
     url = "https://community-tc.services.mozilla.com/api/index/v1/task/project.bugbug/prova.txt"
 
@@ -335,6 +410,61 @@ def test_zstd_compress_decompress(tmp_path):
     assert file_decomp == {"Hello": "World"}
 
 
+def test_zstd_compress_decompress_seekable(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "ZSTD_FRAME_SIZE", 1000)
+
+    path = tmp_path / "prova"
+    content = b"".join(b"%d\n" % i for i in range(10000))
+
+    with open(path, "wb") as f:
+        f.write(content)
+
+    utils.zstd_compress(path)
+    os.remove(path)
+
+    with open(f"{path}.zst", "rb") as f:
+        frames = utils.read_zstd_seek_table(f)
+
+        assert len(frames) == math.ceil(len(content) / 1000)
+        assert sum(size for _, _, size in frames) == len(content)
+
+    # The seekable file is still a regular zstd file.
+    with open(f"{path}.zst", "rb") as f:
+        dctx = zstandard.ZstdDecompressor()
+        with dctx.stream_reader(f, read_across_frames=True) as reader:
+            assert reader.read() == content
+
+    utils.zstd_decompress(path)
+
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+
+def test_zstd_seekable_writer_append(tmp_path, monkeypatch, mock_zst):
+    monkeypatch.setattr(utils, "ZSTD_FRAME_SIZE", 100)
+
+    path = tmp_path / "prova.zst"
+
+    for mode, start in (("wb", 0), ("ab", 500)):
+        with open(path, mode) as f:
+            writer = utils.ZstdSeekableWriter(f)
+            for i in range(start, start + 500):
+                writer.write(b"%d\n" % i)
+            writer.close()
+
+    with open(path, "rb") as f:
+        frames = utils.read_zstd_seek_table(f)
+        # Frames are only ended between writes.
+        chunks = list(utils.iter_zstd_seekable(f, frames, threads=4))
+        assert all(chunk.endswith(b"\n") for chunk in chunks)
+        assert b"".join(chunks) == b"".join(b"%d\n" % i for i in range(1000))
+
+    mock_zst(path)
+
+    with open(path, "rb") as f:
+        assert utils.read_zstd_seek_table(f) is None
+
+
 def test_zstd_compress_not_existing(tmp_path, mock_zst):
     path = tmp_path / "prova"
     compressed_path = path.with_suffix(".zst")